@@ -21,7 +21,8 @@ CREATE TABLE `groups` (
 -- Таблица студентов (ОБНОВЛЕНА: добавлена роль)
 CREATE TABLE students (
     id CHAR(36) PRIMARY KEY,
-    telegram_user_id BIGINT UNIQUE NOT NULL,
+    -- NULL у импортированных из списка деканата, пока они не зашли в бота
+    telegram_user_id BIGINT UNIQUE,
     student_id VARCHAR(20) UNIQUE NOT NULL,
     last_name VARCHAR(50) NOT NULL,
     first_name VARCHAR(50) NOT NULL,
@@ -51,6 +52,8 @@ CREATE TABLE balances (
     current_points BIGINT NOT NULL DEFAULT 0,
     total_earned BIGINT NOT NULL DEFAULT 0,
     total_spent BIGINT NOT NULL DEFAULT 0,
+    -- Зарезервировано под ставки-лидеры на аукционах: тратить можно current_points - held_points
+    held_points BIGINT NOT NULL DEFAULT 0,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
 );
@@ -69,12 +72,25 @@ CREATE TABLE transactions (
     FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
 );
 
+-- Дневные итоги по транзакциям (для графика статистики).
+-- Обновляются в той же транзакции, что и вставка в transactions.
+CREATE TABLE daily_totals (
+    student_id CHAR(36) NOT NULL,
+    day DATE NOT NULL,
+    type VARCHAR(20) NOT NULL,
+    total BIGINT NOT NULL DEFAULT 0,
+    tx_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, day, type),
+    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+);
+
 -- Рейтинг
 CREATE TABLE ranking (
     student_id CHAR(36) PRIMARY KEY,
     score BIGINT NOT NULL,
     position INT NOT NULL,
     calculated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    stale BOOLEAN NOT NULL DEFAULT FALSE,
     FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
 );
 
@@ -137,6 +153,9 @@ CREATE TABLE services (
     points_cost INT NOT NULL,
     description TEXT,
     active BOOLEAN DEFAULT TRUE,
+    -- open -> in_progress -> completed; при отмене заказа снова open
+    status VARCHAR(20) NOT NULL DEFAULT 'open',
+    version INT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (provider_id) REFERENCES students(id) ON DELETE CASCADE
@@ -147,7 +166,9 @@ CREATE TABLE service_orders (
     id CHAR(36) PRIMARY KEY,
     service_id CHAR(36) NOT NULL,
     buyer_id CHAR(36) NOT NULL,
-    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    -- in_progress -> completed | cancelled
+    status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+    version INT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (service_id) REFERENCES services(id) ON DELETE CASCADE,
     FOREIGN KEY (buyer_id) REFERENCES students(id) ON DELETE CASCADE
@@ -160,9 +181,13 @@ CREATE TABLE auctions (
     merch_id CHAR(36) NOT NULL,
     start_price INT NOT NULL,
     current_bid INT DEFAULT 0,
+    min_increment INT NOT NULL DEFAULT 1,
     end_time TIMESTAMP NOT NULL,
     status VARCHAR(20) NOT NULL DEFAULT 'open',
+    -- Лидер торгов (его ставка current_bid удержана в held_points); после закрытия - победитель
     winner_id CHAR(36),
+    -- Единица товара снята со stock при создании аукциона; без победителя возвращается
+    stock_reserved BOOLEAN NOT NULL DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
     FOREIGN KEY (merch_id) REFERENCES merch(id) ON DELETE CASCADE,
@@ -180,5 +205,64 @@ CREATE TABLE bids (
     FOREIGN KEY (bidder_id) REFERENCES students(id) ON DELETE CASCADE
 );
 
+-- Исходящие события для SSE (outbox): пишутся в транзакции операции,
+-- процессы webapp раздают их подписчикам и удаляют старые
+CREATE TABLE events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Заработанные баллы студента за окно (неделя/месяц/семестр). Растет
+-- инкрементально при каждом начислении; faculty_id/group_id скопированы
+-- из students, чтобы топ факультета и группы читался по своему индексу.
+-- position_* пересчитываются пакетно (compact_leaderboards), там же
+-- удаляются истекшие окна
+CREATE TABLE leaderboard_windows (
+    window_type VARCHAR(10) NOT NULL,
+    window_start DATE NOT NULL,
+    student_id CHAR(36) NOT NULL,
+    faculty_id INT,
+    group_id INT,
+    points BIGINT NOT NULL DEFAULT 0,
+    position_global INT NOT NULL DEFAULT 0,
+    position_faculty INT NOT NULL DEFAULT 0,
+    position_group INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (window_type, window_start, student_id),
+    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+);
+
 CREATE INDEX idx_transactions_student_time ON transactions(student_id, created_at);
-CREATE INDEX idx_transactions_status ON transactions(status);
\ No newline at end of file
+CREATE INDEX idx_transactions_status ON transactions(status);
+
+-- Фильтры истории по типу операции / типу сущности без потери keyset-поиска
+CREATE INDEX idx_transactions_student_type_time ON transactions(student_id, type, created_at);
+CREATE INDEX idx_transactions_student_entity_time ON transactions(student_id, entity_type, created_at);
+
+-- Топ-N рейтинга читается по индексу, место студента - по первичному ключу
+CREATE INDEX idx_ranking_score ON ranking(score DESC, student_id);
+
+-- Топ-N окна - в целом, по факультету и по группе
+CREATE INDEX idx_lb_global ON leaderboard_windows(window_type, window_start, points DESC, student_id);
+CREATE INDEX idx_lb_faculty ON leaderboard_windows(window_type, window_start, faculty_id, points DESC, student_id);
+CREATE INDEX idx_lb_group ON leaderboard_windows(window_type, window_start, group_id, points DESC, student_id);
+
+-- Активный заказ услуги ищется по service_id и статусу
+CREATE INDEX idx_service_orders_service_status ON service_orders(service_id, status);
+
+-- Открытые аукционы по времени окончания, ставки аукциона по порядку
+CREATE INDEX idx_auctions_status_end ON auctions(status, end_time);
+CREATE INDEX idx_bids_auction_time ON bids(auction_id, created_at);
+
+-- Очистка outbox событий по возрасту
+CREATE INDEX idx_events_created ON events(created_at);
+
+-- Примененные миграции (migrations/*.sql, python project/manage.py migrate).
+-- Эта схема уже содержит их все
+CREATE TABLE schema_migrations (
+    name VARCHAR(100) PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO schema_migrations (name) VALUES ('001_backlog_schema');
+INSERT INTO schema_migrations (name) VALUES ('002_ranking_stale');
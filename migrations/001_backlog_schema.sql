@@ -0,0 +1,85 @@
+-- Перевод базы, созданной по исходному diplom.sql, на текущую схему.
+-- Применяется командой: python project/manage.py migrate
+-- (новая база из diplom.sql уже отмечена как мигрированная).
+
+-- Импорт из списка деканата: студент без Telegram ID
+ALTER TABLE students MODIFY telegram_user_id BIGINT NULL;
+
+-- Удержания под ставки-лидеры на аукционах
+ALTER TABLE balances ADD COLUMN held_points BIGINT NOT NULL DEFAULT 0 AFTER total_spent;
+
+CREATE TABLE daily_totals (
+    student_id CHAR(36) NOT NULL,
+    day DATE NOT NULL,
+    type VARCHAR(20) NOT NULL,
+    total BIGINT NOT NULL DEFAULT 0,
+    tx_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, day, type),
+    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+);
+
+-- Статус услуги хранится в самой услуге; версия - для условных переходов
+ALTER TABLE services
+    ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'open' AFTER active,
+    ADD COLUMN version INT NOT NULL DEFAULT 0 AFTER status;
+ALTER TABLE service_orders
+    MODIFY status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+    ADD COLUMN version INT NOT NULL DEFAULT 0 AFTER status;
+
+-- 'pending' старого кода - это взятая в работу задача
+UPDATE service_orders SET status = 'in_progress' WHERE status = 'pending';
+
+-- Без этого все уже взятые и выполненные услуги стали бы 'open'
+UPDATE services s SET s.status = CASE
+    WHEN EXISTS (SELECT 1 FROM service_orders o WHERE o.service_id = s.id AND o.status = 'completed')
+        THEN 'completed'
+    WHEN EXISTS (SELECT 1 FROM service_orders o WHERE o.service_id = s.id AND o.status = 'in_progress')
+        THEN 'in_progress'
+    ELSE 'open'
+END;
+
+-- Существующие аукционы товар не резервировали: спишут его при закрытии
+ALTER TABLE auctions
+    ADD COLUMN min_increment INT NOT NULL DEFAULT 1 AFTER current_bid,
+    ADD COLUMN stock_reserved BOOLEAN NOT NULL DEFAULT FALSE AFTER winner_id;
+
+-- Ставки текущих лидеров открытых аукционов удерживаются, как у новых
+UPDATE balances b
+JOIN (
+    SELECT winner_id, SUM(current_bid) AS held FROM auctions
+    WHERE status = 'open' AND winner_id IS NOT NULL
+    GROUP BY winner_id
+) a ON a.winner_id = b.student_id
+SET b.held_points = a.held;
+
+CREATE TABLE events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    telegram_user_id BIGINT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE leaderboard_windows (
+    window_type VARCHAR(10) NOT NULL,
+    window_start DATE NOT NULL,
+    student_id CHAR(36) NOT NULL,
+    faculty_id INT,
+    group_id INT,
+    points BIGINT NOT NULL DEFAULT 0,
+    position_global INT NOT NULL DEFAULT 0,
+    position_faculty INT NOT NULL DEFAULT 0,
+    position_group INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (window_type, window_start, student_id),
+    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_transactions_student_type_time ON transactions(student_id, type, created_at);
+CREATE INDEX idx_transactions_student_entity_time ON transactions(student_id, entity_type, created_at);
+CREATE INDEX idx_ranking_score ON ranking(score DESC, student_id);
+CREATE INDEX idx_lb_global ON leaderboard_windows(window_type, window_start, points DESC, student_id);
+CREATE INDEX idx_lb_faculty ON leaderboard_windows(window_type, window_start, faculty_id, points DESC, student_id);
+CREATE INDEX idx_lb_group ON leaderboard_windows(window_type, window_start, group_id, points DESC, student_id);
+CREATE INDEX idx_service_orders_service_status ON service_orders(service_id, status);
+CREATE INDEX idx_auctions_status_end ON auctions(status, end_time);
+CREATE INDEX idx_bids_auction_time ON bids(auction_id, created_at);
+CREATE INDEX idx_events_created ON events(created_at);
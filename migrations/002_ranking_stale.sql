@@ -0,0 +1,5 @@
+-- Место в ranking больше не обнуляется при изменении баланса:
+-- остается последнее посчитанное, а stale отмечает, что score с тех пор менялся
+ALTER TABLE ranking ADD COLUMN stale BOOLEAN NOT NULL DEFAULT FALSE;
+
+UPDATE ranking SET stale = TRUE WHERE position = 0;
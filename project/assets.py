@@ -0,0 +1,75 @@
+# assets.py
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli  # есть в requirements.txt; если не установилась - отдаем только gzip
+except ImportError:
+    brotli = None
+
+# Хэшированные ассеты не меняются никогда: новое содержимое - новое имя
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+CONTENT_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+
+
+class Asset:
+    """Готовый ответ: тело в нескольких кодировках и strong ETag"""
+
+    def __init__(self, body, content_type):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.encodings = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(body, quality=11)
+
+    def pick(self, accept_encodings):
+        """(кодировка, тело) для заголовка Accept-Encoding; сжатое - только если оно меньше"""
+        for encoding in ("br", "gzip"):
+            body = self.encodings.get(encoding)
+            if body is not None and encoding in accept_encodings \
+                    and len(body) < len(self.encodings["identity"]):
+                return encoding, body
+        return "identity", self.encodings["identity"]
+
+    def etag(self, encoding):
+        """Strong ETag у каждой кодировки свой: байты ответа разные"""
+        return self.digest[:16] if encoding == "identity" else f"{self.digest[:16]}-{encoding}"
+
+
+class AssetBundle:
+    """
+    Оболочка мини-аппа и ее статика, собранные один раз при старте.
+
+    CSS/JS из static_dir получают имена с хэшем содержимого
+    (app.css -> app.3f2a9c1b7e4d.css) и отдаются с immutable-кэшем.
+    Шаблон оболочки рендерится один раз, ссылки на ассеты в нем
+    подставляет asset('app.css').
+    """
+
+    def __init__(self, static_dir, url_prefix="/static/"):
+        self.url_prefix = url_prefix
+        self.files = {}   # хэшированное имя -> Asset
+        self.urls = {}    # исходное имя -> URL с хэшем
+        for name in sorted(os.listdir(static_dir)):
+            root, ext = os.path.splitext(name)
+            if ext not in CONTENT_TYPES:
+                continue
+            with open(os.path.join(static_dir, name), "rb") as f:
+                asset = Asset(f.read(), CONTENT_TYPES[ext])
+            hashed = f"{root}.{asset.digest[:12]}{ext}"
+            self.files[hashed] = asset
+            self.urls[name] = url_prefix + hashed
+
+    def url(self, name):
+        return self.urls[name]
+
+    def render_page(self, jinja_env, template_name, **context):
+        """Рендерит шаблон один раз и возвращает готовый Asset страницы"""
+        html = jinja_env.get_template(template_name).render(asset=self.url, **context)
+        return Asset(html.encode("utf-8"), CONTENT_TYPES[".html"])
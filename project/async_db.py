@@ -0,0 +1,69 @@
+# async_db.py
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from db import db
+
+
+class DatabaseTimeout(Exception):
+    """Запрос к БД не уложился в отведенное время"""
+
+
+class AsyncDatabase:
+    """
+    Асинхронный фасад над Database для хендлеров aiogram.
+
+    Синхронные методы выполняются в ограниченном пуле потоков, каждый вызов -
+    в своем unit of work, так что медленный запрос одного пользователя
+    не блокирует event loop и обработку апдейтов остальных.
+
+        ok, msg = await adb.buy_merch(user_id, merch_id)
+    """
+
+    def __init__(self, database, max_workers=None, timeout=None):
+        self._db = database
+        # Больше потоков, чем соединений в пуле, все равно будут ждать пул
+        self.max_workers = max_workers or database.pool.max_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="db"
+        )
+
+    async def call(self, fn, *args, timeout=None, unit_of_work=True, **kwargs):
+        """
+        Выполняет fn(*args, **kwargs) в пуле потоков с таймаутом.
+        unit_of_work=False - для методов, которые сами коммитят по частям.
+        """
+        loop = asyncio.get_running_loop()
+        if unit_of_work:
+            job = functools.partial(self._db.run_in_transaction, fn, *args, **kwargs)
+        else:
+            job = functools.partial(fn, *args, **kwargs)
+        limit = timeout if timeout is not None else self.timeout
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, job), limit)
+        except asyncio.TimeoutError:
+            # Сам запрос в потоке доработает, но хендлер дальше не ждет
+            raise DatabaseTimeout(f"{getattr(fn, '__name__', fn)}: нет ответа за {limit} с")
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.call(attr, *args, **kwargs)
+        return method
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+adb = AsyncDatabase(
+    db,
+    max_workers=int(os.getenv("DB_EXECUTOR_WORKERS", "0")) or None,
+    timeout=float(os.getenv("DB_CALL_TIMEOUT", "10")),
+)
@@ -0,0 +1,280 @@
+# auctions.py
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class AuctionState:
+    """Текущее состояние торгов: то, что нужно для чтения и быстрой проверки ставки"""
+
+    __slots__ = ("id", "merch_id", "merch_name", "seller_id", "start_price", "current_bid",
+                 "min_increment", "leader_id", "end_time", "status", "bids", "loaded_at")
+
+    def __init__(self, row):
+        for name in self.__slots__[:-1]:
+            setattr(self, name, row.get(name))
+        self.bids = self.bids or 0
+        self.loaded_at = time.monotonic()
+
+    def min_bid(self):
+        """Минимальная ставка, которая сейчас может пройти"""
+        return self.current_bid + self.min_increment if self.leader_id else self.start_price
+
+    def is_open(self, now=None):
+        return self.status == 'open' and self.end_time > (now or datetime.now())
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "merch_id": self.merch_id,
+            "merch_name": self.merch_name,
+            "start_price": self.start_price,
+            "current_bid": self.current_bid,
+            "min_bid": self.min_bid(),
+            "min_increment": self.min_increment,
+            "has_bids": self.leader_id is not None,
+            "bids": self.bids,
+            "end_time": self.end_time.isoformat(sep=' ') if self.end_time else None,
+            "status": self.status,
+        }
+
+
+class AuctionBook:
+    """
+    Состояния аукционов в памяти процесса и блокировка на каждый аукцион.
+
+    Чтение текущей ставки не ходит в БД: состояние обновляется после
+    коммита каждой ставки этого процесса, а ставки других процессов
+    (второй воркер, бот) подхватываются по истечении ttl. Ставка ниже
+    min_bid() отбивается прямо по памяти: пока аукцион открыт, ставка
+    только растет, поэтому устаревшее состояние может пропустить лишнюю
+    ставку в БД, но не отбить проходную.
+
+    lock(auction_id) выстраивает ставки на один аукцион в очередь внутри
+    процесса, не трогая остальные аукционы: в БД они приходят по одной и
+    не толпятся на блокировке строки.
+
+    on_extend(auction_id, end_time) вызывается, когда ставка продлила
+    торги: так AuctionScheduler переносит срок в куче сразу, а не при
+    попытке закрыть аукцион в старый срок.
+    """
+
+    def __init__(self, loader, ttl=1.0):
+        self._loader = loader
+        self.ttl = ttl
+        self.on_extend = None
+        self._states = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, auction_id):
+        """AuctionState или None, если аукциона нет"""
+        with self._lock:
+            state = self._states.get(auction_id)
+            if state and time.monotonic() - state.loaded_at < self.ttl:
+                self.hits += 1
+                return state
+        row = self._loader(auction_id)
+        with self._lock:
+            self.loads += 1
+            if not row:
+                self._states.pop(auction_id, None)
+                return None
+            state = self._states[auction_id] = AuctionState(row)
+            return state
+
+    def lock(self, auction_id):
+        with self._lock:
+            lock = self._locks.get(auction_id)
+            if lock is None:
+                lock = self._locks[auction_id] = threading.Lock()
+            return lock
+
+    def record_bid(self, auction_id, amount, leader_id, end_time=None):
+        """Принятая и закоммиченная ставка; end_time - если торги продлены"""
+        with self._lock:
+            state = self._states.get(auction_id)
+            if state and amount > state.current_bid:
+                state.current_bid = amount
+                state.leader_id = leader_id
+                state.bids += 1
+                if end_time:
+                    state.end_time = end_time
+        if end_time and self.on_extend:
+            self.on_extend(auction_id, end_time)
+
+    def invalidate(self, auction_id):
+        with self._lock:
+            self._states.pop(auction_id, None)
+
+    def forget(self, auction_id):
+        """Аукцион закрыт: состояние и блокировка больше не нужны"""
+        with self._lock:
+            self._states.pop(auction_id, None)
+            self._locks.pop(auction_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._states), "hits": self.hits, "loads": self.loads}
+
+
+# ==========================
+# ЗАКРЫТИЕ ПО ВРЕМЕНИ
+# ==========================
+
+class SystemClock:
+    def now(self):
+        return datetime.now()
+
+    def wait(self, event, seconds):
+        return event.wait(seconds)
+
+
+class ManualClock:
+    """Время, которое двигают руками: тысячи закрытий прогоняются за секунды"""
+
+    def __init__(self, start=None):
+        self._now = start or datetime.now()
+
+    def now(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += timedelta(seconds=seconds)
+        return self._now
+
+    def wait(self, event, seconds):
+        return event.is_set()
+
+
+class AuctionScheduler:
+    """
+    Закрывает аукционы в их end_time.
+
+    Открытые аукционы лежат в куче по end_time: поток спит до ближайшего
+    срока, а не опрашивает таблицу. Просроченные закрываются пачками по
+    batch_size через db.close_auctions - она перепроверяет каждый аукцион
+    под блокировкой и возвращает продленные (антиснайпинг), они ложатся
+    в кучу с новым сроком.
+
+    Состояние - только в БД: при старте load() берет все открытые, включая
+    просроченные, пока процесс лежал, и они закрываются первыми. Пачка
+    закрывается одной транзакцией, поэтому падение посреди нее ничего не
+    списывает, а повторное закрытие не проходит проверку status = 'open'.
+    Аукционы, созданные другими процессами, подхватываются раз в reload_every.
+    """
+
+    def __init__(self, db, clock=None, batch_size=100, reload_every=30.0, max_sleep=5.0):
+        self.db = db
+        self.clock = clock or SystemClock()
+        self.batch_size = batch_size
+        self.reload_every = reload_every
+        self.max_sleep = max_sleep
+        self._heap = []        # (end_time, auction_id)
+        self._deadlines = {}   # auction_id -> актуальный end_time; в куче бывают устаревшие
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._loaded_at = None
+        self.closed = 0
+        self.settled = 0
+        self.extended = 0
+
+    def load(self):
+        """Все открытые аукционы из БД; уже известные обновляют срок"""
+        for auction_id, end_time in self.db.get_open_auction_deadlines():
+            self.schedule(auction_id, end_time)
+        self._loaded_at = time.monotonic()
+
+    def schedule(self, auction_id, end_time):
+        with self._lock:
+            if self._deadlines.get(auction_id) == end_time:
+                return
+            self._deadlines[auction_id] = end_time
+            heapq.heappush(self._heap, (end_time, auction_id))
+        self._wake.set()
+
+    def next_deadline(self):
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while len(due) < self.batch_size:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, auction_id = heapq.heappop(self._heap)
+                del self._deadlines[auction_id]
+                due.append(auction_id)
+        return due
+
+    def run_due(self):
+        """Закрывает все просроченные на clock.now(); возвращает число закрытых"""
+        total = 0
+        now = self.clock.now()
+        while True:
+            due = self._pop_due(now)
+            if not due:
+                return total
+            try:
+                report = self.db.close_auctions(due, now)
+            except Exception as e:
+                print(f"[TASK ERROR] auction_scheduler: {e}")
+                report = None
+            if report is None:
+                # БД недоступна - вернем в кучу и повторим через max_sleep
+                retry_at = now + timedelta(seconds=self.max_sleep)
+                for auction_id in due:
+                    self.schedule(auction_id, retry_at)
+                return total
+            for auction_id, end_time in report['extended'].items():
+                self.schedule(auction_id, end_time)
+            self.closed += report['closed']
+            self.settled += report['settled']
+            self.extended += len(report['extended'])
+            total += report['closed']
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="auction_scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_every:
+                    self.load()
+                self.run_due()
+            except Exception as e:
+                print(f"[TASK ERROR] auction_scheduler: {e}")
+            # schedule() после этой точки разбудит поток раньше срока
+            self._wake.clear()
+            deadline = self.next_deadline()
+            sleep = self.max_sleep
+            if deadline is not None:
+                sleep = min(sleep, max((deadline - self.clock.now()).total_seconds(), 0.0))
+            self.clock.wait(self._wake, sleep)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._deadlines)
+        return {"pending": pending, "closed": self.closed, "settled": self.settled, "extended": self.extended}
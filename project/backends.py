@@ -0,0 +1,356 @@
+# backends.py
+import functools
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "diplom.sql")
+
+# NEW(колонка) в выражениях upsert - значение из вставляемой строки
+_NEW_RE = re.compile(r"NEW\((\w+)\)")
+
+
+class Backend:
+    """
+    Подключение к БД и диалект SQL.
+
+    Запросы в db.py пишутся с плейсхолдером %s и общим для MySQL и SQLite
+    синтаксисом, а то, что различается, берется у бэкенда:
+    upsert(), update_join(), for_update, date_format(). Соединения, которые отдает
+    connect(), ведут себя как соединения mysql-connector
+    (cursor(dictionary=True), commit/rollback, is_connected).
+    """
+
+    name = None
+    Error = Exception
+    for_update = ""
+
+    def connect(self):
+        raise NotImplementedError
+
+    def is_deadlock(self, err):
+        """Ошибка, после которой транзакцию стоит повторить целиком"""
+        return False
+
+    def is_transient(self, err):
+        """Ошибка не из-за данных (дедлок, обрыв связи): ту же операцию можно повторить позже"""
+        return self.is_deadlock(err)
+
+    def pool_limits(self, min_size, max_size):
+        return min_size, max_size
+
+    def begin_unit_of_work(self, conn):
+        """Начало транзакции unit of work; MySQL начинает ее сам с первым запросом"""
+
+    def upsert(self, keys, updates=None):
+        """
+        Хвост INSERT: вставка или обновление по уникальному ключу keys.
+        updates - {колонка: выражение}, в выражении NEW(col) - вставляемое значение.
+        updates=None - при конфликте ничего не менять.
+        """
+        raise NotImplementedError
+
+    def update_join(self, table, alias, source, on, sets):
+        """
+        UPDATE table строками source (подзапрос с псевдонимом) по условию on.
+        sets - {колонка table: выражение}.
+        """
+        raise NotImplementedError
+
+    def date_format(self, expr, fmt):
+        """Дата/время как строка; fmt в кодах strftime (%d %m %Y %H %M %S)"""
+        raise NotImplementedError
+
+    def drop_index(self, name, table):
+        raise NotImplementedError
+
+    def bulk_load_statements(self, enable):
+        """Настройки соединения на время массовой загрузки (enable=True) и возврат к обычным"""
+        return []
+
+
+class MySQLBackend(Backend):
+    name = "mysql"
+    for_update = " FOR UPDATE"
+
+    # MySQL: "Deadlock found when trying to get lock; try restarting transaction"
+    DEADLOCK_ERRNO = 1213
+    # Lock wait timeout, "server has gone away", "lost connection", "connection not available"
+    TRANSIENT_ERRNOS = (1205, 2006, 2013, 2055)
+
+    def __init__(self, host, user, password, database):
+        # Драйвер нужен только этому бэкенду
+        import mysql.connector
+        self._driver = mysql.connector
+        self.Error = mysql.connector.Error
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+
+    def connect(self):
+        return self._driver.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database
+        )
+
+    def is_deadlock(self, err):
+        return isinstance(err, self.Error) and err.errno == self.DEADLOCK_ERRNO
+
+    def is_transient(self, err):
+        errors = self._driver.errors
+        return self.is_deadlock(err) or isinstance(err, (errors.OperationalError, errors.InterfaceError)) or (
+            isinstance(err, self.Error) and err.errno in self.TRANSIENT_ERRNOS
+        )
+
+    def upsert(self, keys, updates=None):
+        updates = updates or {keys[0]: keys[0]}
+        sets = ", ".join(f"{col} = {expr}" for col, expr in updates.items())
+        return "ON DUPLICATE KEY UPDATE " + _NEW_RE.sub(r"VALUES(\1)", sets)
+
+    def update_join(self, table, alias, source, on, sets):
+        sets = ", ".join(f"{alias}.{col} = {expr}" for col, expr in sets.items())
+        return f"UPDATE {table} {alias} JOIN {source} ON {on} SET {sets}"
+
+    def date_format(self, expr, fmt):
+        return f"DATE_FORMAT({expr}, '{fmt.replace('%M', '%i')}')"
+
+    def drop_index(self, name, table):
+        return f"DROP INDEX {name} ON {table}"
+
+    def bulk_load_statements(self, enable):
+        flag = 0 if enable else 1
+        return [f"SET foreign_key_checks = {flag}", f"SET unique_checks = {flag}"]
+
+
+class SQLiteBackend(Backend):
+    """
+    Встроенная SQLite: файл или ":memory:". Схема создается из diplom.sql
+    (MySQL-специфичные конструкции переводятся на лету) при первом подключении
+    к пустой базе.
+
+    SQLite допускает одного писателя: транзакция, начатая с записи, и любой
+    unit of work сразу берут блокировку (BEGIN IMMEDIATE). Иначе unit of work,
+    начатый с SELECT, при первой записи повышал бы блокировку и получал
+    SQLITE_BUSY без ожидания busy_timeout. "database is locked" считается
+    поводом повторить транзакцию - как дедлок в MySQL. In-memory база живет
+    в единственном соединении, поэтому пул для нее - одно соединение.
+    """
+
+    name = "sqlite"
+    Error = sqlite3.Error
+
+    def __init__(self, path=":memory:", schema_path=SCHEMA_PATH, busy_timeout=5.0):
+        self.path = path
+        self.memory = path == ":memory:"
+        self.schema_path = schema_path
+        self.busy_timeout = busy_timeout
+        self._lock = threading.RLock()
+        self._shared = None
+        self._schema_ready = False
+
+    def pool_limits(self, min_size, max_size):
+        return (1, 1) if self.memory else (min_size, max_size)
+
+    def begin_unit_of_work(self, conn):
+        conn.begin_immediate()
+
+    def connect(self):
+        if self.memory:
+            with self._lock:
+                if self._shared is None:
+                    self._shared = self._open()
+                return SQLiteConnection(self._shared, keep_open=True)
+        return SQLiteConnection(self._open())
+
+    def _open(self):
+        raw = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,  # транзакциями управляет SQLiteConnection
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        raw.execute("PRAGMA foreign_keys = ON")
+        if not self.memory:
+            raw.execute("PRAGMA journal_mode = WAL")
+            raw.execute("PRAGMA synchronous = NORMAL")
+        self._ensure_schema(raw)
+        return raw
+
+    def _ensure_schema(self, raw):
+        with self._lock:
+            if self._schema_ready:
+                return
+            exists = raw.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students'"
+            ).fetchone()
+            if not exists:
+                with open(self.schema_path, encoding="utf-8") as f:
+                    raw.executescript(mysql_ddl_to_sqlite(f.read()))
+            self._schema_ready = True
+
+    def is_deadlock(self, err):
+        return isinstance(err, sqlite3.OperationalError) and (
+            "locked" in str(err) or "busy" in str(err)
+        )
+
+    def is_transient(self, err):
+        return self.is_deadlock(err) or isinstance(err, sqlite3.OperationalError) and (
+            "disk I/O" in str(err) or "unable to open" in str(err)
+        )
+
+    def upsert(self, keys, updates=None):
+        if not updates:
+            return "ON CONFLICT DO NOTHING"
+        sets = ", ".join(f"{col} = {expr}" for col, expr in updates.items())
+        return f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET " + _NEW_RE.sub(r"excluded.\1", sets)
+
+    def update_join(self, table, alias, source, on, sets):
+        sets = ", ".join(f"{col} = {expr}" for col, expr in sets.items())
+        return f"UPDATE {table} AS {alias} SET {sets} FROM {source} WHERE {on}"
+
+    def date_format(self, expr, fmt):
+        return f"strftime('{fmt}', {expr})"
+
+    def drop_index(self, name, table):
+        return f"DROP INDEX {name}"
+
+    def bulk_load_statements(self, enable):
+        if enable:
+            return ["PRAGMA foreign_keys = OFF", "PRAGMA synchronous = OFF"]
+        return ["PRAGMA foreign_keys = ON", "PRAGMA synchronous = NORMAL"]
+
+
+def mysql_ddl_to_sqlite(ddl):
+    """Переводит DDL из diplom.sql в диалект SQLite"""
+    ddl = re.sub(r"\b(?:BIG)?INT AUTO_INCREMENT PRIMARY KEY\b", "INTEGER PRIMARY KEY AUTOINCREMENT", ddl)
+    ddl = re.sub(r"\s+ON UPDATE CURRENT_TIMESTAMP\b", "", ddl)
+    ddl = re.sub(r"\bENUM\([^)]*\)", "VARCHAR(20)", ddl)
+    ddl = re.sub(r"\bUNIQUE KEY \w+ \(", "UNIQUE (", ddl)
+    return ddl
+
+
+@functools.lru_cache(maxsize=1024)
+def _to_qmark(sql):
+    """%s -> ? вне строковых литералов"""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    return "".join(p if i % 2 else p.replace("%s", "?") for i, p in enumerate(parts))
+
+
+class SQLiteConnection:
+    """sqlite3-соединение с интерфейсом mysql-connector, который ждет db.py"""
+
+    def __init__(self, raw, keep_open=False):
+        self._raw = raw
+        self._keep_open = keep_open
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self, self._raw.cursor(), dictionary)
+
+    def _begin(self, sql):
+        if not self._raw.in_transaction:
+            keyword = sql.lstrip()[:6].upper()
+            if keyword == "PRAGMA":
+                return  # часть PRAGMA внутри транзакции не действует
+            self._raw.execute("BEGIN" if keyword in ("SELECT", "WITH") else "BEGIN IMMEDIATE")
+
+    def begin_immediate(self):
+        if not self._raw.in_transaction:
+            self._raw.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        if self._raw.in_transaction:
+            self._raw.execute("COMMIT")
+
+    def rollback(self):
+        if self._raw.in_transaction:
+            self._raw.execute("ROLLBACK")
+
+    def is_connected(self):
+        try:
+            self._raw.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        if self._keep_open:
+            self.rollback()
+        else:
+            self._raw.close()
+
+
+class SQLiteCursor:
+    def __init__(self, conn, cur, dictionary):
+        self._conn = conn
+        self._cur = cur
+        self._dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        self._conn._begin(sql)
+        self._cur.execute(_to_qmark(sql), tuple(params or ()))
+
+    def executemany(self, sql, seq_params):
+        self._conn._begin(sql)
+        self._cur.executemany(_to_qmark(sql), [tuple(p) for p in seq_params])
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cur.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cur.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def close(self):
+        self._cur.close()
+
+
+# Даты хранятся текстом в формате CURRENT_TIMESTAMP, чтобы сравнения в
+# запросах (keyset-курсоры истории, периоды статистики) работали как строки
+sqlite3.register_adapter(datetime, lambda v: v.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()))
+
+
+def backend_from_env():
+    """DB_BACKEND=mysql (по умолчанию) или sqlite (SQLITE_PATH, по умолчанию :memory:)"""
+    kind = os.getenv("DB_BACKEND", "mysql").lower()
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("SQLITE_PATH", ":memory:"))
+    if kind != "mysql":
+        raise ValueError(f"Неизвестный DB_BACKEND: {kind}")
+    return MySQLBackend(
+        host=os.getenv("MYSQL_HOST", "127.0.0.1"),
+        user=os.getenv("MYSQL_USER", "root"),
+        password=os.getenv("MYSQL_PASSWORD", "password"),
+        database=os.getenv("MYSQL_DB", "store"),
+    )
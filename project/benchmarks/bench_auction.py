@@ -0,0 +1,97 @@
+# benchmarks/bench_auction.py
+"""
+Ставки на один горячий аукцион: сколько ставок в секунду проходит и
+проверка удержаний - баллы удержаны только у лидера и ровно на его
+ставку, доступный баланс ни у кого не ушел в минус.
+
+Каждая попытка читает текущую ставку из памяти и ставит min_bid плюс
+случайный шаг, как участник, который жмет "перебить" в мини-аппе.
+
+Нужна рабочая БД из .env (тестовые строки удаляются в конце); без MySQL -
+DB_BACKEND=sqlite SQLITE_PATH=bench.db, тот же прогон на встроенной SQLite:
+    python benchmarks/bench_auction.py --bids 2000 --bidders 200 --concurrency 64
+"""
+import argparse
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+
+from common import cleanup, query_all, query_one, run_concurrently, seed_merch, seed_students, summarize
+
+from db import db  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bidders", type=int, default=200)
+    parser.add_argument("--bids", type=int, default=2000, help="всего попыток ставки")
+    parser.add_argument("--points", type=int, default=100000, help="баллов у каждого участника")
+    parser.add_argument("--start-price", type=int, default=10)
+    parser.add_argument("--min-increment", type=int, default=5)
+    parser.add_argument("--max-step", type=int, default=20, help="сверх минимальной ставки")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--keep", action="store_true", help="не удалять тестовые данные")
+    args = parser.parse_args()
+
+    # Первый - проводящий аукцион, остальные торгуются
+    tg_ids = seed_students(db, args.bidders + 1, args.points)
+    merch_id = seed_merch(db, 1, args.start_price)
+    try:
+        ok, auction_id = db.create_auction(tg_ids[0], merch_id, args.start_price,
+                                           datetime.now() + timedelta(hours=1), args.min_increment)
+        if not ok:
+            print(f"[BENCH] аукцион не создан: {auction_id}")
+            return 1
+
+        def bid(tg_id):
+            state = db.get_auction(auction_id)
+            return db.place_bid(auction_id, tg_id, state["min_bid"] + random.randint(0, args.max_step))
+
+        jobs = [tg_ids[1 + i % args.bidders] for i in range(args.bids)]
+        results, latencies, elapsed = run_concurrently(bid, jobs, args.concurrency)
+
+        accepted = sum(1 for ok, _ in results if ok)
+        auction = query_all(db, "SELECT current_bid, winner_id FROM auctions WHERE id = %s", (auction_id,))[0]
+        bids = query_one(db, "SELECT COUNT(*) FROM bids WHERE auction_id = %s", (auction_id,))
+        top = query_one(db, "SELECT MAX(amount) FROM bids WHERE auction_id = %s", (auction_id,))
+        marks = ", ".join(["%s"] * len(tg_ids))
+        holders = query_all(db, f"""
+            SELECT b.student_id, b.held_points FROM balances b JOIN students s ON s.id = b.student_id
+            WHERE s.telegram_user_id IN ({marks}) AND b.held_points != 0
+        """, tuple(tg_ids))
+        negative = query_one(db, f"""
+            SELECT COUNT(*) FROM balances b JOIN students s ON s.id = b.student_id
+            WHERE s.telegram_user_id IN ({marks}) AND b.current_points - b.held_points < 0
+        """, tuple(tg_ids))
+
+        reasons = {}
+        for ok, message in results:
+            if not ok:
+                reasons[message.split(":")[0]] = reasons.get(message.split(":")[0], 0) + 1
+
+        report = summarize(latencies, elapsed)
+        report.update({
+            "accepted": accepted,
+            "rejected": len(results) - accepted,
+            "rejected_by_reason": reasons,
+            "accepted_bids_per_sec": round(accepted / elapsed, 1) if elapsed else None,
+            "final_bid": auction[0],
+            "bids_rows": bids,
+            "holders": len(holders),
+            "negative_available": negative,
+            "memory_state": db.get_auction(auction_id),
+        })
+        consistent = (bids == accepted and top == auction[0] and negative == 0
+                      and len(holders) == 1 and str(holders[0][0]) == str(auction[1])
+                      and holders[0][1] == auction[0])
+        report["holds_consistent"] = consistent
+        print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+        return 0 if consistent else 1
+    finally:
+        if not args.keep:
+            cleanup(db, tg_ids, [merch_id])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
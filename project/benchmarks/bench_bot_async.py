@@ -0,0 +1,89 @@
+# benchmarks/bench_bot_async.py
+"""
+Пропускная способность обработки апдейтов бота при N одновременных
+пользователях: синхронные вызовы БД прямо в event loop против AsyncDatabase.
+
+БД имитируется задержкой (MySQL не нужен):
+    python benchmarks/bench_bot_async.py --users 10 100 500 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_db import AsyncDatabase  # noqa: E402
+
+
+class _Pool:
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+
+class SlowDatabase:
+    """Подмена Database: каждый запрос занимает latency секунд"""
+
+    def __init__(self, latency, pool_size):
+        self.latency = latency
+        self.pool = _Pool(pool_size)
+
+    def run_in_transaction(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def get_or_create_student(self, telegram_id, **kwargs):
+        time.sleep(self.latency)
+        return True
+
+
+async def _heartbeat(stop, lags):
+    """Мерит, насколько event loop опаздывает с обработкой таймера"""
+    interval = 0.005
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def _run(users, handler):
+    stop, lags = asyncio.Event(), []
+    beat = asyncio.create_task(_heartbeat(stop, lags))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(uid) for uid in range(users)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    return users / elapsed, max(lags) if lags else 0.0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--latency", type=float, default=0.02, help="время одного запроса к БД, с")
+    parser.add_argument("--pool", type=int, default=10, help="размер пула соединений / потоков")
+    args = parser.parse_args()
+
+    fake = SlowDatabase(args.latency, args.pool)
+    facade = AsyncDatabase(fake, timeout=30)
+
+    async def blocking_start(uid):
+        fake.get_or_create_student(telegram_id=uid)
+        await asyncio.sleep(0)  # message.answer
+
+    async def async_start(uid):
+        await facade.get_or_create_student(telegram_id=uid)
+        await asyncio.sleep(0)
+
+    print(f"latency={args.latency * 1000:.0f} ms, pool={args.pool}")
+    print(f"{'users':>6} | {'mode':>8} | {'updates/s':>10} | {'max loop stall, ms':>18}")
+    for users in args.users:
+        for name, handler in (("blocking", blocking_start), ("executor", async_start)):
+            rate, stall = await _run(users, handler)
+            print(f"{users:>6} | {name:>8} | {rate:>10.1f} | {stall * 1000:>18.1f}")
+    facade.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+# benchmarks/bench_buy_merch.py
+"""
+Конкурентные покупки одного товара: пропускная способность, p99 и проверка,
+что товар не продан сверх остатка, а балансы не ушли в минус.
+
+Нужна рабочая БД из .env (тестовые строки удаляются в конце); без MySQL -
+DB_BACKEND=sqlite SQLITE_PATH=bench.db, тот же прогон на встроенной SQLite:
+    python benchmarks/bench_buy_merch.py --buys 500 --stock 100 --concurrency 64
+"""
+import argparse
+import json
+import sys
+
+from common import cleanup, query_one, run_concurrently, seed_merch, seed_students, summarize
+
+from db import db  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--buyers", type=int, default=200)
+    parser.add_argument("--buys", type=int, default=500, help="всего попыток покупки")
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--price", type=int, default=10)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--keep", action="store_true", help="не удалять тестовые данные")
+    args = parser.parse_args()
+
+    # Денег хватает на 3 покупки: часть отказов будет из-за баланса, часть - из-за остатка
+    budget = args.price * args.quantity * 3
+    tg_ids = seed_students(db, args.buyers, budget)
+    merch_id = seed_merch(db, args.stock, args.price)
+    try:
+        jobs = [tg_ids[i % len(tg_ids)] for i in range(args.buys)]
+        results, latencies, elapsed = run_concurrently(
+            lambda tg_id: db.run_in_transaction(db.buy_merch, tg_id, merch_id, args.quantity),
+            jobs, args.concurrency,
+        )
+
+        sold = sum(args.quantity for ok, _ in results if ok)
+        final_stock = query_one(db, "SELECT stock FROM merch WHERE id = %s", (merch_id,))
+        ordered = query_one(db, "SELECT COALESCE(SUM(quantity), 0) FROM merch_orders WHERE merch_id = %s", (merch_id,))
+        marks = ", ".join(["%s"] * len(tg_ids))
+        negative = query_one(db, f"""
+            SELECT COUNT(*) FROM balances b JOIN students s ON s.id = b.student_id
+            WHERE s.telegram_user_id IN ({marks}) AND b.current_points < 0
+        """, tuple(tg_ids))
+
+        report = summarize(latencies, elapsed)
+        report.update({
+            "succeeded": sum(1 for ok, _ in results if ok),
+            "rejected": sum(1 for ok, _ in results if not ok),
+            "sold_units": sold,
+            "initial_stock": args.stock,
+            "final_stock": final_stock,
+            "ordered_units": int(ordered),
+            "negative_balances": negative,
+        })
+        consistent = (final_stock >= 0 and args.stock - final_stock == sold == int(ordered)
+                      and negative == 0)
+        report["oversell_free"] = consistent
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0 if consistent else 1
+    finally:
+        if not args.keep:
+            cleanup(db, tg_ids, [merch_id])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# benchmarks/bench_checkin.py
+"""
+Вход на концерт: всплеск отметок по одному QR-коду. Меряется время
+ответа scan() у входа (начисления идут фоном пачками) и проверяется,
+что участников не больше max_participants, повторные сканы не дали
+баллов, а баланс, student_activities и transactions сходятся.
+
+Нужна рабочая БД из .env (тестовые строки удаляются в конце); без MySQL -
+DB_BACKEND=sqlite SQLITE_PATH=bench.db, тот же прогон на встроенной SQLite:
+    python benchmarks/bench_checkin.py --students 2000 --capacity 1800 --concurrency 64
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from common import cleanup, query_one, run_concurrently, seed_students, summarize
+
+from checkin import CheckinDesk  # noqa: E402
+from db import db  # noqa: E402
+from tasks import PeriodicTask  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--capacity", type=int, default=1800, help="max_participants мероприятия")
+    parser.add_argument("--points", type=int, default=50)
+    parser.add_argument("--repeat-share", type=float, default=0.1, help="доля повторных сканов")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    parser.add_argument("--cold", action="store_true", help="сбросить кэш Telegram ID -> студент")
+    parser.add_argument("--keep", action="store_true", help="не удалять тестовые данные")
+    args = parser.parse_args()
+
+    tg_ids = seed_students(db, args.students, 0)
+    ok, activity_id = db.create_activity("Bench concert", args.points, "culture",
+                                         max_participants=args.capacity)
+    if not ok:
+        print(f"[BENCH] активность не создана: {activity_id}")
+        return 1
+    try:
+        desk = CheckinDesk(db, b"bench-secret", batch_size=args.batch_size)
+        token = desk.token(activity_id)
+        if args.cold:
+            for tg_id in tg_ids:
+                db.student_cache.invalidate(tg_id)
+
+        jobs = tg_ids + random.sample(tg_ids, int(len(tg_ids) * args.repeat_share))
+        random.shuffle(jobs)
+        flusher = PeriodicTask(desk.flush, args.flush_interval, name="checkin_flush").start()
+        results, latencies, elapsed = run_concurrently(lambda tg_id: desk.scan(tg_id, token),
+                                                       jobs, args.concurrency)
+        flusher.stop()
+        drain_start = time.perf_counter()
+        desk.flush()
+        drain = time.perf_counter() - drain_start
+
+        participants = query_one(db, "SELECT COUNT(*) FROM student_activities WHERE activity_id = %s",
+                                 (activity_id,))
+        tx_rows = query_one(db, """
+            SELECT COUNT(*) FROM transactions WHERE entity_type = 'activity' AND entity_id = %s
+        """, (activity_id,))
+        marks = ", ".join(["%s"] * len(tg_ids))
+        earned = query_one(db, f"""
+            SELECT COALESCE(SUM(b.total_earned), 0) FROM balances b JOIN students s ON s.id = b.student_id
+            WHERE s.telegram_user_id IN ({marks})
+        """, tuple(tg_ids))
+
+        expected = min(args.students, args.capacity)
+        report = summarize(latencies, elapsed)
+        report.update({
+            "accepted_at_door": sum(1 for ok, _ in results if ok),
+            "rejected_at_door": sum(1 for ok, _ in results if not ok),
+            "final_flush_s": round(drain, 3),
+            "participants": participants,
+            "transactions": tx_rows,
+            "earned_total": int(earned),
+            "desk": desk.stats(),
+        })
+        consistent = (participants == tx_rows == expected == desk.awarded
+                      and int(earned) == expected * args.points)
+        report["checkin_consistent"] = consistent
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0 if consistent else 1
+    finally:
+        if not args.keep:
+            conn = db._get_connection()
+            try:
+                conn.cursor().execute("DELETE FROM activities WHERE id = %s", (activity_id,))
+                conn.commit()
+            finally:
+                conn.close()
+            cleanup(db, tg_ids)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# benchmarks/bench_service_orders.py
+"""
+Стресс биржи услуг: несколько исполнителей одновременно берут одну задачу,
+затем заказчик "дважды нажимает" подтверждение. Меряет пропускную способность
+и проверяет, что у задачи один исполнитель и оплата прошла ровно один раз.
+
+Нужна рабочая БД из .env (тестовые строки удаляются в конце); без MySQL -
+DB_BACKEND=sqlite SQLITE_PATH=bench.db, тот же прогон на встроенной SQLite:
+    python benchmarks/bench_service_orders.py --services 100 --contenders 4 --confirms 2
+"""
+import argparse
+import json
+import sys
+
+from common import BENCH_TG_BASE, cleanup, query_all, query_one, run_concurrently, seed_students, summarize
+
+from db import db  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--providers", type=int, default=20)
+    parser.add_argument("--executors", type=int, default=50)
+    parser.add_argument("--services", type=int, default=100)
+    parser.add_argument("--contenders", type=int, default=4, help="исполнителей на одну задачу")
+    parser.add_argument("--confirms", type=int, default=2, help="параллельных подтверждений заказа")
+    parser.add_argument("--cost", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--keep", action="store_true", help="не удалять тестовые данные")
+    args = parser.parse_args()
+
+    per_provider = -(-args.services // args.providers)
+    providers = seed_students(db, args.providers, args.cost * per_provider)
+    executors = seed_students(db, args.executors, 0, tg_base=BENCH_TG_BASE + args.providers)
+    tg_ids = providers + executors
+    try:
+        for i in range(args.services):
+            db.run_in_transaction(db.add_service, providers[i % len(providers)], f"Bench task {i}",
+                                  args.cost, "Бенчмарк")
+        marks = ", ".join(["%s"] * len(providers))
+        services = query_all(db, f"""
+            SELECT s.id, st.telegram_user_id FROM services s JOIN students st ON st.id = s.provider_id
+            WHERE st.telegram_user_id IN ({marks})
+        """, tuple(providers))
+
+        # 1. Каждую задачу одновременно пытаются взять contenders исполнителей
+        jobs = [(svc_id, executors[(i * args.contenders + k) % len(executors)])
+                for i, (svc_id, _) in enumerate(services) for k in range(args.contenders)]
+        taken, take_lat, take_time = run_concurrently(
+            lambda job: db.run_in_transaction(db.assign_service, *job), jobs, args.concurrency)
+
+        provider_of = dict(services)
+        orders = query_all(db, f"""
+            SELECT ord.id, ord.service_id FROM service_orders ord
+            WHERE ord.service_id IN ({", ".join(["%s"] * len(services))}) AND ord.status = 'in_progress'
+        """, tuple(provider_of))
+
+        # 2. Каждый заказ подтверждают confirms раз параллельно
+        jobs = [(order_id, provider_of[svc_id]) for order_id, svc_id in orders for _ in range(args.confirms)]
+        paid, confirm_lat, confirm_time = run_concurrently(
+            lambda job: db.run_in_transaction(db.complete_service_order, *job), jobs, args.concurrency)
+
+        order_marks = ", ".join(["%s"] * len(orders)) or "NULL"
+        order_ids = tuple(order_id for order_id, _ in orders)
+        earn_rows = query_one(db, f"""
+            SELECT COUNT(*) FROM transactions WHERE entity_type = 'service' AND type = 'earn'
+            AND entity_id IN ({order_marks})
+        """, order_ids)
+        marks = ", ".join(["%s"] * len(tg_ids))
+        earned = query_one(db, f"""
+            SELECT COALESCE(SUM(b.total_earned), 0) FROM balances b JOIN students s ON s.id = b.student_id
+            WHERE s.telegram_user_id IN ({", ".join(["%s"] * len(executors))})
+        """, tuple(executors))
+        negative = query_one(db, f"""
+            SELECT COUNT(*) FROM balances b JOIN students s ON s.id = b.student_id
+            WHERE s.telegram_user_id IN ({marks}) AND b.current_points < 0
+        """, tuple(tg_ids))
+
+        assigned = sum(1 for ok, _ in taken if ok)
+        confirmed = sum(1 for ok, _ in paid if ok)
+        report = {
+            "take": summarize(take_lat, take_time),
+            "confirm": summarize(confirm_lat, confirm_time),
+            "services": len(services),
+            "assigned": assigned,
+            "orders": len(orders),
+            "confirmed": confirmed,
+            "earn_transactions": earn_rows,
+            "executors_earned": int(earned),
+            "negative_balances": negative,
+        }
+        consistent = (assigned == len(orders) == len(services) and confirmed == earn_rows == len(orders)
+                      and int(earned) == confirmed * args.cost and negative == 0)
+        report["no_double_payment"] = consistent
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0 if consistent else 1
+    finally:
+        if not args.keep:
+            cleanup(db, tg_ids)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
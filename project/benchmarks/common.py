@@ -0,0 +1,120 @@
+# benchmarks/common.py
+"""Общие помощники бенчмарков: подготовка данных, параллельный прогон, перцентили."""
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Telegram ID тестовых студентов берем из диапазона, которого нет у реальных
+BENCH_TG_BASE = 9_000_000_000
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    """Сводка по латентностям (секунды) -> dict в миллисекундах"""
+    return {
+        "count": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def run_concurrently(fn, jobs, concurrency):
+    """
+    Вызывает fn(job) для каждого job в concurrency потоках, стартующих
+    одновременно. Возвращает (результаты, латентности, общее время).
+    """
+    results = [None] * len(jobs)
+    latencies = [0.0] * len(jobs)
+    start_gate = threading.Barrier(min(concurrency, len(jobs)) or 1)
+
+    def worker(index):
+        if index < concurrency:
+            start_gate.wait()
+        t0 = time.perf_counter()
+        results[index] = fn(jobs[index])
+        latencies[index] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(len(jobs))))
+    return results, latencies, time.perf_counter() - t0
+
+
+def seed_students(db, count, points, tg_base=BENCH_TG_BASE):
+    """Создает count студентов с балансом points. Возвращает их Telegram ID."""
+    tg_ids = [tg_base + i for i in range(count)]
+    for tg_id in tg_ids:
+        db.run_in_transaction(db.get_or_create_student, tg_id, f"Bench{tg_id % 100000}", "Bench")
+        if points:
+            db.run_in_transaction(db.admin_add_points, tg_id, points, "Бенчмарк")
+    return tg_ids
+
+
+def seed_merch(db, stock, price, name="Bench item"):
+    merch_id = str(uuid.uuid4())
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO merch (id, name, description, price_points, stock) VALUES (%s, %s, NULL, %s, %s)
+        """, (merch_id, name, price, stock))
+        conn.commit()
+    finally:
+        conn.close()
+    return merch_id
+
+
+def query_one(db, sql, params=()):
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        row = cur.fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def query_all(db, sql, params=()):
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def cleanup(db, tg_ids=(), merch_ids=()):
+    """Удаляет тестовых студентов (каскадом - их балансы и историю) и товары"""
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        for merch_id in merch_ids:
+            cur.execute("DELETE FROM merch WHERE id = %s", (merch_id,))
+        tg_ids = list(tg_ids)
+        for i in range(0, len(tg_ids), 500):
+            chunk = tg_ids[i:i + 500]
+            marks = ", ".join(["%s"] * len(chunk))
+            cur.execute(f"DELETE FROM students WHERE telegram_user_id IN ({marks})", tuple(chunk))
+        conn.commit()
+    finally:
+        conn.close()
+    for tg_id in tg_ids:
+        db.student_cache.invalidate(tg_id)
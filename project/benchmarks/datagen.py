@@ -0,0 +1,520 @@
+# benchmarks/datagen.py
+"""
+Генератор синтетических данных по схеме diplom.sql.
+
+Факультеты, группы, студенты с Telegram ID, мерч и заказы, услуги и заказы
+услуг, активности с участием, аукционы со ставками, транзакции и балансы,
+которые с ними сходятся (плюс daily_totals и ranking).
+
+Распределения неравномерные: активность студентов по закону Ципфа (немного
+"тяжелых" пользователей), будни/выходные, всплески в дни мероприятий.
+Строки генерируются потоком по дням и пишутся пачками - память не зависит
+от числа транзакций. Одинаковые --seed и --end дают одинаковые данные.
+
+    # Прямо в БД из .env (или DB_BACKEND=sqlite SQLITE_PATH=big.db)
+    python benchmarks/datagen.py --students 50000 --transactions 10000000 --check
+
+    # Удалить сгенерированное (те же --prefix/--tg-base/--students)
+    python benchmarks/datagen.py --students 50000 --cleanup
+
+    # CSV + load.sql для LOAD DATA в MySQL
+    python benchmarks/datagen.py --csv data/ --transactions 10000000
+    mysql --local-infile=1 store < data/load.sql
+"""
+import argparse
+import csv
+import itertools
+import os
+import random
+import re
+import sys
+import time
+from datetime import date, timedelta
+
+from common import BENCH_TG_BASE
+
+DATAGEN_TG_BASE = BENCH_TG_BASE + 20_000_000
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "diplom.sql")
+
+# Таблица -> колонки. Порядок - порядок сброса пачек (родители раньше детей).
+TABLES = {
+    "faculties": ("id", "code", "name"),
+    "groups": ("id", "group_code", "faculty_id"),
+    "students": ("id", "telegram_user_id", "student_id", "last_name", "first_name",
+                 "group_id", "faculty_id", "created_at"),
+    "merch": ("id", "name", "description", "price_points", "stock", "created_at"),
+    "activities": ("id", "title", "points", "category", "start_date", "end_date",
+                   "max_participants", "status", "created_at"),
+    "services": ("id", "provider_id", "name", "points_cost", "description", "status", "created_at"),
+    "service_orders": ("id", "service_id", "buyer_id", "status", "created_at"),
+    "merch_orders": ("id", "merch_id", "buyer_id", "quantity", "status", "created_at"),
+    "student_activities": ("id", "student_id", "activity_id", "earned_points", "status", "created_at"),
+    "auctions": ("id", "student_id", "merch_id", "start_price", "current_bid", "end_time",
+                 "status", "winner_id", "created_at"),
+    "bids": ("id", "auction_id", "bidder_id", "amount", "created_at"),
+    "transactions": ("id", "student_id", "type", "amount", "description", "entity_type",
+                     "entity_id", "created_at"),
+    "daily_totals": ("student_id", "day", "type", "total", "tx_count"),
+    "balances": ("student_id", "current_points", "total_earned", "total_spent", "held_points"),
+    "ranking": ("student_id", "score", "position"),
+}
+
+# Доли событий в обычный день (участие в активностях добавляется всплесками)
+EVENT_MIX = {"admin": 0.30, "activity": 0.30, "merch": 0.20, "service": 0.19, "auction_bid": 0.01}
+
+FIRST_NAMES = ("Иван", "Анна", "Петр", "Мария", "Алексей", "Елена", "Дмитрий", "Ольга", "Никита", "Софья")
+LAST_NAMES = ("Иванов", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева", "Козлов", "Новикова")
+CATEGORIES = ("science", "sport", "volunteer", "culture", "olympiad")
+
+
+def code_prefix(prefix):
+    """Префикс кодов факультетов/групп/зачеток: коды в схеме короткие (VARCHAR(10))"""
+    return prefix[:3].upper()
+
+
+class DataGenerator:
+    """
+    Поток (таблица, строка) в порядке, пригодном для загрузки. Состояние,
+    которое нужно до конца (балансы, аукционы, мерч), - O(студентов + товаров);
+    сами транзакции нигде не накапливаются.
+    """
+
+    def __init__(self, students=50000, transactions=10_000_000, days=180, faculties=8,
+                 groups_per_faculty=12, merch=200, activities=300, auctions=100,
+                 seed=42, tg_base=DATAGEN_TG_BASE, prefix="DG", int_id_base=0, start_bonus=0, end=None):
+        self.students = students
+        self.transactions = transactions
+        self.days = days
+        self.faculties = faculties
+        self.groups_per_faculty = groups_per_faculty
+        self.merch = merch
+        self.activities = activities
+        self.auctions = auctions
+        self.seed = seed
+        self.tg_base = tg_base
+        self.prefix = prefix
+        self.code = code_prefix(prefix)
+        self.int_id_base = int_id_base
+        self.start_bonus = start_bonus
+        self.end = end or date.today()
+        self.start = self.end - timedelta(days=days - 1)
+        self.rng = random.Random(seed)
+
+    def _uid(self):
+        h = "%032x" % self.rng.getrandbits(128)
+        return f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{h[16:20]}-{h[20:]}"
+
+    def _ts(self, day):
+        """Случайное время дня: днем и вечером чаще, чем ночью"""
+        hour = min(23, max(0, int(self.rng.gauss(15, 4))))
+        return f"{day.isoformat()} {hour:02d}:{self.rng.randrange(60):02d}:{self.rng.randrange(60):02d}"
+
+    def _picker(self, cum_weights, chunk=8192):
+        """Бесконечный поток индексов по накопленным весам (выборка пачками - быстрее)"""
+        population = range(len(cum_weights))
+        while True:
+            yield from self.rng.choices(population, cum_weights=cum_weights, k=chunk)
+
+    def rows(self):
+        rng = self.rng
+        n = self.students
+
+        # --- Справочники ---
+        group_ids = []
+        for f in range(self.faculties):
+            faculty_id = self.int_id_base + f + 1
+            yield "faculties", (faculty_id, f"{self.code}{f:03d}", f"Факультет {self.prefix}-{f}")
+            for g in range(self.groups_per_faculty):
+                group_id = self.int_id_base + f * self.groups_per_faculty + g + 1
+                group_ids.append((group_id, faculty_id))
+                yield "groups", (group_id, f"{self.code}{f:02d}-{g:02d}", faculty_id)
+
+        uuids = []
+        for i in range(n):
+            uid = self._uid()
+            uuids.append(uid)
+            group_id, faculty_id = rng.choice(group_ids)
+            yield "students", (uid, self.tg_base + i, f"{self.code}-{i}", rng.choice(LAST_NAMES),
+                               rng.choice(FIRST_NAMES), group_id, faculty_id, self._ts(self.start))
+
+        # Ципф: вес студента 1/rank^1.1, ранги перемешаны
+        ranks = list(range(1, n + 1))
+        rng.shuffle(ranks)
+        cum = list(itertools.accumulate(1.0 / r ** 1.1 for r in ranks))
+        pick = self._picker(cum)
+
+        merch = []
+        for i in range(self.merch):
+            price = int(rng.lognormvariate(4.5, 0.8)) + 10
+            merch.append((self._uid(), price))
+            yield "merch", (merch[-1][0], f"{self.prefix} мерч {i}", None, price,
+                            rng.randint(0, 500), self._ts(self.start))
+
+        # Активности: даты - дни всплесков
+        bursts = {}
+        participants = {}  # активность -> участники (студент участвует один раз)
+        for i in range(self.activities):
+            act_id = self._uid()
+            start = self.start + timedelta(days=rng.randrange(self.days))
+            end = min(self.end, start + timedelta(days=rng.choice((0, 0, 1, 2))))
+            limit = int(rng.paretovariate(1.5) * 30)
+            points = rng.choice((10, 20, 30, 50, 100))
+            status = "finished" if end < self.end else "active"
+            yield "activities", (act_id, f"{self.prefix} мероприятие {i}", points, rng.choice(CATEGORIES),
+                                 start, end, limit, status, self._ts(start - timedelta(days=7)))
+            span = (end - start).days + 1
+            for d in range(span):
+                bursts.setdefault(start + timedelta(days=d), []).append(
+                    (act_id, points, limit // span + (d < limit % span)))
+
+        # Аукционы: закрываются в случайный день, ставки копятся до закрытия
+        auctions = {}
+        for _ in range(self.auctions):
+            merch_id, price = rng.choice(merch)
+            end_day = self.start + timedelta(days=rng.randrange(self.days))
+            auctions.setdefault(end_day, []).append({
+                "id": self._uid(), "seller": uuids[rng.randrange(n)], "merch_id": merch_id,
+                "start_price": max(1, price // 2), "bids": [], "created": self._ts(end_day - timedelta(days=3)),
+            })
+
+        balance = [0] * n
+        earned = [0] * n
+        spent = [0] * n
+        held = [0] * n  # ставки лидеров еще открытых аукционов
+
+        # Объем по дням: выходные тише, дни мероприятий громче
+        factors = []
+        for d in range(self.days):
+            day = self.start + timedelta(days=d)
+            factor = 0.4 if day.weekday() >= 5 else 1.0
+            factors.append(factor * (1 + 0.5 * len(bursts.get(day, ()))))
+        scale = self.transactions / sum(factors)
+        cum_factors = [0.0, *itertools.accumulate(factors)]
+        quotas = [round(scale * cum_factors[d + 1]) - round(scale * cum_factors[d]) for d in range(self.days)]
+
+        kinds, weights = list(EVENT_MIX), list(EVENT_MIX.values())
+        for d in range(self.days):
+            day = self.start + timedelta(days=d)
+            totals = {}  # (студент, тип) -> [сумма, число] за день
+
+            def tx(i, tx_type, amount, description, entity_type, entity_id, ts):
+                if tx_type == "earn":
+                    balance[i] += amount
+                    earned[i] += amount
+                else:
+                    balance[i] -= amount
+                    spent[i] += amount
+                agg = totals.setdefault((i, tx_type), [0, 0])
+                agg[0] += amount
+                agg[1] += 1
+                return "transactions", (self._uid(), uuids[i], tx_type, amount, description,
+                                        entity_type, entity_id, ts)
+
+            made = 0
+            if d == 0 and self.start_bonus:
+                for i in range(n):
+                    yield tx(i, "earn", self.start_bonus, "Стартовый бонус", "admin", None, self._ts(day))
+
+            # Всплеск: участие в мероприятиях этого дня
+            for act_id, points, seats in bursts.get(day, ()):
+                taken = participants.setdefault(act_id, set())
+                for _ in range(seats):
+                    i = next(pick)
+                    if i in taken:
+                        continue
+                    taken.add(i)
+                    ts = self._ts(day)
+                    yield "student_activities", (self._uid(), uuids[i], act_id, points, "approved", ts)
+                    yield tx(i, "earn", points, "Участие в мероприятии", "activity", act_id, ts)
+                    made += 1
+
+            # Услуга дает две транзакции, ставка - ни одной: добираем до квоты дня
+            while made < quotas[d]:
+                for kind in rng.choices(kinds, weights, k=quotas[d] - made):
+                    if made >= quotas[d]:
+                        break
+                    i = next(pick)
+                    ts = self._ts(day)
+                    if kind == "merch":
+                        merch_id, price = merch[rng.randrange(len(merch))]
+                        if balance[i] >= price:
+                            yield "merch_orders", (self._uid(), merch_id, uuids[i], 1, "completed", ts)
+                            yield tx(i, "spend", price, "Покупка мерча", "merch", merch_id, ts)
+                            made += 1
+                            continue
+                        kind = "admin"
+                    elif kind == "service":
+                        executor = next(pick)
+                        cost = rng.randint(5, 100)
+                        if executor != i and balance[i] >= cost:
+                            service_id, order_id = self._uid(), self._uid()
+                            yield "services", (service_id, uuids[i], "Помощь", cost, None, "completed", ts)
+                            yield "service_orders", (order_id, service_id, uuids[executor], "completed", ts)
+                            yield tx(i, "spend", cost, "Оплата задачи: Помощь", "service", order_id, ts)
+                            yield tx(executor, "earn", cost, "Выполнение задачи: Помощь", "service", order_id, ts)
+                            made += 2
+                            continue
+                        kind = "admin"
+                    elif kind == "auction_bid":
+                        open_days = [k for k in auctions if k >= day]
+                        if open_days:
+                            auction = rng.choice(auctions[rng.choice(open_days)])
+                            last = auction["bids"][-1][2] if auction["bids"] else auction["start_price"]
+                            auction["bids"].append((self._uid(), i, last + rng.randint(1, 20), ts))
+                            continue
+                        kind = "admin"
+                    if kind == "activity":
+                        yield tx(i, "earn", rng.choice((10, 20, 30)), "Активность", "activity", None, ts)
+                    else:
+                        yield tx(i, "earn", rng.randint(5, 50), "Бонус от админа", "admin", None, ts)
+                    made += 1
+
+            # Закрытие аукционов дня: побеждает старшая ставка, которую участник может оплатить.
+            # Аукционы последнего дня остаются открытыми: у лидера его ставка удержана
+            for auction in auctions.pop(day, ()):
+                winner, price = None, 0
+                for bid_id, bidder, amount, ts in sorted(auction["bids"], key=lambda b: -b[2]):
+                    if balance[bidder] - held[bidder] >= amount:
+                        winner, price = bidder, amount
+                        break
+                end_time = f"{day.isoformat()} 21:00:00"
+                status = "closed" if day < self.end else "open"
+                yield "auctions", (auction["id"], auction["seller"], auction["merch_id"], auction["start_price"],
+                                   price, end_time, status, uuids[winner] if winner is not None else None,
+                                   auction["created"])
+                for bid_id, bidder, amount, ts in auction["bids"]:
+                    if status == "closed" or amount <= price:
+                        yield "bids", (bid_id, auction["id"], uuids[bidder], amount, ts)
+                if winner is None:
+                    continue
+                if status == "closed":
+                    yield tx(winner, "spend", price, "Выигрыш аукциона", "auction", auction["id"], end_time)
+                else:
+                    held[winner] += price
+
+            for (i, tx_type), (total, count) in totals.items():
+                yield "daily_totals", (uuids[i], day, tx_type, total, count)
+
+        # --- Итоговое состояние ---
+        for i, uid in enumerate(uuids):
+            yield "balances", (uid, balance[i], earned[i], spent[i], held[i])
+        order = sorted(range(n), key=lambda i: (-balance[i], uuids[i]))
+        for position, i in enumerate(order, start=1):
+            yield "ranking", (uuids[i], balance[i], position)
+
+
+# ==========================
+# ЗАПИСЬ
+# ==========================
+
+def _secondary_indexes(tables):
+    """CREATE INDEX из diplom.sql для загружаемых таблиц: [(имя, таблица, DDL)]"""
+    with open(SCHEMA_PATH, encoding="utf-8") as f:
+        ddl = f.read()
+    found = re.findall(r"(CREATE INDEX (\w+) ON (\w+)\s*\(.*?\);)", ddl)
+    return [(name, table, stmt) for stmt, name, table in found if table in tables]
+
+
+class DatabaseWriter:
+    """
+    Пишет поток в БД одним соединением: executemany пачками, проверки FK
+    выключены на время загрузки, вторичные индексы удаляются и строятся заново
+    в конце (rebuild_indexes=False - оставить как есть).
+    """
+
+    def __init__(self, db, batch_size=10000, rebuild_indexes=True):
+        self.db = db
+        self.batch_size = batch_size
+        self.rebuild_indexes = rebuild_indexes
+        self.counts = dict.fromkeys(TABLES, 0)
+        self._buffers = {table: [] for table in TABLES}
+        self._sql = {table: "INSERT INTO {} ({}) VALUES ({})".format(
+            f"`{table}`" if table == "groups" else table, ", ".join(cols), ", ".join(["%s"] * len(cols)))
+            for table, cols in TABLES.items()}
+
+    def write(self, stream):
+        backend = self.db.backend
+        conn = self.db._get_connection()
+        cur = conn.cursor()
+        indexes = _secondary_indexes(TABLES) if self.rebuild_indexes else []
+        try:
+            for stmt in backend.bulk_load_statements(True):
+                cur.execute(stmt)
+            for name, table, _ in indexes:
+                try:
+                    cur.execute(backend.drop_index(name, table))
+                except backend.Error:
+                    pass  # индекса уже нет
+            conn.commit()
+
+            pending = 0
+            for table, row in stream:
+                self._buffers[table].append(row)
+                pending += 1
+                if pending >= self.batch_size:
+                    self._flush(conn, cur)
+                    pending = 0
+            self._flush(conn, cur)
+
+            for name, table, stmt in indexes:
+                print(f"[DATAGEN] индекс {name}...")
+                cur.execute(stmt)
+            conn.commit()
+        finally:
+            conn.rollback()
+            for stmt in backend.bulk_load_statements(False):
+                cur.execute(stmt)
+            conn.close()
+
+    def _flush(self, conn, cur):
+        for table, rows in self._buffers.items():
+            if rows:
+                cur.executemany(self._sql[table], rows)
+                self.counts[table] += len(rows)
+                rows.clear()
+        conn.commit()
+
+
+class CsvWriter:
+    """Пишет <таблица>.csv и load.sql с LOAD DATA для MySQL"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.counts = dict.fromkeys(TABLES, 0)
+
+    def write(self, stream):
+        os.makedirs(self.directory, exist_ok=True)
+        files, writers = {}, {}
+        try:
+            for table, cols in TABLES.items():
+                files[table] = open(os.path.join(self.directory, f"{table}.csv"), "w", newline="", encoding="utf-8")
+                writers[table] = csv.writer(files[table])
+                writers[table].writerow(cols)
+            for table, row in stream:
+                # При ESCAPED BY '' MySQL читает NULL без кавычек как NULL
+                writers[table].writerow(["NULL" if v is None else v for v in row])
+                self.counts[table] += 1
+        finally:
+            for f in files.values():
+                f.close()
+
+        with open(os.path.join(self.directory, "load.sql"), "w", encoding="utf-8") as f:
+            f.write("SET foreign_key_checks = 0;\nSET unique_checks = 0;\n")
+            for table, cols in TABLES.items():
+                f.write(f"LOAD DATA LOCAL INFILE '{table}.csv' INTO TABLE `{table}` CHARACTER SET utf8mb4\n"
+                        f"  FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY ''\n"
+                        f"  LINES TERMINATED BY '\\r\\n' IGNORE 1 LINES ({', '.join(cols)});\n")
+            f.write("SET unique_checks = 1;\nSET foreign_key_checks = 1;\n")
+
+
+def next_int_id(db):
+    """Свободный диапазон id для факультетов и групп (они AUTO_INCREMENT)"""
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM faculties")
+        faculties = cur.fetchone()[0]
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM `groups`")
+        return max(faculties, cur.fetchone()[0])
+    finally:
+        conn.close()
+
+
+def cleanup_generated(db, prefix, tg_base, students):
+    """Удаляет сгенерированное: студентов (каскадом - их данные), мерч, активности, группы, факультеты"""
+    code = code_prefix(prefix)
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM students WHERE telegram_user_id >= %s AND telegram_user_id < %s",
+                    (tg_base, tg_base + students))
+        cur.execute("DELETE FROM merch WHERE name LIKE %s", (prefix + " %",))
+        cur.execute("DELETE FROM activities WHERE title LIKE %s", (prefix + " %",))
+        cur.execute("DELETE FROM `groups` WHERE group_code LIKE %s", (code + "%",))
+        cur.execute("DELETE FROM faculties WHERE code LIKE %s", (code + "%",))
+        conn.commit()
+    finally:
+        conn.close()
+    db.student_cache.clear()
+
+
+def check_balances(db, tg_base, students):
+    """Число сгенерированных студентов, у которых баланс не сходится с транзакциями"""
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT COUNT(*) FROM balances b
+            JOIN students s ON s.id = b.student_id
+            LEFT JOIN (
+                SELECT student_id,
+                       SUM(CASE WHEN type = 'earn' THEN amount ELSE 0 END) AS earned,
+                       SUM(CASE WHEN type = 'spend' THEN amount ELSE 0 END) AS spent
+                FROM transactions GROUP BY student_id
+            ) t ON t.student_id = b.student_id
+            WHERE s.telegram_user_id >= %s AND s.telegram_user_id < %s
+              AND (b.total_earned != COALESCE(t.earned, 0) OR b.total_spent != COALESCE(t.spent, 0)
+                   OR b.current_points != b.total_earned - b.total_spent)
+        """, (tg_base, tg_base + students))
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--merch", type=int, default=200)
+    parser.add_argument("--activities", type=int, default=300)
+    parser.add_argument("--auctions", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end", type=date.fromisoformat, help="последний день истории, ГГГГ-ММ-ДД (по умолчанию сегодня)")
+    parser.add_argument("--tg-base", type=int, default=DATAGEN_TG_BASE, help="первый Telegram ID")
+    parser.add_argument("--prefix", default="DG", help="префикс названий и кодов")
+    parser.add_argument("--csv", metavar="DIR", help="писать CSV + load.sql вместо БД")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--keep-indexes", action="store_true", help="не удалять и не пересоздавать индексы")
+    parser.add_argument("--check", action="store_true", help="после загрузки сверить балансы с транзакциями")
+    parser.add_argument("--cleanup", action="store_true", help="удалить ранее сгенерированные данные и выйти")
+    args = parser.parse_args()
+
+    params = dict(students=args.students, transactions=args.transactions, days=args.days, merch=args.merch,
+                  activities=args.activities, auctions=args.auctions, seed=args.seed,
+                  tg_base=args.tg_base, prefix=args.prefix, end=args.end)
+    db = None
+    if args.csv:
+        writer = CsvWriter(args.csv)
+    else:
+        # Генерация не должна слать уведомления в Telegram
+        os.environ["BOT_TOKEN"] = ""
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from db import db
+        if args.cleanup:
+            cleanup_generated(db, args.prefix, args.tg_base, args.students)
+            print("[DATAGEN] сгенерированные данные удалены")
+            return 0
+        params["int_id_base"] = next_int_id(db)
+        writer = DatabaseWriter(db, args.batch_size, rebuild_indexes=not args.keep_indexes)
+
+    t0 = time.perf_counter()
+    writer.write(DataGenerator(**params).rows())
+    elapsed = time.perf_counter() - t0
+    for table, count in writer.counts.items():
+        print(f"[DATAGEN] {table:<20}{count:>12}")
+    print(f"[DATAGEN] {elapsed:.1f} с, {sum(writer.counts.values()) / elapsed:,.0f} строк/с")
+
+    if db is not None:
+        # История записана в обход _record_transactions - рейтинги по окнам собираем из daily_totals
+        db.backfill_leaderboards()
+
+    if db is not None and args.check:
+        bad = check_balances(db, args.tg_base, args.students)
+        print(f"[DATAGEN] балансы {'сходятся' if not bad else f'НЕ сходятся у {bad} студентов'}")
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
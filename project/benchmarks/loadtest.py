@@ -0,0 +1,437 @@
+# benchmarks/loadtest.py
+"""
+Нагрузочный прогон API мини-аппа и хендлеров бота на заданном наборе данных.
+
+Наполняет базу (студенты, транзакции, мерч, заказы услуг), затем на каждом
+уровне конкурентности гоняет смесь запросов заданное время и печатает
+пропускную способность и p50/p95/p99 по каждому эндпоинту. Результаты
+сохраняются в JSON и могут сравниваться с прошлым прогоном.
+
+    # API в процессе (Flask test client) на SQLite, без MySQL и сервера
+    DB_BACKEND=sqlite SQLITE_PATH=load.db python benchmarks/loadtest.py \\
+        --students 50000 --transactions 5000000 --concurrency 1 8 32 --out run.json
+
+    # Запущенный сервер (данные наполняются через ту же БД из .env)
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --concurrency 16 64
+
+    # Хендлеры бота (AsyncDatabase) и сравнение с базовым прогоном
+    python benchmarks/loadtest.py --target bot --baseline run.json --out run2.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from common import BENCH_TG_BASE, summarize
+from datagen import DataGenerator, DatabaseWriter, cleanup_generated, next_int_id
+
+# Нагрузочный прогон не должен слать уведомления в Telegram
+os.environ["BOT_TOKEN"] = ""
+
+from db import db  # noqa: E402
+
+# Свой диапазон Telegram ID: cleanup() других бенчмарков его не задевает
+LOADTEST_TG_BASE = BENCH_TG_BASE + 10_000_000
+MERCH_PREFIX = "Loadtest"
+
+API_MIX = "user=30,history=25,leaderboard=20,services=15,buy_merch=5,confirm_task=5"
+BOT_MIX = "start=60,buy_merch=30,add_points=10"
+
+
+# ==========================
+# НАБОР ДАННЫХ
+# ==========================
+
+class Dataset:
+    """Что нагрузке нужно знать о данных: студенты, товары, очередь заказов"""
+
+    def __init__(self, students, merch_ids, orders):
+        self.students = students
+        self.merch_ids = merch_ids
+        self._orders = orders  # [(order_id, provider_tg)] - подтверждаются по одному разу
+        self._lock = threading.Lock()
+        self._new_students = 0
+
+    def random_tg(self, rng):
+        return LOADTEST_TG_BASE + rng.randrange(self.students)
+
+    def next_order(self):
+        with self._lock:
+            return self._orders.pop() if self._orders else None
+
+    def new_tg(self):
+        """Telegram ID нового (еще не зарегистрированного) пользователя"""
+        with self._lock:
+            self._new_students += 1
+            return LOADTEST_TG_BASE + self.students + self._new_students
+
+
+def _insert_batches(sql, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _flush(sql, batch)
+            batch = []
+    if batch:
+        _flush(sql, batch)
+
+
+def _flush(sql, batch):
+    conn = db._get_connection()
+    try:
+        conn.cursor().executemany(sql, batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _scalar(sql, params=()):
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _rows(sql, params=()):
+    conn = db._get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def seed_dataset(students, transactions, merch, orders, seed, batch_size=5000):
+    """
+    Наполняет базу, если в диапазоне нагрузочных Telegram ID еще нет
+    students студентов; иначе переиспользует уже созданные данные.
+    Заказы услуг (in_progress) создаются заново на каждый прогон -
+    подтверждение их расходует.
+    """
+    rng = random.Random(seed)
+    existing = _scalar(
+        "SELECT COUNT(*) FROM students WHERE telegram_user_id >= %s AND telegram_user_id < %s",
+        (LOADTEST_TG_BASE, LOADTEST_TG_BASE + students),
+    )
+    if existing != students:
+        if existing:
+            cleanup_dataset()
+        t0 = time.perf_counter()
+        # Стартовый бонус, чтобы покупки не упирались в баланс
+        generator = DataGenerator(
+            students=students, transactions=transactions, days=90, merch=merch, seed=seed,
+            tg_base=LOADTEST_TG_BASE, prefix=MERCH_PREFIX, int_id_base=next_int_id(db), start_bonus=10000,
+        )
+        DatabaseWriter(db, batch_size).write(generator.rows())
+        # Нагрузка покупает мерч без остановки - склад не должен кончаться
+        _flush("UPDATE merch SET stock = %s WHERE name LIKE %s", [(10 ** 9, MERCH_PREFIX + " %")])
+        db.merch_catalog.bump()
+        print(f"[LOADTEST] данные созданы за {time.perf_counter() - t0:.1f} с")
+
+    merch_ids = [row[0] for row in _rows("SELECT id FROM merch WHERE name LIKE %s", (MERCH_PREFIX + " %",))]
+
+    # Заказы в работе для confirm_task: услуга одного студента, исполнитель - другой
+    students_rows = _rows(
+        "SELECT id, telegram_user_id FROM students WHERE telegram_user_id >= %s AND telegram_user_id < %s",
+        (LOADTEST_TG_BASE, LOADTEST_TG_BASE + students),
+    )
+    service_rows, order_rows, queue = [], [], []
+    for _ in range(orders):
+        (provider, provider_tg), (executor, _) = rng.sample(students_rows, 2)
+        service_id, order_id = str(uuid.uuid4()), str(uuid.uuid4())
+        service_rows.append((service_id, provider, "Нагрузочная задача", rng.randint(1, 20), "in_progress"))
+        order_rows.append((order_id, service_id, executor, "in_progress"))
+        queue.append((order_id, provider_tg))
+    _insert_batches("""
+        INSERT INTO services (id, provider_id, name, points_cost, status) VALUES (%s, %s, %s, %s, %s)
+    """, service_rows, batch_size)
+    _insert_batches("""
+        INSERT INTO service_orders (id, service_id, buyer_id, status) VALUES (%s, %s, %s, %s)
+    """, order_rows, batch_size)
+    db.service_board.bump()
+    return Dataset(students, merch_ids, queue)
+
+
+def cleanup_dataset():
+    """Удаляет нагрузочных студентов (каскадом - все их данные), товары, активности, группы"""
+    cleanup_generated(db, MERCH_PREFIX, LOADTEST_TG_BASE, 10_000_000)
+
+
+# ==========================
+# КЛИЕНТЫ И ОПЕРАЦИИ
+# ==========================
+
+class ApiClient:
+    """Flask test client в этом процессе или HTTP к запущенному серверу"""
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        if base_url:
+            import requests
+            self._session = requests.Session()
+        else:
+            from webapp import app
+            self._client = app.test_client()
+
+    def get(self, path):
+        if self.base_url:
+            resp = self._session.get(self.base_url + path, timeout=30)
+            return resp.status_code, _json(resp.content)
+        resp = self._client.get(path)
+        return resp.status_code, resp.get_json(silent=True)
+
+    def post(self, path, payload):
+        if self.base_url:
+            resp = self._session.post(self.base_url + path, json=payload, timeout=30)
+            return resp.status_code, _json(resp.content)
+        resp = self._client.post(path, json=payload)
+        return resp.status_code, resp.get_json(silent=True)
+
+
+def _json(content):
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+# Операция API: (client, rng, dataset) -> (status, body) или None, если делать нечего
+API_OPS = {
+    "user": lambda api, rng, ds: api.get(f"/api/user/{ds.random_tg(rng)}"),
+    "history": lambda api, rng, ds: api.get(f"/api/history/{ds.random_tg(rng)}?limit=20"),
+    "leaderboard": lambda api, rng, ds: api.get("/api/leaderboard?limit=10"),
+    "services": lambda api, rng, ds: api.get(f"/api/services?user_id={ds.random_tg(rng)}&status=active"),
+    "buy_merch": lambda api, rng, ds: api.post("/api/buy_merch", {
+        "user_id": ds.random_tg(rng), "merch_id": rng.choice(ds.merch_ids)}),
+    "confirm_task": lambda api, rng, ds: _confirm(api, ds),
+}
+
+
+def _confirm(api, ds):
+    order = ds.next_order()
+    if not order:
+        return None
+    order_id, provider_tg = order
+    return api.post("/api/confirm_task", {"user_id": provider_tg, "order_id": order_id})
+
+
+# Операции бота: то, что делают хендлеры, без сети Telegram
+BOT_OPS = {
+    "start": lambda adb, rng, ds: adb.get_or_create_student(
+        telegram_id=ds.new_tg() if rng.random() < 0.1 else ds.random_tg(rng), first_name="Load", last_name="Test"),
+    "buy_merch": lambda adb, rng, ds: adb.buy_merch(ds.random_tg(rng), rng.choice(ds.merch_ids)),
+    "add_points": lambda adb, rng, ds: adb.admin_add_points(ds.random_tg(rng), 5, "Нагрузочный тест"),
+}
+
+
+def parse_mix(text, ops):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ops:
+            raise SystemExit(f"Неизвестная операция: {name} (есть: {', '.join(ops)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _outcome(result):
+    """(status, rejected): rejected - бизнес-отказ вида {"success": false}"""
+    if result is True or result is False:
+        return 200, not result
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], bool):
+        return 200, not result[0]  # (success, msg) от методов Database
+    status, body = result
+    return status, isinstance(body, dict) and body.get("success") is False
+
+
+# ==========================
+# ПРОГОН
+# ==========================
+
+def run_api_level(ds, mix, concurrency, duration, base_url, seed):
+    samples = []
+    lock = threading.Lock()
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        api = ApiClient(base_url)
+        local = []
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            result = API_OPS[name](api, rng, ds)
+            if result is None:
+                continue
+            local.append((name, time.perf_counter() - t0) + _outcome(result))
+        with lock:
+            samples.extend(local)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - t0
+
+
+def run_bot_level(ds, mix, concurrency, duration, seed):
+    from async_db import adb
+
+    names, weights = list(mix), list(mix.values())
+
+    async def worker(n, samples, deadline):
+        rng = random.Random(seed * 1000 + n)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                result = await BOT_OPS[name](adb, rng, ds)
+                status, rejected = _outcome(result)
+            except Exception:
+                status, rejected = 500, False
+            samples.append((name, time.perf_counter() - t0, status, rejected))
+
+    async def main():
+        samples = []
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(worker(n, samples, deadline) for n in range(concurrency)))
+        return samples
+
+    t0 = time.perf_counter()
+    samples = asyncio.run(main())
+    return samples, time.perf_counter() - t0
+
+
+def summarize_level(samples, elapsed):
+    endpoints = {}
+    for name in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == name]
+        stats = summarize([s[1] for s in rows], elapsed)
+        stats["errors"] = sum(1 for s in rows if s[2] >= 500)
+        stats["rejected"] = sum(1 for s in rows if s[3])
+        endpoints[name] = stats
+    total = summarize([s[1] for s in samples], elapsed)
+    total["errors"] = sum(1 for s in samples if s[2] >= 500)
+    return endpoints, total
+
+
+def print_level(level):
+    print(f"\n== {level['target']} x{level['concurrency']}: "
+          f"{level['total']['throughput_rps']} rps, ошибок {level['total']['errors']}")
+    print(f"{'endpoint':<14}{'count':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>6}{'rej':>6}")
+    for name, s in level["endpoints"].items():
+        print(f"{name:<14}{s['count']:>8}{s['throughput_rps']:>9}{s['p50_ms']:>9}"
+              f"{s['p95_ms']:>9}{s['p99_ms']:>9}{s['errors']:>6}{s['rejected']:>6}")
+
+
+def compare(results, baseline, threshold):
+    """Печатает разницу с базовым прогоном; возвращает число регрессий"""
+    base = {(lvl["target"], lvl["concurrency"], name): s
+            for lvl in baseline["results"] for name, s in lvl["endpoints"].items()}
+    regressions = 0
+    print(f"\n== Сравнение с базовым прогоном ({baseline['meta'].get('git_rev')}, порог {threshold:.0%})")
+    for lvl in results:
+        for name, s in lvl["endpoints"].items():
+            old = base.get((lvl["target"], lvl["concurrency"], name))
+            if not old:
+                continue
+            d_rps = (s["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] if old["throughput_rps"] else 0
+            d_p95 = (s["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0
+            worse = d_rps < -threshold or d_p95 > threshold
+            regressions += worse
+            print(f"{'!!' if worse else '  '} {lvl['target']} x{lvl['concurrency']:<4} {name:<14}"
+                  f"rps {old['throughput_rps']:>8} -> {s['throughput_rps']:<8} ({d_rps:+.0%})  "
+                  f"p95 {old['p95_ms']:>8} -> {s['p95_ms']:<8} ({d_p95:+.0%})")
+    return regressions
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("api", "bot"), default="api")
+    parser.add_argument("--url", help="адрес запущенного сервера; по умолчанию Flask test client")
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--merch", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=5000, help="заказов в работе для confirm_task")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на уровень")
+    parser.add_argument("--mix", help=f"веса операций, по умолчанию {API_MIX} / {BOT_MIX}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="куда сохранить результаты (JSON)")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое ухудшение rps/p95")
+    parser.add_argument("--cleanup", action="store_true", help="удалить нагрузочные данные в конце")
+    args = parser.parse_args()
+
+    ops = API_OPS if args.target == "api" else BOT_OPS
+    mix = parse_mix(args.mix or (API_MIX if args.target == "api" else BOT_MIX), ops)
+    ds = seed_dataset(args.students, args.transactions, args.merch, args.orders, args.seed)
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            if args.target == "api":
+                samples, elapsed = run_api_level(ds, mix, concurrency, args.duration, args.url, args.seed)
+            else:
+                samples, elapsed = run_bot_level(ds, mix, concurrency, args.duration, args.seed)
+            endpoints, total = summarize_level(samples, elapsed)
+            level = {"target": args.target, "concurrency": concurrency, "duration_s": round(elapsed, 2),
+                     "endpoints": endpoints, "total": total}
+            results.append(level)
+            print_level(level)
+    finally:
+        if args.cleanup:
+            cleanup_dataset()
+
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "backend": db.backend.name,
+            "url": args.url,
+            "dataset": {"students": args.students, "transactions": args.transactions,
+                        "merch": args.merch, "orders": args.orders, "seed": args.seed},
+            "mix": mix,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n[LOADTEST] результаты: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
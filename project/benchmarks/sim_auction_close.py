@@ -0,0 +1,155 @@
+# benchmarks/sim_auction_close.py
+"""
+Закрытие тысяч аукционов на ручных часах (ManualClock): сколько закрытий
+в секунду дает AuctionScheduler и сходится ли расчет.
+
+Аукционы заканчиваются равномерно в пределах --spread минут, на часть
+из них ставят ставки, часть продлевается "другим процессом" уже после
+загрузки планировщика. На середине планировщик пересоздается с нуля,
+как после падения процесса. В конце проверяется: все аукционы закрыты,
+с каждого победителя списана ровно его ставка и снято удержание, на
+каждый выигрыш есть transactions и merch_orders, двойных расчетов нет.
+
+Нужна рабочая БД из .env (тестовые строки удаляются в конце); без MySQL -
+DB_BACKEND=sqlite SQLITE_PATH=bench.db, тот же прогон на встроенной SQLite:
+    python benchmarks/sim_auction_close.py --auctions 2000 --bidders 300
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import cleanup, query_all, query_one, seed_merch, seed_students
+
+from auctions import AuctionScheduler, ManualClock  # noqa: E402
+from db import db  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--auctions", type=int, default=2000)
+    parser.add_argument("--bidders", type=int, default=300)
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--max-bids", type=int, default=4, help="ставок на аукцион, не больше")
+    parser.add_argument("--spread", type=int, default=60, help="минут, на которые разбросаны end_time")
+    parser.add_argument("--extend-share", type=float, default=0.05, help="доля продленных аукционов")
+    parser.add_argument("--step", type=int, default=5, help="шаг часов, секунд")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="не удалять тестовые данные")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    tg_ids = seed_students(db, args.bidders + 1, args.points)
+    merch_id = seed_merch(db, args.auctions, 10)
+    try:
+        # Торги идут в реальном времени, закрытие - по ручным часам с base
+        base = datetime.now().replace(microsecond=0) + timedelta(hours=1)
+        auction_ids, end_times = [], {}
+        for i in range(args.auctions):
+            end_time = base + timedelta(seconds=args.spread * 60 * i // args.auctions)
+            ok, auction_id = db.create_auction(tg_ids[0], merch_id, 10, end_time)
+            if not ok:
+                print(f"[SIM] аукцион не создан: {auction_id}")
+                return 1
+            auction_ids.append(auction_id)
+            end_times[auction_id] = end_time
+
+        bid_start = time.perf_counter()
+        for auction_id in auction_ids:
+            for _ in range(rng.randint(0, args.max_bids)):
+                state = db.get_auction(auction_id)
+                db.place_bid(auction_id, rng.choice(tg_ids[1:]), state["min_bid"] + rng.randint(0, 10))
+        bid_elapsed = time.perf_counter() - bid_start
+
+        clock = ManualClock(base - timedelta(seconds=1))
+        scheduler = AuctionScheduler(db, clock=clock, batch_size=args.batch_size)
+        scheduler.load()
+
+        # Продление после загрузки: планировщик узнает о нем только при попытке закрыть
+        extended = rng.sample(auction_ids, int(len(auction_ids) * args.extend_share))
+        conn = db._get_connection()
+        try:
+            cur = conn.cursor()
+            cur.executemany("UPDATE auctions SET end_time = %s WHERE id = %s",
+                            [(end_times[a] + timedelta(minutes=10), a) for a in extended])
+            conn.commit()
+        finally:
+            conn.close()
+
+        end = base + timedelta(minutes=args.spread + 11)
+        restart_at = base + timedelta(minutes=args.spread / 2)
+        restarted = False
+        closed_before_restart = extended_before_restart = 0
+        close_start = time.perf_counter()
+        while clock.now() < end:
+            clock.advance(args.step)
+            if not restarted and clock.now() >= restart_at:
+                # "Падение": новая куча только из БД
+                closed_before_restart, extended_before_restart = scheduler.closed, scheduler.extended
+                scheduler = AuctionScheduler(db, clock=clock, batch_size=args.batch_size)
+                scheduler.load()
+                restarted = True
+            scheduler.run_due()
+        close_elapsed = time.perf_counter() - close_start
+
+        # Повторное закрытие уже закрытых ничего не меняет
+        repeat = db.close_auctions(auction_ids[:args.batch_size], clock.now())
+
+        marks = ", ".join(["%s"] * len(auction_ids))
+        still_open = query_one(db, f"SELECT COUNT(*) FROM auctions WHERE id IN ({marks}) AND status != 'closed'",
+                               tuple(auction_ids))
+        won = query_all(db, f"""
+            SELECT winner_id, current_bid FROM auctions WHERE id IN ({marks}) AND winner_id IS NOT NULL
+        """, tuple(auction_ids))
+        orders = query_one(db, "SELECT COUNT(*) FROM merch_orders WHERE merch_id = %s", (merch_id,))
+        tx_rows = query_one(db, f"""
+            SELECT COUNT(*) FROM transactions WHERE entity_type = 'auction' AND entity_id IN ({marks})
+        """, tuple(auction_ids))
+        stock = query_one(db, "SELECT stock FROM merch WHERE id = %s", (merch_id,))
+        tg_marks = ", ".join(["%s"] * len(tg_ids))
+        held, spent = query_all(db, f"""
+            SELECT COALESCE(SUM(b.held_points), 0), COALESCE(SUM(b.total_spent), 0)
+            FROM balances b JOIN students s ON s.id = b.student_id WHERE s.telegram_user_id IN ({tg_marks})
+        """, tuple(tg_ids))[0]
+
+        report = {
+            "auctions": len(auction_ids),
+            "bids_per_sec": round(count_bids(auction_ids) / bid_elapsed, 1) if bid_elapsed else None,
+            "close_elapsed_s": round(close_elapsed, 3),
+            "closes_per_sec": round(len(auction_ids) / close_elapsed, 1) if close_elapsed else None,
+            "closed_before_restart": closed_before_restart,
+            "closed_after_restart": scheduler.closed,
+            "extended": len(extended),
+            "extended_seen": extended_before_restart + scheduler.extended,
+            "still_open": still_open,
+            "settled": len(won),
+            "merch_orders": orders,
+            "auction_transactions": tx_rows,
+            "stock_left": stock,
+            "held_left": int(held),
+            "spent": int(spent),
+            "won_total": sum(bid for _, bid in won),
+            "repeat_close": repeat,
+        }
+        consistent = (still_open == 0 and orders == tx_rows == len(won)
+                      and stock == args.auctions - len(won) and held == 0
+                      and spent == report["won_total"] and repeat["closed"] == 0
+                      and closed_before_restart + scheduler.closed == len(auction_ids))
+        report["settlement_consistent"] = consistent
+        print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+        return 0 if consistent else 1
+    finally:
+        if not args.keep:
+            cleanup(db, tg_ids, [merch_id])
+
+
+def count_bids(auction_ids):
+    marks = ", ".join(["%s"] * len(auction_ids))
+    return query_one(db, f"SELECT COUNT(*) FROM bids WHERE auction_id IN ({marks})", tuple(auction_ids))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
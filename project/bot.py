@@ -2,13 +2,18 @@
 import asyncio
 import json
 import os
+from datetime import datetime
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F, types
-from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, WebAppInfo, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.filters import CommandStart, Command, CommandObject, ExceptionTypeFilter
+from aiogram.types import ErrorEvent, Message, WebAppInfo, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from async_db import DatabaseTimeout, adb
+from checkin import DEEP_LINK_PREFIX, CheckinDesk
 from db import db
+from grants import parse_grants, upload_id
+from tasks import PeriodicTask
 
 load_dotenv()
 
@@ -18,6 +23,9 @@ BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# Отметка по deep link t.me/<бот>?start=checkin_<токен> - тот же CheckinDesk, что в webapp
+checkin_desk = CheckinDesk.from_env(db)
+
 # --- FSM для админки ---
 class AdminStates(StatesGroup):
     waiting_for_merch_name = State()
@@ -27,16 +35,24 @@ class AdminStates(StatesGroup):
     waiting_for_student_id_points = State()
     waiting_for_points_amount = State()
 
+    waiting_for_grants_list = State()
+
 # --- Стартовая команда ---
 @dp.message(CommandStart())
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, command: CommandObject | None = None):
     user = message.from_user
-    db.get_or_create_student(
-        telegram_user_id=user.id,
+    await adb.get_or_create_student(
+        telegram_id=user.id,
         first_name=user.first_name,
         last_name=user.last_name or '',
         username=user.username or ''
     )
+
+    # command=None - вызов из admin_exit, без параметра /start
+    if command and command.args and command.args.startswith(DEEP_LINK_PREFIX):
+        success, msg = await adb.call(checkin_desk.scan, user.id, command.args)
+        await message.answer(f"{'✅' if success else '❌'} {msg}")
+        return
     
     webapp_url = f"{BASE_URL}/miniapp?user_id={user.id}"
     kb = ReplyKeyboardMarkup(
@@ -48,7 +64,7 @@ async def cmd_start(message: Message):
 # --- АДМИН ПАНЕЛЬ ---
 @dp.message(Command("admin"))
 async def cmd_admin(message: Message):
-    if not db.is_admin(message.from_user.id):
+    if not await adb.is_admin(message.from_user.id):
         await message.answer("⛔ У вас нет прав администратора.")
         return
 
@@ -56,6 +72,7 @@ async def cmd_admin(message: Message):
         keyboard=[
             [types.KeyboardButton(text="➕ Добавить Мерч")],
             [types.KeyboardButton(text="💰 Начислить баллы")],
+            [types.KeyboardButton(text="📋 Начислить списком")],
             [types.KeyboardButton(text="🔙 Выход")]
         ],
         resize_keyboard=True
@@ -70,7 +87,7 @@ async def admin_exit(message: Message, state: FSMContext):
 # --- 1. Добавление Мерча ---
 @dp.message(F.text == "➕ Добавить Мерч")
 async def start_add_merch(message: Message, state: FSMContext):
-    if not db.is_admin(message.from_user.id): return
+    if not await adb.is_admin(message.from_user.id): return
     await message.answer("Введите название товара:", reply_markup=types.ReplyKeyboardRemove())
     await state.set_state(AdminStates.waiting_for_merch_name)
 
@@ -96,7 +113,7 @@ async def process_merch_stock(message: Message, state: FSMContext):
         return
     data = await state.get_data()
     
-    success = db.admin_add_merch(data['name'], data['price'], int(message.text))
+    success = await adb.admin_add_merch(data['name'], data['price'], int(message.text))
     if success:
         await message.answer(f"✅ Товар '{data['name']}' добавлен!")
     else:
@@ -108,7 +125,7 @@ async def process_merch_stock(message: Message, state: FSMContext):
 # --- 2. Начисление баллов ---
 @dp.message(F.text == "💰 Начислить баллы")
 async def start_add_points(message: Message, state: FSMContext):
-    if not db.is_admin(message.from_user.id): return
+    if not await adb.is_admin(message.from_user.id): return
     await message.answer("Введите Telegram ID студента:", reply_markup=types.ReplyKeyboardRemove())
     await state.set_state(AdminStates.waiting_for_student_id_points)
 
@@ -127,7 +144,7 @@ async def process_points_amount(message: Message, state: FSMContext):
         amount = int(message.text)
         data = await state.get_data()
         
-        success, msg = db.admin_add_points(data['target_id'], amount, "Бонус от админа")
+        success, msg = await adb.admin_add_points(data['target_id'], amount, "Бонус от админа")
         await message.answer(f"{'✅' if success else '❌'} {msg}")
         
     except ValueError:
@@ -136,6 +153,68 @@ async def process_points_amount(message: Message, state: FSMContext):
     await state.clear()
     await cmd_admin(message)
 
+# --- 3. Массовое начисление списком / CSV ---
+MAX_REPORTED_ERRORS = 20
+
+@dp.message(F.text == "📋 Начислить списком")
+async def start_bulk_points(message: Message, state: FSMContext):
+    if not await adb.is_admin(message.from_user.id): return
+    await message.answer(
+        "Пришлите CSV-файл или вставьте список, по строке на студента:\n"
+        "<code>номер студенческого, сумма, описание</code>\n"
+        "или по Telegram ID: <code>tg:123456789, сумма, описание</code>\n\n"
+        "Описание необязательно. Отрицательная сумма - списание. "
+        "Повторная загрузка того же списка в тот же день ничего не начислит дважды.",
+        parse_mode="HTML",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+    await state.set_state(AdminStates.waiting_for_grants_list)
+
+@dp.message(AdminStates.waiting_for_grants_list)
+async def process_bulk_points(message: Message, state: FSMContext):
+    if not await adb.is_admin(message.from_user.id): return
+    if message.document:
+        raw = (await bot.download(message.document)).read()
+        try:
+            text = raw.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            text = raw.decode("cp1251")  # CSV из Excel
+        default_description = f"Начисление: {message.document.file_name}"
+    elif message.text:
+        text = message.text
+        default_description = f"Начисление по списку {datetime.now():%d.%m.%Y}"
+    else:
+        await message.answer("❌ Пришлите файл или текст.")
+        return
+
+    rows, errors = parse_grants(text, default_description)
+    failed = list(errors)
+    report = {'applied': 0, 'skipped': 0, 'failed': [], 'error': None}
+    if rows:
+        await message.answer(f"⏳ Обрабатываю {len(rows)} строк...")
+        # Метод сам коммитит каждую пачку - без общего unit of work
+        report = await adb.call(db.admin_bulk_add_points, rows, upload_id(text, default_description),
+                                timeout=120, unit_of_work=False)
+    failed += report['failed']
+    failed.sort(key=lambda f: f[0])
+
+    lines = [
+        f"✅ Проведено: {report['applied']}",
+        f"↩️ Уже было проведено раньше: {report['skipped']}",
+        f"❌ Ошибок: {len(failed)}",
+    ]
+    for line, target, reason in failed[:MAX_REPORTED_ERRORS]:
+        lines.append(f"  строка {line}: {target} - {reason}")
+    if len(failed) > MAX_REPORTED_ERRORS:
+        lines.append(f"  ...и еще {len(failed) - MAX_REPORTED_ERRORS}")
+    if report['error']:
+        lines.append(f"\n⚠️ Обработка прервана ошибкой БД: {report['error']}\n"
+                     "Загрузите список еще раз - проведенные строки не повторятся.")
+    await message.answer("\n".join(lines))
+
+    await state.clear()
+    await cmd_admin(message)
+
 # --- WebApp Data ---
 @dp.message(F.web_app_data)
 async def webapp_data(message: Message):
@@ -144,11 +223,11 @@ async def webapp_data(message: Message):
     user_id = message.from_user.id
     
     if action == 'buy_merch':
-        success, msg = db.buy_merch(user_id, data['merch_id'])
+        success, msg = await adb.buy_merch(user_id, data['merch_id'])
         await message.answer(f"{'✅' if success else '❌'} {msg}")
     
     elif action == 'add_service':
-        success = db.add_service(
+        success, _ = await adb.add_service(
             user_id, 
             data['name'], 
             data['price'], 
@@ -160,10 +239,22 @@ async def webapp_data(message: Message):
             await message.answer("❌ Ошибка при размещении услуги")
     
     elif action == 'buy_service':
-        success, msg = db.buy_service(user_id, data['service_id'])
+        success, msg = await adb.buy_service(user_id, data['service_id'])
         await message.answer(f"{'✅' if success else '❌'} {msg}")
 
+# --- Ошибки ---
+@dp.error(ExceptionTypeFilter(DatabaseTimeout))
+async def on_database_timeout(event: ErrorEvent):
+    # БД не ответила за DB_CALL_TIMEOUT: пользователь не должен остаться без ответа
+    print(f"[DB TIMEOUT] {event.exception}")
+    message = event.update.message
+    if message:
+        await message.answer("⏳ Сервер сейчас перегружен, попробуйте еще раз через минуту.")
+    return True
+
 async def main():
+    db.warmup()
+    PeriodicTask(checkin_desk.flush, float(os.getenv("CHECKIN_FLUSH_SECONDS", "0.5")), name="checkin_flush").start()
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+# catalog.py
+import bisect
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+
+
+class MerchCatalog:
+    """
+    Кэш каталога мерча с номером версии.
+
+    Каталог хранится уже сериализованным в JSON вместе со strong ETag, так что
+    /api/merch отдает готовые байты без запроса к БД. buy_merch и
+    admin_add_merch вызывают bump() - снимок пересобирается при следующем
+    обращении. Изменения, сделанные другим процессом (например, ботом),
+    подхватываются по истечении ttl.
+
+    Журнал изменений (версия, merch_id) позволяет отдавать клиенту только
+    остатки тех товаров, что поменялись с его версии.
+    """
+
+    def __init__(self, loader, ttl=30.0, log_size=1000):
+        self._loader = loader
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._snapshot = None
+        self._changes = deque(maxlen=log_size)  # (version, merch_id | None)
+
+    def bump(self, merch_id=None):
+        """merch_id=None - изменился состав каталога, клиенту нужен полный список"""
+        with self._lock:
+            self.version += 1
+            self._changes.append((self.version, merch_id))
+
+    def snapshot(self):
+        """{'version', 'body', 'etag', 'stock'} - актуальный снимок каталога"""
+        snap = self._fresh_snapshot()
+        if snap:
+            return snap
+        with self._build_lock:
+            # Пока ждали блокировку, снимок мог собрать соседний поток
+            snap = self._fresh_snapshot()
+            if snap:
+                return snap
+            with self._lock:
+                version = self.version
+            rows = self._loader()
+            body = json.dumps(rows, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+            etag = hashlib.sha1(body).hexdigest()
+            with self._lock:
+                old = self._snapshot
+                if old and old["etag"] != etag and old["version"] == version == self.version:
+                    # Каталог поменяли в обход bump() - в другом процессе
+                    self.version += 1
+                    self._changes.append((self.version, None))
+                    version = self.version
+                snap = {
+                    "version": version,
+                    "body": body,
+                    "etag": etag,
+                    "stock": {row["id"]: row["stock"] for row in rows},
+                    "built_at": time.monotonic(),
+                }
+                if version == self.version:
+                    self._snapshot = snap
+            return snap
+
+    def _fresh_snapshot(self):
+        with self._lock:
+            snap = self._snapshot
+            if (snap and snap["version"] == self.version
+                    and time.monotonic() - snap["built_at"] < self.ttl):
+                return snap
+        return None
+
+    def stock_delta(self, since):
+        """
+        Остатки товаров, изменившихся после версии since.
+        full=True - журнал не покрывает since или менялся состав каталога:
+        клиенту стоит заново запросить /api/merch.
+        """
+        snap = self.snapshot()
+        version = snap["version"]
+        if since == version:
+            return {"version": version, "full": False, "stock": {}}
+        with self._lock:
+            covered = bool(self._changes) and self._changes[0][0] <= since + 1
+            changed = [merch_id for v, merch_id in self._changes if since < v <= version]
+        full = since > version or not covered or None in changed
+        ids = snap["stock"].keys() if full else set(changed)
+        # Раскупленные товары в каталог не попадают - для них остаток 0
+        return {"version": version, "full": full,
+                "stock": {merch_id: snap["stock"].get(merch_id, 0) for merch_id in ids}}
+
+
+class ServiceBoard:
+    """
+    Общая для всех пользователей часть биржи услуг.
+
+    Список активных услуг загружается одним запросом и заранее раскладывается
+    по фильтрам статуса и вариантам сортировки. Страница - это бинарный поиск
+    по ключу курсора и срез списка; персональные флаги (is_my_task,
+    am_i_executor) накладываются поверх уже выбранной страницы.
+    add_service / assign_service / complete_service_order / cancel_service_order
+    вызывают bump(service_id): следующий запрос перечитает только эту услугу
+    и переставит ее в готовых списках (копируются лишь списки, где она была
+    или будет). bump() без id и истекший ttl - полная перезагрузка.
+    """
+
+    STATUS_FILTERS = {
+        "active": ("open", "in_progress"),
+        "open": ("open",),
+        "in_progress": ("in_progress",),
+        "completed": ("completed",),
+        "all": ("open", "in_progress", "completed"),
+    }
+    SORTS = {
+        # Ключи возрастают по ходу списка; при равенстве порядок задает id
+        "recent": lambda s: (-s["created_ts"], s["id"]),
+        "price_asc": lambda s: (s["points_cost"], s["id"]),
+        "price_desc": lambda s: (-s["points_cost"], s["id"]),
+    }
+
+    def __init__(self, loader, ttl=10.0):
+        """loader(ids=None) - услуги с id из ids или все активные"""
+        self._loader = loader
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._board = None
+        self._changed = set()  # id услуг, измененных после снимка; None - нужна полная загрузка
+
+    def bump(self, service_id=None):
+        """service_id=None - поменялось неизвестно что, список загрузится целиком"""
+        with self._lock:
+            self.version += 1
+            if service_id is None:
+                self._changed = None
+            elif self._changed is not None:
+                self._changed.add(str(service_id))
+
+    def _fresh_board(self):
+        with self._lock:
+            board = self._board
+            if (board and board["version"] == self.version
+                    and time.monotonic() - board["built_at"] < self.ttl):
+                return board
+        return None
+
+    def _get_board(self):
+        board = self._fresh_board()
+        if board:
+            return board
+        with self._build_lock:
+            board = self._fresh_board()
+            if board:
+                return board
+            with self._lock:
+                version, changed, base = self.version, self._changed, self._board
+                self._changed = set()
+            try:
+                if base and changed is not None and time.monotonic() - base["built_at"] < self.ttl:
+                    board = self._apply(base, changed, self._loader(changed))
+                else:
+                    board = self._build(self._loader())
+            except Exception:
+                with self._lock:
+                    self._changed = None
+                raise
+            board["version"] = version
+            # Изменения, пришедшие во время загрузки, остались в _changed:
+            # их применит следующий запрос
+            with self._lock:
+                self._board = board
+            return board
+
+    def _build(self, services):
+        lists = {}
+        for status_filter, statuses in self.STATUS_FILTERS.items():
+            matching = [s for s in services if s["status"] in statuses]
+            for sort, key in self.SORTS.items():
+                ordered = sorted(matching, key=key)
+                lists[(status_filter, sort)] = (ordered, [key(s) for s in ordered])
+        return {"lists": lists, "services": {str(s["id"]): s for s in services},
+                "built_at": time.monotonic()}
+
+    def _apply(self, base, changed, services):
+        """Новый снимок из base: услуги changed заменены на services (нет в services - удалены)"""
+        fresh = {str(s["id"]): s for s in services}
+        by_id = dict(base["services"])
+        lists = dict(base["lists"])
+        copied = set()
+        for service_id in changed:
+            old, new = by_id.pop(service_id, None), fresh.get(service_id)
+            if new:
+                by_id[service_id] = new
+            for (status_filter, sort), (ordered, keys) in lists.items():
+                statuses, key = self.STATUS_FILTERS[status_filter], self.SORTS[sort]
+                old_in, new_in = old and old["status"] in statuses, new and new["status"] in statuses
+                if not (old_in or new_in):
+                    continue
+                # Списки старого снимка читают другие потоки - меняем копию
+                if (status_filter, sort) not in copied:
+                    ordered, keys = list(ordered), list(keys)
+                    copied.add((status_filter, sort))
+                if old_in:
+                    i = bisect.bisect_left(keys, key(old))
+                    del ordered[i], keys[i]
+                if new_in:
+                    new_key = key(new)
+                    i = bisect.bisect_left(keys, new_key)
+                    ordered.insert(i, new)
+                    keys.insert(i, new_key)
+                lists[(status_filter, sort)] = (ordered, keys)
+        return {"lists": lists, "services": by_id, "built_at": base["built_at"]}
+
+    def page(self, status="active", sort="recent", limit=20, after=None):
+        """
+        Страница услуг: (services, ключ последней или None, если дальше пусто).
+        after - ключ последней услуги предыдущей страницы; ключ не того
+        вида (поддельный курсор) - ValueError.
+        """
+        if status not in self.STATUS_FILTERS or sort not in self.SORTS:
+            raise ValueError("Некорректный фильтр или сортировка")
+        if after and not self._valid_key(after):
+            raise ValueError("Некорректный курсор")
+        ordered, keys = self._get_board()["lists"][(status, sort)]
+        start = bisect.bisect_right(keys, tuple(after)) if after else 0
+        items = ordered[start:start + limit]
+        has_more = start + limit < len(ordered)
+        return items, (keys[start + limit - 1] if has_more else None)
+
+    @staticmethod
+    def _valid_key(key):
+        # Ключ сортировки - (число, id услуги); с другими типами bisect упадет с TypeError
+        return (len(key) == 2 and isinstance(key[0], (int, float)) and not isinstance(key[0], bool)
+                and isinstance(key[1], str))
@@ -0,0 +1,228 @@
+# checkin.py
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+
+# Префикс параметра /start: t.me/<бот>?start=checkin_<токен>
+DEEP_LINK_PREFIX = "checkin_"
+
+SIGNATURE_BYTES = 10
+
+
+def make_token(secret, activity_id, expires_at):
+    """
+    Токен QR-кода мероприятия: id активности, срок действия (unix time) и
+    HMAC-подпись. 40 символов base64url - влезает в параметр /start (до 64).
+    """
+    payload = uuid.UUID(str(activity_id)).bytes + struct.pack(">I", int(expires_at))
+    sig = hmac.new(secret, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(payload + sig).decode().rstrip("=")
+
+
+def parse_token(secret, token, now=None):
+    """(activity_id, None) или (None, причина). Принимает и текст deep link целиком"""
+    token = (token or "").strip()
+    if token.startswith(DEEP_LINK_PREFIX):
+        token = token[len(DEEP_LINK_PREFIX):]
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None, "Неверный QR-код"
+    if len(raw) != 20 + SIGNATURE_BYTES:
+        return None, "Неверный QR-код"
+    payload, sig = raw[:20], raw[20:]
+    expected = hmac.new(secret, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    if not hmac.compare_digest(sig, expected):
+        return None, "Неверный QR-код"
+    if struct.unpack(">I", payload[16:])[0] < (now or time.time()):
+        return None, "QR-код просрочен"
+    return str(uuid.UUID(bytes=payload[:16])), None
+
+
+class ActivityRoster:
+    """Кто уже отмечен на активности и сколько мест занято - в памяти процесса"""
+
+    __slots__ = ("id", "title", "points", "max_participants", "status", "students")
+
+    def __init__(self, row, students):
+        self.id = row["id"]
+        self.title = row["title"]
+        self.points = row["points"]
+        self.max_participants = row["max_participants"]
+        self.status = row["status"]
+        self.students = set(students)
+
+    def is_full(self):
+        return self.max_participants is not None and len(self.students) >= self.max_participants
+
+
+class CheckinDesk:
+    """
+    Отметка на мероприятии по QR-коду или deep link бота.
+
+    scan() отвечает у входа без записи в БД: подпись токена, повтор и
+    свободные места проверяются по составу активности в памяти (грузится
+    один раз на активность), принятый скан встает в очередь. flush() раз в
+    flush_interval забирает из очереди до batch_size сканов и проводит их
+    одной транзакцией db.award_checkins: student_activities, balances,
+    transactions пачкой.
+
+    Память - быстрый ответ, но не последнее слово: бот и webapp - разные
+    процессы, поэтому award_checkins еще раз проверяет уникальный ключ и
+    max_participants под блокировкой активности. Отклоненное там (нет
+    мест, активность закрыта) снимается и из памяти, студент получает
+    событие 'checkin' rejected; повтор из другого процесса просто пропускается.
+    Пачку, которую БД отвергла из-за данных, flush() проводит по одной
+    отметке и отбрасывает с записью в лог только сбойные; при дедлоке или
+    обрыве связи пачка ждет следующего flush(). Очередь живет в памяти: сканы последних flush_interval секунд при
+    падении процесса теряются, после перезапуска их можно повторить.
+    """
+
+    def __init__(self, db, secret, batch_size=500, max_queue=100000):
+        self.db = db
+        self.secret = secret
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self._rosters = {}
+        self._queue = deque()  # (activity_id, student_uuid)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.accepted = 0
+        self.duplicates = 0
+        self.full = 0
+        self.awarded = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls, db):
+        # Бот и webapp должны подписывать и проверять QR одним ключом
+        secret = os.getenv("CHECKIN_SECRET") or os.getenv("BOT_TOKEN") or ""
+        return cls(
+            db,
+            hashlib.sha256(b"checkin:" + secret.encode()).digest(),
+            batch_size=int(os.getenv("CHECKIN_BATCH_SIZE", "500")),
+        )
+
+    def token(self, activity_id, valid_seconds=6 * 3600):
+        return make_token(self.secret, activity_id, time.time() + valid_seconds)
+
+    def roster(self, activity_id):
+        """ActivityRoster из памяти; первый вызов грузит активность из БД"""
+        with self._lock:
+            roster = self._rosters.get(activity_id)
+        if roster:
+            return roster
+        with self._load_lock:
+            with self._lock:
+                roster = self._rosters.get(activity_id)
+            if roster:
+                return roster
+            row, students = self.db.get_activity_roster(activity_id)
+            if not row:
+                return None
+            roster = ActivityRoster(row, students)
+            with self._lock:
+                self._rosters[activity_id] = roster
+            return roster
+
+    def scan(self, telegram_id, token):
+        """(True, сообщение) - отмечен, баллы придут с ближайшей пачкой"""
+        activity_id, error = parse_token(self.secret, token)
+        if error: return False, error
+        student_uuid = self.db._get_student_uuid(telegram_id)
+        if not student_uuid: return False, "Сначала зарегистрируйтесь: /start"
+        roster = self.roster(activity_id)
+        if not roster: return False, "Мероприятие не найдено"
+        if roster.status != 'active': return False, "Мероприятие завершено"
+
+        student_uuid = str(student_uuid)
+        with self._lock:
+            if student_uuid in roster.students:
+                self.duplicates += 1
+                return False, "Вы уже отмечены на этом мероприятии"
+            if roster.is_full():
+                self.full += 1
+                return False, "Свободных мест нет"
+            if len(self._queue) >= self.max_queue:
+                return False, "Слишком много отметок, попробуйте через минуту"
+            roster.students.add(student_uuid)
+            self._queue.append((activity_id, student_uuid))
+            self.accepted += 1
+        return True, f"Вы отмечены на «{roster.title}»: +{roster.points} STC"
+
+    def flush(self):
+        """Проводит очередь пачками; возвращает число начисленных"""
+        total = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return total
+                try:
+                    report = self.db.award_checkins(batch)
+                    left = batch if report is None else []
+                except Exception as e:
+                    # Пачку не пропускает какая-то из отметок - проводим по одной
+                    print(f"[CHECKIN ERROR] Пачка из {len(batch)} не проведена ({e}), провожу по одной")
+                    report, left = self._award_one_by_one(batch)
+                if left:
+                    # БД недоступна - вернем непроведенное в начало очереди до следующего раза
+                    with self._lock:
+                        self._queue.extendleft(reversed(left))
+                if report is None:
+                    return total
+                with self._lock:
+                    for activity_id, student_uuid, _ in report['rejected']:
+                        roster = self._rosters.get(activity_id)
+                        if roster:
+                            roster.students.discard(student_uuid)
+                    for activity_id, status in report['closed'].items():
+                        roster = self._rosters.get(activity_id)
+                        if roster:
+                            roster.status = status
+                    self.awarded += report['awarded']
+                    self.rejected += len(report['rejected'])
+                    self.duplicates += report['duplicates']
+                total += report['awarded']
+                if left:
+                    return total
+
+    def _award_one_by_one(self, batch):
+        """
+        (отчет, непроведенный хвост). Отметка, на которой падает БД из-за
+        данных, логируется и отбрасывается как rejected; при недоступной БД
+        остаток пачки возвращается для повтора.
+        """
+        report = {'awarded': 0, 'duplicates': 0, 'rejected': [], 'closed': {}}
+        for i, (activity_id, student_uuid) in enumerate(batch):
+            try:
+                one = self.db.award_checkins([(activity_id, student_uuid)])
+            except Exception as e:
+                print(f"[CHECKIN ERROR] Отметка {student_uuid} на {activity_id} отброшена: {e}")
+                report['rejected'].append((activity_id, student_uuid, "Ошибка начисления"))
+                continue
+            if one is None:
+                return report, batch[i:]
+            report['awarded'] += one['awarded']
+            report['duplicates'] += one['duplicates']
+            report['rejected'].extend(one['rejected'])
+            report['closed'].update(one['closed'])
+        return report, []
+
+    def forget(self, activity_id):
+        with self._lock:
+            self._rosters.pop(activity_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"activities": len(self._rosters), "queued": len(self._queue),
+                    "accepted": self.accepted, "duplicates": self.duplicates, "full": self.full,
+                    "awarded": self.awarded, "rejected": self.rejected}
@@ -1,58 +1,259 @@
-import mysql.connector
+import base64
+import functools
+import json
 import os
+import random
+import time
 import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
+import metrics
+from auctions import AuctionBook
+from backends import backend_from_env
+from cache import LRUCache
+from leaderboards import SCOPES, WINDOWS, previous_start, window_end, window_start
+from catalog import MerchCatalog, ServiceBoard
+from pool import ConnectionPool, PoolTimeout
+from uow import UnitOfWork, current_uow
 
 load_dotenv()
 
+# Допустимые периоды графика /api/stats, дней
+STATS_RANGES = (7, 30, 90, 365)
+
+# Разделы /api/dashboard
+DASHBOARD_SECTIONS = ('user', 'stats', 'history', 'leaderboard')
+
+# Конечные автоматы биржи услуг: статус -> куда из него можно перейти.
+# Услуга возвращается в open, когда ее заказ отменяют.
+SERVICE_TRANSITIONS = {
+    'services': {
+        'open': ('in_progress',),
+        'in_progress': ('completed', 'open'),
+        'completed': (),
+    },
+    'service_orders': {
+        'in_progress': ('completed', 'cancelled'),
+        'completed': (),
+        'cancelled': (),
+    },
+}
+
+
+# Пространство имен uuid5 для id транзакций массовых начислений
+BULK_GRANT_NAMESPACE = uuid.UUID('6f1c2a3e-8d4b-5e9f-a0b1-c2d3e4f5a6b7')
+
+# Миграции схемы для баз, созданных по старому diplom.sql
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "migrations")
+
+
+def _sql_statements(text):
+    """Файл миграции -> отдельные запросы; комментарии -- отбрасываются"""
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith("--")]
+    return [stmt.strip() for stmt in "\n".join(lines).split(";") if stmt.strip()]
+
+
+# Инфраструктура unit of work и кэша - не запросы к БД, ее не меряем
+@metrics.instrument_methods(skip=(
+    'unit_of_work', 'run_in_transaction', 'after_commit', 'transactional',
+    'cache_stats',
+))
 class Database:
-    def __init__(self):
-        # db.py
-        self.host = os.getenv("MYSQL_HOST", "127.0.0.1")
-        self.user = os.getenv("MYSQL_USER", "root")
-        self.password = os.getenv("MYSQL_PASSWORD", "password") # Теперь он найдет Danila.789
-        self.database = os.getenv("MYSQL_DB", "store")
+    def __init__(self, backend=None):
+        # MySQL или SQLite - см. backends.backend_from_env (DB_BACKEND)
+        self.backend = backend or backend_from_env()
 
+        # Один пул на процесс: им пользуются и Flask-роуты, и бот
+        min_size, max_size = self.backend.pool_limits(
+            int(os.getenv("MYSQL_POOL_MIN", "2")), int(os.getenv("MYSQL_POOL_MAX", "10"))
+        )
+        self.pool = ConnectionPool(
+            self._connect,
+            min_size=min_size,
+            max_size=max_size,
+            timeout=float(os.getenv("MYSQL_POOL_TIMEOUT", "5")),
+            idle_timeout=float(os.getenv("MYSQL_POOL_IDLE", "300")),
+        )
+        self.deadlock_retries = int(os.getenv("MYSQL_DEADLOCK_RETRIES", "3"))
+        # Антиснайпинг: ставка за AUCTION_SNIPE_WINDOW секунд до конца
+        # продлевает торги до now + AUCTION_SNIPE_EXTEND (0 - выключен)
+        self.auction_snipe_window = float(os.getenv("AUCTION_SNIPE_WINDOW", "0"))
+        self.auction_snipe_extend = float(os.getenv("AUCTION_SNIPE_EXTEND", "120"))
 
-    def _get_connection(self):
+        # Telegram ID -> UUID студента. Связка не меняется после регистрации,
+        # поэтому TTL по умолчанию выключен (STUDENT_CACHE_TTL=0).
+        ttl = float(os.getenv("STUDENT_CACHE_TTL", "0"))
+        self.student_cache = LRUCache(
+            maxsize=int(os.getenv("STUDENT_CACHE_SIZE", "10000")),
+            ttl=ttl or None,
+        )
+
+        # Каталог мерча: версия растет при покупке и добавлении товара
+        self.merch_catalog = MerchCatalog(
+            self.get_all_merch, ttl=float(os.getenv("MERCH_CACHE_TTL", "30"))
+        )
+        # Общий список биржи услуг: сбрасывается при изменении услуг и заказов
+        self.service_board = ServiceBoard(
+            self._load_service_board, ttl=float(os.getenv("SERVICES_CACHE_TTL", "10"))
+        )
+        # Текущие ставки аукционов в памяти + очередь ставок на каждый аукцион
+        self.auction_book = AuctionBook(
+            self._load_auction, ttl=float(os.getenv("AUCTION_CACHE_TTL", "1"))
+        )
+
+    def _connect(self):
+        return self.backend.connect()
+
+    def _checkout(self):
+        start = time.perf_counter()
         try:
-            return mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database
-            )
-        except mysql.connector.Error as err:
+            conn = self.pool.connection()
+        except PoolTimeout as err:
+            print(f"[DB ERROR] Pool exhausted: {err}")
+            return None
+        except self.backend.Error as err:
             print(f"[DB ERROR] Connection failed: {err}")
             return None
+        metrics.observe_connection_wait(time.perf_counter() - start)
+        # Курсоры считают запросы, время и строки под текущим методом
+        return metrics.InstrumentedConnection(conn)
+
+    def _get_connection(self):
+        """
+        Внутри unit of work - общее соединение запроса,
+        иначе - соединение из пула. conn.close() возвращает его обратно.
+        """
+        uow = current_uow.get()
+        if uow is not None:
+            return uow.bound_connection()
+        return self._checkout()
+
+    # ==========================
+    # UNIT OF WORK
+    # ==========================
+
+    @contextmanager
+    def unit_of_work(self):
+        """
+        Все вызовы Database внутри блока идут через одно соединение
+        и одну транзакцию: COMMIT при успехе, ROLLBACK при ошибке.
+        Вложенные блоки присоединяются к внешнему.
+        """
+        uow = current_uow.get()
+        if uow is not None:
+            uow.depth += 1
+            try:
+                yield uow
+            finally:
+                uow.depth -= 1
+            return
+
+        token = metrics.current_method.set('unit_of_work')
+        try:
+            conn = self._checkout()
+        finally:
+            metrics.current_method.reset(token)
+        if conn is None:
+            # Пул недоступен - методы сами вернут свои "Ошибка БД"
+            yield None
+            return
+        try:
+            self.backend.begin_unit_of_work(conn)
+        except Exception:
+            conn.close()
+            raise
+
+        uow = UnitOfWork(conn, self.backend.is_deadlock)
+        token = current_uow.set(uow)
+        failed = True
+        try:
+            yield uow
+            failed = False
+        finally:
+            current_uow.reset(token)
+            uow.finish(failed)
+
+    def run_in_transaction(self, fn, *args, **kwargs):
+        """
+        Выполняет fn в unit of work. При дедлоке (backend.is_deadlock) транзакция
+        откатывается и fn повторяется с небольшой паузой.
+        """
+        if current_uow.get() is not None:
+            return fn(*args, **kwargs)
+
+        for attempt in range(self.deadlock_retries + 1):
+            last = attempt == self.deadlock_retries
+            try:
+                with self.unit_of_work() as uow:
+                    result = fn(*args, **kwargs)
+            except Exception as err:
+                if not self.backend.is_deadlock(err) or last:
+                    raise
+            else:
+                if uow is None or not uow.deadlocked or last:
+                    return result
+            print(f"[DB] Deadlock, повтор {attempt + 1}/{self.deadlock_retries}")
+            time.sleep(random.uniform(0.01, 0.05) * (2 ** attempt))
+
+    def after_commit(self, fn):
+        """Внутри unit of work откладывает fn до COMMIT, иначе вызывает сразу"""
+        uow = current_uow.get()
+        if uow is not None:
+            uow.after_commit(fn)
+        else:
+            fn()
+
+    def transactional(self, fn):
+        """Декоратор для Flask-роутов: один запрос = один unit of work"""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return self.run_in_transaction(fn, *args, **kwargs)
+        return wrapper
+
+    def warmup(self):
+        """Заранее открывает минимальное число соединений пула"""
+        try:
+            self.pool.warmup()
+        except (PoolTimeout, self.backend.Error) as err:
+            print(f"[DB ERROR] Pool warmup failed: {err}")
+
+    # ==========================
+    # КЭШ TELEGRAM ID -> UUID
+    # ==========================
+
+    def _remember_student(self, telegram_id, student_uuid):
+        self.student_cache.set(int(telegram_id), student_uuid)
+
+    def cache_stats(self):
+        return {"students": self.student_cache.stats(),
+                "merch_catalog": {"version": self.merch_catalog.version},
+                "service_board": {"version": self.service_board.version},
+                "auctions": self.auction_book.stats()}
 
     def _get_student_uuid(self, telegram_id):
+        # Превращаем в int, чтобы убрать возможные пробелы или кавычки
+        try:
+            tg_id_clean = int(telegram_id)
+        except (TypeError, ValueError):
+            return None
+
+        cached = self.student_cache.get(tg_id_clean)
+        if cached is not None:
+            return cached
+
         conn = self._get_connection()
         if not conn: return None
         try:
-            # Превращаем в int, чтобы убрать возможные пробелы или кавычки
-            tg_id_clean = int(telegram_id)
-            
             cur = conn.cursor(dictionary=True)
-            
-            # ВНИМАНИЕ: Проверь, что имя колонки совпадает с твоей таблицей MySQL!
-            # В твоем последнем CREATE TABLE это telegram_user_id
-            query = "SELECT id FROM students WHERE telegram_user_id = %s"
-            
-            # ДЛЯ ОТЛАДКИ (будет видно в консоли терминала):
-            print(f"DEBUG: Ищу студента с telegram_user_id={tg_id_clean}")
-            
-            cur.execute(query, (tg_id_clean,))
+            cur.execute("SELECT id FROM students WHERE telegram_user_id = %s", (tg_id_clean,))
             res = cur.fetchone()
-            
-            if res:
-                print(f"DEBUG: Нашел UUID: {res['id']}")
-                return res['id']
-            else:
-                print(f"DEBUG: Студент не найден в БД!")
+            if not res:
                 return None
+            self._remember_student(tg_id_clean, res['id'])
+            return res['id']
         except Exception as e:
-            print(f"DEBUG ERROR: {e}")
+            print(f"[DB ERROR] _get_student_uuid: {e}")
             return None
         finally:
             conn.close()
@@ -68,19 +269,33 @@ class Database:
                 SELECT s.id, s.telegram_user_id, s.first_name, s.last_name, 
                        IFNULL(b.current_points, 0) as current_points,
                        IFNULL(b.total_earned, 0) as total_earned,
-                       IFNULL(b.total_spent, 0) as total_spent
+                       IFNULL(b.total_spent, 0) as total_spent,
+                       IFNULL(b.held_points, 0) as held_points
                 FROM students s
                 LEFT JOIN balances b ON s.id = b.student_id
                 WHERE s.telegram_user_id = %s
             """
             cur.execute(query, (telegram_id,))
-            return cur.fetchone()
+            student = cur.fetchone()
+            if student:
+                self._remember_student(telegram_id, student['id'])
+            return student
         finally:
             conn.close()
 
     def get_or_create_student(self, telegram_id, first_name="", last_name="", username=""):
-        """Создает студента, если его нет (для тестов/авторегистрации)"""
-        if self.get_student_by_tg_id(telegram_id):
+        """
+        Идемпотентная регистрация (для /start и авторегистрации).
+        Вставка студента - upsert без изменений при конфликте, поэтому
+        одновременные /start одного пользователя не падают на уникальном ключе:
+        второй дождется первого и просто прочитает его id.
+        """
+        # Ключ кэша - int, как в _remember_student: id из init data мини-аппа приходит строкой
+        try:
+            telegram_id = int(telegram_id)
+        except (TypeError, ValueError):
+            return False
+        if self.student_cache.get(telegram_id):
             return True
 
         conn = self._get_connection()
@@ -91,18 +306,33 @@ class Database:
             # Генерируем фейковые уникальные поля, если их нет
             stud_id_code = f"STU-{telegram_id}"
             
-            # 1. Создаем студента
-            cur.execute("""
+            # 1. Создаем студента (0 строк - уже зарегистрирован)
+            cur.execute(f"""
                 INSERT INTO students (id, telegram_user_id, student_id, first_name, last_name, email)
                 VALUES (%s, %s, %s, %s, %s, NULL)
+                {self.backend.upsert(('telegram_user_id',))}
             """, (new_uuid, telegram_id, stud_id_code, first_name, last_name))
 
-            # 2. Создаем баланс
-            cur.execute("""
-                INSERT INTO balances (student_id, current_points) VALUES (%s, 0)
-            """, (new_uuid,))
+            if cur.rowcount == 1:
+                # 2. Создаем баланс
+                cur.execute(f"""
+                    INSERT INTO balances (student_id, current_points) VALUES (%s, 0)
+                    {self.backend.upsert(('student_id',))}
+                """, (new_uuid,))
+                self._sync_ranking(cur, [new_uuid])
+                student_uuid = new_uuid
+            else:
+                cur.execute("SELECT id FROM students WHERE telegram_user_id = %s", (telegram_id,))
+                row = cur.fetchone()
+                if not row:
+                    # Конфликт не по telegram_user_id (занят student_id)
+                    conn.rollback()
+                    print(f"[DB CREATE USER ERROR] {stud_id_code} уже занят")
+                    return False
+                student_uuid = row[0]
             
             conn.commit()
+            self.after_commit(lambda: self._remember_student(telegram_id, student_uuid))
             return True
         except Exception as e:
             print(f"[DB CREATE USER ERROR] {e}")
@@ -111,329 +341,1733 @@ class Database:
         finally:
             conn.close()
 
-    def get_user_stats(self, telegram_id):
-        """Статистика для графика (по транзакциям)"""
-        uuid_id = self._get_student_uuid(telegram_id)
-        if not uuid_id: return []
+    def import_students(self, rows, chunk_size=500):
+        """
+        Импорт студентов из списка деканата (см. roster.parse_roster) пачками.
+        Факультеты и группы создаются при необходимости, уже существующие
+        студенты (по student_id) обновляют ФИО, группу и факультет.
+        Telegram ID у импортированных пустой. Баланс создается сразу.
+
+        Возвращает {'created', 'updated', 'error'}; error - ошибка БД,
+        импорт прерван на этой пачке (повторный запуск безопасен).
+        """
+        report = {'created': 0, 'updated': 0, 'error': None}
+        for start in range(0, len(rows), chunk_size):
+            conn = self._get_connection()
+            if not conn:
+                report['error'] = "Ошибка БД"
+                return report
+            try:
+                created, updated = self._import_students_chunk(conn.cursor(), rows[start:start + chunk_size])
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"[DB ERROR] Импорт студентов: {e}")
+                report['error'] = str(e)
+                return report
+            finally:
+                conn.close()
+            report['created'] += created
+            report['updated'] += updated
+        return report
+
+    def _import_students_chunk(self, cur, chunk):
+        # 1. Факультеты и группы: upsert + один SELECT за id
+        faculties = {r['faculty']: r['faculty_name'] or r['faculty'] for r in chunk if r['faculty']}
+        faculty_ids = {}
+        if faculties:
+            cur.executemany(f"""
+                INSERT INTO faculties (code, name) VALUES (%s, %s)
+                {self.backend.upsert(('code',))}
+            """, list(faculties.items()))
+            marks = ", ".join(["%s"] * len(faculties))
+            cur.execute(f"SELECT code, id FROM faculties WHERE code IN ({marks})", tuple(faculties))
+            faculty_ids = dict(cur.fetchall())
+
+        groups = {r['group']: faculty_ids[r['faculty']] for r in chunk if r['group'] and r['faculty']}
+        group_ids = {}
+        if groups:
+            cur.executemany(f"""
+                INSERT INTO `groups` (group_code, faculty_id) VALUES (%s, %s)
+                {self.backend.upsert(('group_code',))}
+            """, list(groups.items()))
+        codes = {r['group'] for r in chunk if r['group']}
+        if codes:
+            marks = ", ".join(["%s"] * len(codes))
+            cur.execute(f"SELECT group_code, id FROM `groups` WHERE group_code IN ({marks})", tuple(codes))
+            group_ids = dict(cur.fetchall())
+
+        # 2. Студенты: upsert по student_id
+        marks = ", ".join(["%s"] * len(chunk))
+        student_codes = tuple(r['student_id'] for r in chunk)
+        cur.execute(f"SELECT student_id FROM students WHERE student_id IN ({marks})", student_codes)
+        existing = {row[0] for row in cur.fetchall()}
+
+        cur.executemany(f"""
+            INSERT INTO students (id, student_id, last_name, first_name, middle_name, group_id, faculty_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            {self.backend.upsert(('student_id',), {col: f'NEW({col})' for col in (
+                'last_name', 'first_name', 'middle_name', 'group_id', 'faculty_id')})}
+        """, [(str(uuid.uuid4()), r['student_id'], r['last_name'], r['first_name'], r['middle_name'],
+               group_ids.get(r['group']), faculty_ids.get(r['faculty'])) for r in chunk])
+
+        # 3. Балансы новым студентам
+        cur.execute(f"SELECT id FROM students WHERE student_id IN ({marks})", student_codes)
+        uuids = [row[0] for row in cur.fetchall()]
+        cur.executemany(f"""
+            INSERT INTO balances (student_id, current_points) VALUES (%s, 0)
+            {self.backend.upsert(('student_id',))}
+        """, [(u,) for u in uuids])
+        self._sync_ranking(cur, uuids)
+
+        created = len(set(student_codes) - existing)
+        return created, len(set(student_codes)) - created
+
+    # ==========================
+    # ТРАНЗАКЦИИ И СТАТИСТИКА
+    # ==========================
+
+    def _record_transactions(self, cur, rows, ids=None):
+        """
+        Пишет строки в transactions и в той же транзакции обновляет
+        дневные итоги daily_totals.
+        rows: [(student_uuid, type, amount, description, entity_type, entity_id)]
+        ids - заранее известные id транзакций (по умолчанию uuid4).
+        Возвращает id созданных транзакций.
+        """
+        ids = ids or [str(uuid.uuid4()) for _ in rows]
+        cur.executemany("""
+            INSERT INTO transactions (id, student_id, type, amount, description, entity_type, entity_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, [(tx_id,) + tuple(row) for tx_id, row in zip(ids, rows)])
+        # День берем из самой транзакции, чтобы итоги не разъехались около полуночи
+        cur.executemany(f"""
+            INSERT INTO daily_totals (student_id, day, type, total, tx_count)
+            SELECT student_id, DATE(created_at), type, amount, 1 FROM transactions WHERE id = %s
+            {self.backend.upsert(('student_id', 'day', 'type'),
+                                 {'total': 'total + NEW(total)', 'tx_count': 'tx_count + 1'})}
+        """, [(tx_id,) for tx_id in ids])
+        self._add_window_points(cur, rows)
+
+        # Мини-апп получает новую строку истории и новый баланс без перезапроса
+        created_at = datetime.now().strftime('%d.%m %H:%M')
+        self._queue_events(cur, [
+            (row[0], {'type': 'history', 'item': {
+                'id': tx_id, 'description': row[3], 'amount': row[2], 'type': row[1],
+                'entity_type': row[4], 'created_at': created_at,
+            }})
+            for tx_id, row in zip(ids, rows)
+        ], balances_of={row[0] for row in rows})
+        return ids
+
+    # ==========================
+    # СОБЫТИЯ ДЛЯ МИНИ-АППА (SSE)
+    # ==========================
 
+    def _queue_events(self, cur, events, balances_of=()):
+        """
+        Кладет события в outbox (таблица events) в текущей транзакции: они
+        уйдут подписчикам, только если операция закоммитится, и дойдут до
+        webapp, даже если операцию провел бот. Курсор - dictionary=True.
+        events - [(student_uuid, payload)]; balances_of - кому еще отправить
+        событие 'balance' с балансом после операции.
+        """
+        uuids = {student_uuid for student_uuid, _ in events} | set(balances_of)
+        if not uuids: return
+        marks = ", ".join(["%s"] * len(uuids))
+        cur.execute(f"""
+            SELECT s.id, s.telegram_user_id, b.current_points, b.total_earned, b.total_spent, b.held_points
+            FROM students s LEFT JOIN balances b ON b.student_id = s.id
+            WHERE s.id IN ({marks})
+        """, tuple(uuids))
+        students = {str(row['id']): row for row in cur.fetchall()}
+
+        rows = []
+        for student_uuid in balances_of:
+            st = students.get(str(student_uuid))
+            if st and st['telegram_user_id'] and st['current_points'] is not None:
+                rows.append((st['telegram_user_id'], json.dumps({
+                    'type': 'balance', 'current_points': st['current_points'],
+                    'total_earned': st['total_earned'], 'total_spent': st['total_spent'],
+                    'held_points': st['held_points'],
+                })))
+        for student_uuid, payload in events:
+            st = students.get(str(student_uuid))
+            # У импортированных без Telegram ID мини-аппа еще нет
+            if st and st['telegram_user_id']:
+                rows.append((st['telegram_user_id'], json.dumps(payload, ensure_ascii=False)))
+        if rows:
+            cur.executemany("INSERT INTO events (telegram_user_id, payload) VALUES (%s, %s)", rows)
+
+    def _queue_task_event(self, cur, order, status):
+        """
+        Статус заказа услуги - заказчику и исполнителю. Новые status/version
+        услуги мини-апп применяет к уже показанной карточке без перезагрузки биржи.
+        """
+        cur.execute("SELECT status, version FROM services WHERE id = %s", (order['service_id'],))
+        service = cur.fetchone()
+        payload = {'type': 'task', 'service_id': order['service_id'], 'order_id': order['id'], 'status': status,
+                   'service_status': service['status'], 'version': service['version']}
+        self._queue_events(cur, [(order['provider_id'], payload), (order['executor_id'], payload)])
+
+    def get_last_event_id(self):
+        """Последний id в outbox (0 - пусто); None - БД недоступна"""
         conn = self._get_connection()
-        if not conn: return []
+        if not conn: return None
         try:
-            cur = conn.cursor(dictionary=True)
-            # Группируем расходы по дням
-            cur.execute("""
-                SELECT DATE_FORMAT(created_at, '%d.%m') as date, SUM(amount) as total
-                FROM transactions
-                WHERE student_id = %s AND type = 'spend'
-                GROUP BY DATE(created_at)
-                ORDER BY created_at DESC
-                LIMIT 7
-            """, (uuid_id,))
-            data = cur.fetchall()
-            return list(reversed(data)) # Чтобы график шел слева направо
+            cur = conn.cursor()
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM events")
+            return cur.fetchone()[0]
         finally:
             conn.close()
 
-    def get_student_history(self, telegram_id):
-        """История операций"""
-        uuid_id = self._get_student_uuid(telegram_id)
-        if not uuid_id: return []
-
+    def get_events_after(self, after_id, limit=1000):
+        """[(id, telegram_user_id, payload)] по возрастанию id"""
         conn = self._get_connection()
         if not conn: return []
         try:
-            cur = conn.cursor(dictionary=True)
+            cur = conn.cursor()
             cur.execute("""
-                SELECT description, amount, type, DATE_FORMAT(created_at, '%d.%m %H:%i') as created_at
-                FROM transactions
-                WHERE student_id = %s
-                ORDER BY created_at DESC
-                LIMIT 20
-            """, (uuid_id,))
-            return cur.fetchall()
+                SELECT id, telegram_user_id, payload FROM events WHERE id > %s ORDER BY id LIMIT %s
+            """, (after_id, limit))
+            return [tuple(row) for row in cur.fetchall()]
         finally:
             conn.close()
 
-    def get_leaderboard(self):
-        """Топ студентов по балансу"""
+    def prune_events(self, older_than_seconds):
         conn = self._get_connection()
-        if not conn: return []
+        if not conn: return 0
         try:
-            cur = conn.cursor(dictionary=True)
+            cur = conn.cursor()
+            cur.execute("DELETE FROM events WHERE created_at < %s",
+                        (datetime.now() - timedelta(seconds=older_than_seconds),))
+            conn.commit()
+            return cur.rowcount
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB ERROR] Очистка событий: {e}")
+            return 0
+        finally:
+            conn.close()
+
+    def apply_migrations(self, path=MIGRATIONS_PATH):
+        """
+        Применяет migrations/*.sql, которых еще нет в schema_migrations, по
+        порядку имен. Возвращает список примененных или None при ошибке.
+        DDL в MySQL коммитится сам: упавшую на середине миграцию надо
+        доделать вручную и отметить в schema_migrations.
+        """
+        conn = self._get_connection()
+        if not conn: return None
+        name = None
+        applied = []
+        try:
+            cur = conn.cursor()
             cur.execute("""
-                SELECT s.first_name, b.current_points 
-                FROM students s
-                JOIN balances b ON s.id = b.student_id
-                ORDER BY b.current_points DESC
-                LIMIT 10
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name VARCHAR(100) PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
             """)
-            return cur.fetchall()
+            cur.execute("SELECT name FROM schema_migrations")
+            done = {row[0] for row in cur.fetchall()}
+            for file_name in sorted(os.listdir(path)):
+                name, ext = os.path.splitext(file_name)
+                if ext != ".sql" or name in done:
+                    continue
+                with open(os.path.join(path, file_name), encoding="utf-8") as f:
+                    for statement in _sql_statements(f.read()):
+                        cur.execute(statement)
+                cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+                conn.commit()
+                applied.append(name)
+                print(f"[MIGRATE] {name}")
+            return applied
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB ERROR] Миграция {name}: {e}")
+            return None
         finally:
             conn.close()
 
-    def get_all_merch(self):
+    def backfill_daily_totals(self, batch_size=1000):
+        """
+        Пересобирает daily_totals из transactions пачками студентов.
+        Каждая пачка - отдельная транзакция, поэтому можно запускать на живой базе.
+        """
+        last_id, students, days = '', 0, 0
+        while True:
+            conn = self._get_connection()
+            if not conn: return False
+            try:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT id FROM students WHERE id > %s ORDER BY id LIMIT %s
+                """, (last_id, batch_size))
+                batch = [row[0] for row in cur.fetchall()]
+                if not batch:
+                    print(f"[BACKFILL] daily_totals: {students} студентов, {days} строк")
+                    return True
+                marks = ", ".join(["%s"] * len(batch))
+                cur.execute(f"DELETE FROM daily_totals WHERE student_id IN ({marks})", tuple(batch))
+                cur.execute(f"""
+                    INSERT INTO daily_totals (student_id, day, type, total, tx_count)
+                    SELECT student_id, DATE(created_at), type, SUM(amount), COUNT(*)
+                    FROM transactions
+                    WHERE student_id IN ({marks})
+                    GROUP BY student_id, DATE(created_at), type
+                """, tuple(batch))
+                days += cur.rowcount
+                conn.commit()
+                students += len(batch)
+                last_id = batch[-1]
+            except Exception as e:
+                print(f"[BACKFILL ERROR] {e}")
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+
+    def get_user_stats(self, telegram_id, days=7, buckets=None):
+        """
+        Заработано/потрачено за последние days дней для графика.
+        Читает daily_totals (не больше days строк на тип), а не сырые транзакции,
+        и сводит дни в buckets столбиков (по умолчанию не больше 30).
+        """
+        uuid_id = self._get_student_uuid(telegram_id)
+        if not uuid_id: return []
+
+        buckets = max(1, min(buckets or min(days, 30), days))
+        size = -(-days // buckets)  # дней в одном столбике, округление вверх
+        start = date.today() - timedelta(days=days - 1)
+
         conn = self._get_connection()
         if not conn: return []
         try:
             cur = conn.cursor(dictionary=True)
-            cur.execute("SELECT * FROM merch WHERE stock > 0 ORDER BY price_points ASC")
-            return cur.fetchall()
+            cur.execute("""
+                SELECT day, type, total FROM daily_totals
+                WHERE student_id = %s AND day >= %s AND type IN ('earn', 'spend')
+            """, (uuid_id, start))
+            rows = cur.fetchall()
         finally:
             conn.close()
 
-    def buy_merch(self, telegram_id, merch_id):
-        """Покупка мерча (с транзакцией)"""
-        buyer_uuid = self._get_student_uuid(telegram_id)
-        if not buyer_uuid: return False, "Пользователь не найден"
+        series = []
+        for i in range(-(-days // size)):
+            bucket_start = start + timedelta(days=i * size)
+            series.append({'date': bucket_start.strftime('%d.%m'), 'earned': 0, 'spent': 0})
+        for row in rows:
+            index = (row['day'] - start).days // size
+            if not 0 <= index < len(series): continue  # разница часовых поясов БД и сервера
+            series[index]['earned' if row['type'] == 'earn' else 'spent'] += int(row['total'])
+        return series
 
-        conn = self._get_connection()
-        if not conn: return False, "Ошибка БД"
-        
+    @staticmethod
+    def _encode_cursor(values):
+        raw = json.dumps(list(values), ensure_ascii=False).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor, size):
+        """Курсор -> список из size значений. ValueError, если курсор испорчен."""
         try:
-            cur = conn.cursor(dictionary=True)
-            
-            # 1. Проверяем товар
-            cur.execute("SELECT name, price_points, stock FROM merch WHERE id = %s", (merch_id,))
-            item = cur.fetchone()
-            if not item: return False, "Товар не найден"
-            if item['stock'] < 1: return False, "Товар закончился"
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except Exception:
+            values = None
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError("Некорректный курсор")
+        return values
 
-            # 2. Проверяем баланс
-            cur.execute("SELECT current_points FROM balances WHERE student_id = %s", (buyer_uuid,))
-            bal = cur.fetchone()
-            if not bal or bal['current_points'] < item['price_points']:
-                return False, "Недостаточно средств"
+    def get_student_history(self, telegram_id, limit=20, cursor=None, tx_type=None, entity_type=None):
+        """
+        История операций постранично, от новых к старым.
 
-            cost = item['price_points']
+        Keyset-пагинация по (created_at, id): каждая страница - это поиск по
+        индексу idx_transactions_student_time (InnoDB хранит id в конце
+        вторичного индекса), поэтому глубина прокрутки не влияет на стоимость.
+        Фильтры по type / entity_type обслуживают свои составные индексы.
+        Возвращает {'items': [...], 'next_cursor': str | None}.
+        """
+        page = {'items': [], 'next_cursor': None}
+        uuid_id = self._get_student_uuid(telegram_id)
+        if not uuid_id: return page
 
-            # --- ТРАНЗАКЦИЯ ---
-            # Списываем деньги
-            cur.execute("UPDATE balances SET current_points = current_points - %s, total_spent = total_spent + %s WHERE student_id = %s", (cost, cost, buyer_uuid))
-            
-            # Уменьшаем сток
-            cur.execute("UPDATE merch SET stock = stock - 1 WHERE id = %s", (merch_id,))
-            
-            # Создаем заказ
-            order_id = str(uuid.uuid4())
-            cur.execute("INSERT INTO merch_orders (id, merch_id, buyer_id, quantity, status) VALUES (%s, %s, %s, 1, 'completed')", (order_id, merch_id, buyer_uuid))
-            
-            # Записываем в историю
-            trans_id = str(uuid.uuid4())
-            cur.execute("""
-                INSERT INTO transactions (id, student_id, type, amount, description, entity_type, entity_id)
-                VALUES (%s, %s, 'spend', %s, %s, 'merch', %s)
-            """, (trans_id, buyer_uuid, cost, f"Покупка: {item['name']}", merch_id))
+        # Колонки квалифицированы: created_at в SELECT - это отформатированная строка
+        where, params = ["t.student_id = %s"], [uuid_id]
+        if tx_type:
+            where.append("t.type = %s")
+            params.append(tx_type)
+        if entity_type:
+            where.append("t.entity_type = %s")
+            params.append(entity_type)
+        if cursor:
+            created_at, row_id = self._decode_cursor(cursor, 2)
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except (TypeError, ValueError):
+                raise ValueError("Некорректный курсор")
+            # id транзакции - строка; список или объект уронил бы драйвер (500)
+            if not isinstance(row_id, str):
+                raise ValueError("Некорректный курсор")
+            where.append("(t.created_at < %s OR (t.created_at = %s AND t.id < %s))")
+            params.extend([created_at, created_at, row_id])
+        params.append(limit + 1)
 
-            conn.commit()
-            return True, f"Вы купили {item['name']}"
-        except Exception as e:
-            conn.rollback()
-            return False, str(e)
+        conn = self._get_connection()
+        if not conn: return page
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(f"""
+                SELECT id, description, amount, type, entity_type, created_at AS created_raw,
+                       {self.backend.date_format('created_at', '%d.%m %H:%M')} as created_at
+                FROM transactions t
+                WHERE {' AND '.join(where)}
+                ORDER BY t.created_at DESC, t.id DESC
+                LIMIT %s
+            """, tuple(params))
+            rows = cur.fetchall()
         finally:
             conn.close()
 
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            page['next_cursor'] = self._encode_cursor([last['created_raw'].isoformat(sep=' '), last['id']])
+        for row in rows:
+            del row['created_raw']
+        page['items'] = rows
+        return page
+
+    def get_dashboard(self, telegram_id, sections=DASHBOARD_SECTIONS):
+        """
+        Данные главного экрана одним заходом: одно соединение,
+        по одному запросу на раздел. Ненужные разделы не запрашиваются.
+        """
+        result = {}
+        with self.unit_of_work():
+            if 'user' in sections:
+                result['user'] = self.get_student_by_tg_id(telegram_id)
+            if 'stats' in sections:
+                result['stats'] = self.get_user_stats(telegram_id)
+            if 'history' in sections:
+                result['history'] = self.get_student_history(telegram_id)
+            if 'leaderboard' in sections:
+                result['leaderboard'] = self.get_leaderboard()
+        return result
+
     # ==========================
-    # БЛОК УСЛУГ (БИРЖА)
+    # РЕЙТИНГ (таблица ranking)
     # ==========================
 
-    def get_all_services(self, current_user_tg_id):
+    def _sync_ranking(self, cur, student_uuids):
         """
-        Возвращает список услуг + статус для текущего юзера.
-        Использует LEFT JOIN с service_orders, чтобы понять, занята ли задача.
+        Переносит актуальный баланс в ranking.score в той же транзакции.
+        Сохраненное место остается, но помечается stale: до следующего
+        refresh_ranking() get_my_position отдает его как есть, с calculated_at.
+        Новому студенту место 0 - его get_my_position считает на лету.
         """
-        user_uuid = self._get_student_uuid(current_user_tg_id)
-        # Если юзера нет, вернем пустой список или ошибку, но лучше пустой список чтоб не падало
-        if not user_uuid: 
-            # Можно попробовать создать юзера "на лету" если это тест
-            return []
+        if not student_uuids: return
+        marks = ", ".join(["%s"] * len(student_uuids))
+        cur.execute(f"""
+            INSERT INTO ranking (student_id, score, position, stale)
+            SELECT student_id, current_points, 0, 1 FROM balances WHERE student_id IN ({marks})
+            {self.backend.upsert(('student_id',), {'score': 'NEW(score)', 'stale': '1'})}
+        """, tuple(student_uuids))
+
+    # ==========================
+    # РЕЙТИНГИ ПО ОКНАМ (неделя / месяц / семестр)
+    # ==========================
+
+    def _add_window_points(self, cur, rows):
+        """
+        Начисления из rows - в текущие окна leaderboard_windows, по строке на
+        студента и окно. Суммы собираются здесь и уходят одним многострочным
+        upsert. Курсор - dictionary=True. Сохраненные места сбрасываются: пока не прошел
+        compact_leaderboards, место студента считается на лету по его новым баллам.
+        """
+        earned = {}
+        for row in rows:
+            if row[1] == 'earn':
+                earned[str(row[0])] = earned.get(str(row[0]), 0) + row[2]
+        if not earned: return
+        marks = ", ".join(["%s"] * len(earned))
+        cur.execute(f"SELECT id, faculty_id, group_id FROM students WHERE id IN ({marks})", tuple(earned))
+        students = sorted(cur.fetchall(), key=lambda st: str(st['id']))
+        if not students: return
+        today = date.today()
+        values = [(window, window_start(window, today), st['id'], st['faculty_id'], st['group_id'], earned[str(st['id'])])
+                  for window in WINDOWS for st in students]
+        cur.execute(f"""
+            INSERT INTO leaderboard_windows (window_type, window_start, student_id, faculty_id, group_id, points)
+            VALUES {", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(values))}
+            {self.backend.upsert(('window_type', 'window_start', 'student_id'),
+                                 {'points': 'points + NEW(points)', 'faculty_id': 'NEW(faculty_id)',
+                                  'group_id': 'NEW(group_id)', 'position_global': '0',
+                                  'position_faculty': '0', 'position_group': '0'})}
+        """, tuple(v for row in values for v in row))
+
+    def get_window_leaderboard(self, window, scope, telegram_id=None, limit=10):
+        """
+        Топ по заработанному за текущее окно: в целом, по факультету или
+        группе студента telegram_id. Топ читается по индексу idx_lb_<scope>,
+        место студента - по первичному ключу (position_* из compact_leaderboards;
+        кто набрал баллы после пересчета - место считается на лету).
+        """
+        if window not in WINDOWS: raise ValueError(f"Неизвестное окно: {window}")
+        if scope not in SCOPES: raise ValueError(f"Неизвестный срез: {scope}")
+        if scope != 'global' and not telegram_id:
+            raise ValueError("Для рейтинга факультета или группы нужен user_id")
+        start = window_start(window)
+        result = {'window': window, 'scope': scope, 'start': start.isoformat(),
+                  'end': window_end(window, start).isoformat(), 'items': [], 'me': None}
+
+        student_uuid = self._get_student_uuid(telegram_id) if telegram_id else None
+        if telegram_id and not student_uuid: return result
 
         conn = self._get_connection()
-        if not conn: return []
+        if not conn: return result
         try:
             cur = conn.cursor(dictionary=True)
-            
-            # Выбираем услуги.
-            # Если service_orders существует с активным статусом -> задача занята.
-            # Нам нужно знать order_id, чтобы подтвердить выполнение.
-            query = """
-            SELECT 
-                s.id, s.name, s.description, s.points_cost, s.provider_id,
-                st.first_name as provider_name,
-                ord.id as order_id,
-                ord.buyer_id as executor_id,
-                ord.status as order_status
-            FROM services s
-            JOIN students st ON s.provider_id = st.id
-            LEFT JOIN service_orders ord ON s.id = ord.service_id 
-                 AND ord.status IN ('pending', 'in_progress', 'completed')
-            WHERE s.active = 1
-            ORDER BY s.created_at DESC
-            """
-            cur.execute(query)
-            rows = cur.fetchall()
-            
-            result = []
-            for row in rows:
-                status = 'open'
-                # Определяем статус для фронтенда
-                if row['order_status'] in ['pending', 'in_progress']:
-                    status = 'in_progress'
-                elif row['order_status'] == 'completed':
-                    status = 'completed'
-
-                result.append({
-                    'id': row['id'],
-                    'name': row['name'],
-                    'description': row['description'],
-                    'points_cost': row['points_cost'],
-                    'provider_name': row['provider_name'],
-                    'is_my_task': (str(row['provider_id']) == str(user_uuid)),
-                    'am_i_executor': (str(row['executor_id']) == str(user_uuid)) if row['executor_id'] else False,
-                    'status': status,
-                    'order_id': row['order_id'] # Нужен для подтверждения
-                })
+            scope_sql, scope_args = "", ()
+            if scope != 'global':
+                column = f"{scope}_id"
+                cur.execute(f"SELECT {column} FROM students WHERE id = %s", (student_uuid,))
+                scope_id = cur.fetchone()[column]
+                if scope_id is None: return result
+                scope_sql, scope_args = f" AND l.{column} = %s", (scope_id,)
+
+            cur.execute(f"""
+                SELECT l.student_id, s.first_name, l.points
+                FROM leaderboard_windows l JOIN students s ON s.id = l.student_id
+                WHERE l.window_type = %s AND l.window_start = %s{scope_sql}
+                ORDER BY l.points DESC, l.student_id ASC
+                LIMIT %s
+            """, (window, start) + scope_args + (limit,))
+            for i, row in enumerate(cur.fetchall(), 1):
+                if str(row['student_id']) == str(student_uuid):
+                    result['me'] = {'points': row['points'], 'position': i}
+                result['items'].append({'position': i, 'first_name': row['first_name'], 'points': row['points']})
+
+            if student_uuid and result['me'] is None:
+                cur.execute(f"""
+                    SELECT points, position_{scope} AS position FROM leaderboard_windows l
+                    WHERE window_type = %s AND window_start = %s AND student_id = %s
+                """, (window, start, student_uuid))
+                mine = cur.fetchone()
+                if not mine:
+                    result['me'] = {'points': 0, 'position': None}
+                elif mine['position']:
+                    result['me'] = mine
+                else:
+                    cur.execute(f"""
+                        SELECT COUNT(*) AS higher FROM leaderboard_windows l
+                        WHERE l.window_type = %s AND l.window_start = %s{scope_sql}
+                          AND (l.points > %s OR (l.points = %s AND l.student_id < %s))
+                    """, (window, start) + scope_args + (mine['points'], mine['points'], student_uuid))
+                    result['me'] = {'points': mine['points'], 'position': cur.fetchone()['higher'] + 1}
             return result
         finally:
             conn.close()
 
-    def add_service(self, tg_id, name, points, desc):
-        provider_uuid = self._get_student_uuid(tg_id)
-        if not provider_uuid: return False, "Студент не найден"
-        
+    def compact_leaderboards(self):
+        """
+        Удаляет окна старше предыдущего и пересчитывает места в текущих окнах.
+        Вызывается периодически, как refresh_ranking.
+        """
         conn = self._get_connection()
-        if not conn: return False, "Нет связи с БД"
+        if not conn: return False
         try:
             cur = conn.cursor()
-            svc_id = str(uuid.uuid4())
-            cur.execute(
-                "INSERT INTO services (id, provider_id, name, points_cost, description, active) VALUES (%s, %s, %s, %s, %s, 1)",
-                (svc_id, provider_uuid, name, points, desc)
-            )
+            today = date.today()
+            for window in WINDOWS:
+                start = window_start(window, today)
+                cur.execute("DELETE FROM leaderboard_windows WHERE window_type = %s AND window_start < %s",
+                            (window, previous_start(window, start)))
+                # Места считаются в производной таблице (с оконными функциями
+                # MySQL ее материализует) и раскладываются UPDATE ... JOIN
+                cur.execute(self.backend.update_join(
+                    'leaderboard_windows', 'w',
+                    """(SELECT student_id,
+                               ROW_NUMBER() OVER (ORDER BY points DESC, student_id ASC) AS pos_global,
+                               ROW_NUMBER() OVER (PARTITION BY faculty_id ORDER BY points DESC, student_id ASC) AS pos_faculty,
+                               ROW_NUMBER() OVER (PARTITION BY group_id ORDER BY points DESC, student_id ASC) AS pos_group
+                        FROM leaderboard_windows
+                        WHERE window_type = %s AND window_start = %s) r""",
+                    "w.window_type = %s AND w.window_start = %s AND w.student_id = r.student_id",
+                    {'position_global': 'r.pos_global', 'position_faculty': 'r.pos_faculty',
+                     'position_group': 'r.pos_group'},
+                ), (window, start, window, start))
             conn.commit()
-            return True, "Услуга опубликована"
+            return True
         except Exception as e:
+            print(f"[DB LEADERBOARD ERROR] {e}")
             conn.rollback()
-            return False, str(e)
+            return False
         finally:
             conn.close()
 
-    def assign_service(self, service_id, executor_tg_id):
-        """Исполнитель берет задачу (создаем service_orders)"""
-        executor_uuid = self._get_student_uuid(executor_tg_id)
-        if not executor_uuid: return False, "Пользователь не найден"
-
+    def backfill_leaderboards(self):
+        """
+        Пересобирает текущие окна из daily_totals - после загрузки истории
+        в обход _record_transactions. Начисления во время пересборки могут
+        потеряться: запускать в тихое время.
+        """
         conn = self._get_connection()
-        if not conn: return False, "Ошибка БД"
+        if not conn: return False
         try:
-            cur = conn.cursor(dictionary=True)
-            
-            # 1. Проверка: задача свободна?
-            # Смотрим, есть ли активные ордера на этот сервис
-            cur.execute("""
-                SELECT id FROM service_orders 
-                WHERE service_id = %s AND status IN ('pending', 'in_progress', 'completed')
-            """, (service_id,))
-            if cur.fetchone():
-                return False, "Задание уже занято или выполнено"
-
-            # 2. Проверка: не автор ли это?
-            cur.execute("SELECT provider_id FROM services WHERE id = %s", (service_id,))
-            svc = cur.fetchone()
-            if not svc: return False, "Услуга не найдена"
-            if str(svc['provider_id']) == str(executor_uuid):
-                return False, "Нельзя выполнять свои задания"
-
-            # 3. Создаем заказ
-            order_id = str(uuid.uuid4())
-            cur.execute("""
-                INSERT INTO service_orders (id, service_id, buyer_id, status)
-                VALUES (%s, %s, %s, 'in_progress')
-            """, (order_id, service_id, executor_uuid))
-            
+            cur = conn.cursor()
+            for window in WINDOWS:
+                start = window_start(window)
+                cur.execute("DELETE FROM leaderboard_windows WHERE window_type = %s AND window_start = %s",
+                            (window, start))
+                cur.execute("""
+                    INSERT INTO leaderboard_windows (window_type, window_start, student_id, faculty_id, group_id, points)
+                    SELECT %s, %s, d.student_id, s.faculty_id, s.group_id, SUM(d.total)
+                    FROM daily_totals d JOIN students s ON s.id = d.student_id
+                    WHERE d.type = 'earn' AND d.day >= %s AND d.day < %s
+                    GROUP BY d.student_id, s.faculty_id, s.group_id
+                """, (window, start, start, window_end(window, start)))
             conn.commit()
-            return True, "Вы взяли задание в работу!"
         except Exception as e:
+            print(f"[DB LEADERBOARD ERROR] {e}")
             conn.rollback()
-            return False, str(e)
+            return False
         finally:
             conn.close()
+        return self.compact_leaderboards()
+
+    def refresh_ranking(self, chunk_size=1000):
+        """
+        Пакетный пересчет мест. При равных баллах выше тот, у кого меньше id.
+
+        Балансы читаются одним снимком без блокировок (INSERT ... SELECT по
+        balances держал бы разделяемые блокировки на всю таблицу и ловил
+        дедлоки с начислениями), места пишутся пачками, каждая - своей
+        транзакцией с повтором при дедлоке. Если score студента изменился
+        после снимка, место все равно записывается (оно свежее прежнего),
+        но остается stale до следующего пересчета.
+        """
+        conn = self._get_connection()
+        if not conn: return False
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT student_id, current_points FROM balances ORDER BY current_points DESC, student_id ASC")
+            snapshot = cur.fetchall()
+            conn.commit()
+        except Exception as e:
+            print(f"[DB RANKING ERROR] {e}")
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+
+        rows = [(student_id, score, position) for position, (student_id, score) in enumerate(snapshot, 1)]
+        for start in range(0, len(rows), chunk_size):
+            try:
+                if not self.run_in_transaction(self._write_ranking, rows[start:start + chunk_size]):
+                    return False
+            except Exception as e:
+                print(f"[DB RANKING ERROR] {e}")
+                return False
+        return True
+
+    def _write_ranking(self, rows):
+        conn = self._get_connection()
+        if not conn: return False
+        try:
+            cur = conn.cursor()
+            cur.executemany(f"""
+                INSERT INTO ranking (student_id, score, position, calculated_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                {self.backend.upsert(('student_id',), {
+                    'position': 'NEW(position)',
+                    'calculated_at': 'NEW(calculated_at)',
+                    'stale': 'CASE WHEN score = NEW(score) THEN 0 ELSE 1 END',
+                })}
+            """, rows)
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get_leaderboard(self, limit=10):
+        """Топ студентов по балансу: чтение top-N по индексу idx_ranking_score"""
+        conn = self._get_connection()
+        if not conn: return []
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT s.first_name, r.score AS current_points
+                FROM ranking r
+                JOIN students s ON s.id = r.student_id
+                ORDER BY r.score DESC, r.student_id ASC
+                LIMIT %s
+            """, (limit,))
+            rows = cur.fetchall()
+            for i, row in enumerate(rows, 1):
+                row['position'] = i
+            return rows
+        finally:
+            conn.close()
+
+    def get_my_position(self, telegram_id):
+        """
+        Место студента в рейтинге: чтение одной строки по первичному ключу.
+        Место - на момент calculated_at; stale=True, если баланс с тех пор менялся.
+        """
+        uuid_id = self._get_student_uuid(telegram_id)
+        if not uuid_id: return None
+
+        conn = self._get_connection()
+        if not conn: return None
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT score, position, calculated_at, stale FROM ranking WHERE student_id = %s
+            """, (uuid_id,))
+            row = cur.fetchone()
+            if row and row['position'] > 0:
+                row['stale'] = bool(row['stale'])
+                return row
+
+            # Студент появился после последнего пересчета - считаем место на лету
+            cur.execute("SELECT current_points FROM balances WHERE student_id = %s", (uuid_id,))
+            bal = cur.fetchone()
+            score = bal['current_points'] if bal else 0
+            cur.execute("""
+                SELECT COUNT(*) AS higher FROM ranking
+                WHERE score > %s OR (score = %s AND student_id < %s)
+            """, (score, score, uuid_id))
+            return {'score': score, 'position': cur.fetchone()['higher'] + 1, 'calculated_at': None, 'stale': False}
+        finally:
+            conn.close()
+
+    def get_all_merch(self):
+        conn = self._get_connection()
+        if not conn: return []
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT id, name, description, price_points, stock, image_url
+                FROM merch WHERE stock > 0 ORDER BY price_points ASC
+            """)
+            return cur.fetchall()
+        finally:
+            conn.close()
+
+    def get_merch_catalog(self):
+        """Готовый JSON каталога + ETag из кэша (см. catalog.MerchCatalog)"""
+        return self.merch_catalog.snapshot()
+
+    def get_merch_stock_delta(self, since_version):
+        return self.merch_catalog.stock_delta(since_version)
+
+    def buy_merch(self, telegram_id, merch_id, quantity=1):
+        """
+        Покупка мерча без гонок.
+
+        Остаток и баланс не проверяются отдельными SELECT: списание идет
+        условными UPDATE (stock >= quantity, current_points >= cost), и успех
+        определяется по числу измененных строк. Порядок блокировок всегда
+        один - сначала строка товара, потом баланс.
+        """
+        try:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            return False, "Некорректное количество"
+        if quantity < 1: return False, "Некорректное количество"
+
+        buyer_uuid = self._get_student_uuid(telegram_id)
+        if not buyer_uuid: return False, "Пользователь не найден"
 
-    def complete_service_order(self, order_id, provider_tg_id):
-        """Заказчик подтверждает выполнение и платит"""
-        if not order_id: return False, "Не передан ID заказа"
-        
-        provider_uuid = self._get_student_uuid(provider_tg_id)
-        if not provider_uuid: return False, "Пользователь не найден"
-        
         conn = self._get_connection()
         if not conn: return False, "Ошибка БД"
+        
         try:
             cur = conn.cursor(dictionary=True)
             
-            # Получаем детали заказа + цену из услуги
+            # 1. Резервируем товар: строка merch заблокирована до конца транзакции
+            cur.execute("""
+                UPDATE merch SET stock = stock - %s WHERE id = %s AND stock >= %s
+            """, (quantity, merch_id, quantity))
+            reserved = cur.rowcount == 1
+
+            cur.execute("SELECT name, price_points FROM merch WHERE id = %s", (merch_id,))
+            item = cur.fetchone()
+            if not item: return False, "Товар не найден"
+            if not reserved: return False, "Товар закончился"
+
+            cost = item['price_points'] * quantity
+
+            # 2. Списываем деньги, только если их хватает
+            # (при cost = 0 строка не меняется и rowcount был бы 0)
+            if cost > 0:
+                cur.execute("""
+                    UPDATE balances SET current_points = current_points - %s, total_spent = total_spent + %s
+                    WHERE student_id = %s AND current_points - held_points >= %s
+                """, (cost, cost, buyer_uuid, cost))
+                if cur.rowcount != 1:
+                    conn.rollback()
+                    return False, "Недостаточно средств"
+            
+            # 3. Создаем заказ
+            order_id = str(uuid.uuid4())
+            cur.execute("""
+                INSERT INTO merch_orders (id, merch_id, buyer_id, quantity, status)
+                VALUES (%s, %s, %s, %s, 'completed')
+            """, (order_id, merch_id, buyer_uuid, quantity))
+            
+            self._sync_ranking(cur, [buyer_uuid])
+
+            # Записываем в историю
+            title = item['name'] if quantity == 1 else f"{item['name']} x{quantity}"
+            self._record_transactions(cur, [
+                (buyer_uuid, 'spend', cost, f"Покупка: {title}", 'merch', merch_id),
+            ])
+
+            conn.commit()
+            self.after_commit(lambda: self.merch_catalog.bump(merch_id))
+            return True, f"Вы купили {title}"
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    # ==========================
+    # БЛОК УСЛУГ (БИРЖА)
+    # ==========================
+
+    def _load_service_board(self, ids=None):
+        """Активные услуги со статусом (все или с id из ids) - общая для всех пользователей часть"""
+        if ids is not None and not ids: return []
+        conn = self._get_connection()
+        if not conn:
+            # Пустой ответ на точечную загрузку убрал бы эти услуги из кэша
+            if ids is not None: raise RuntimeError("Нет связи с БД")
+            return []
+        try:
+            cur = conn.cursor(dictionary=True)
+            
+            # Выбираем услуги со статусом.
+            # Незакрытый или оплаченный заказ у услуги максимум один (его гарантирует
+            # переход open -> in_progress), order_id нужен, чтобы подтвердить выполнение.
             query = """
-            SELECT ord.id, ord.buyer_id as executor_id, ord.status, 
+            SELECT 
+                s.id, s.name, s.description, s.points_cost, s.provider_id, s.created_at, s.status, s.version,
+                st.first_name as provider_name,
+                ord.id as order_id,
+                ord.buyer_id as executor_id
+            FROM services s
+            JOIN students st ON s.provider_id = st.id
+            LEFT JOIN service_orders ord ON s.id = ord.service_id 
+                 AND ord.status IN ('in_progress', 'completed')
+            WHERE s.active = 1
+            """
+            params = ()
+            if ids:
+                ids = list(ids)
+                query += f" AND s.id IN ({', '.join(['%s'] * len(ids))})"
+                params = tuple(ids)
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        finally:
+            conn.close()
+
+        result = []
+        for row in rows:
+            result.append({
+                'id': row['id'],
+                'name': row['name'],
+                'description': row['description'],
+                'points_cost': row['points_cost'],
+                'provider_name': row['provider_name'],
+                'provider_id': str(row['provider_id']),
+                'executor_id': str(row['executor_id']) if row['executor_id'] else None,
+                'status': row['status'],
+                'version': row['version'],
+                'order_id': row['order_id'], # Нужен для подтверждения
+                'created_ts': row['created_at'].timestamp() if row['created_at'] else 0,
+            })
+        return result
+
+    def get_all_services(self, current_user_tg_id, status='active', sort='recent', limit=20, cursor=None):
+        """
+        Страница биржи услуг + флаги для текущего юзера.
+        Сам список берется из кэша ServiceBoard, здесь только накладываются
+        is_my_task / am_i_executor. Возвращает {'items': [...], 'next_cursor': ...}.
+        ValueError - неизвестный status/sort или испорченный курсор.
+        """
+        page = {'items': [], 'next_cursor': None}
+        user_uuid = self._get_student_uuid(current_user_tg_id)
+        # Если юзера нет, вернем пустой список, чтоб не падало
+        if not user_uuid: 
+            return page
+
+        after = self._decode_cursor(cursor, 2) if cursor else None
+        services, last_key = self.service_board.page(status, sort, limit, after)
+        user_uuid = str(user_uuid)
+        page['items'] = [{
+            'id': s['id'],
+            'name': s['name'],
+            'description': s['description'],
+            'points_cost': s['points_cost'],
+            'provider_name': s['provider_name'],
+            'is_my_task': s['provider_id'] == user_uuid,
+            'am_i_executor': s['executor_id'] == user_uuid,
+            'status': s['status'],
+            'version': s['version'],
+            'order_id': s['order_id'],
+        } for s in services]
+        if last_key:
+            page['next_cursor'] = self._encode_cursor(last_key)
+        return page
+
+    def get_service_state(self, service_id):
+        """status/version услуги и ее заказ в работе - для точечного обновления карточки"""
+        if not service_id: return None
+        conn = self._get_connection()
+        if not conn: return None
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT s.id, s.status, s.version, ord.id AS order_id
+                FROM services s
+                LEFT JOIN service_orders ord ON ord.service_id = s.id AND ord.status = 'in_progress'
+                WHERE s.id = %s
+            """, (service_id,))
+            return cur.fetchone()
+        finally:
+            conn.close()
+
+    def add_service(self, tg_id, name, points, desc):
+        provider_uuid = self._get_student_uuid(tg_id)
+        if not provider_uuid: return False, "Студент не найден"
+        
+        conn = self._get_connection()
+        if not conn: return False, "Нет связи с БД"
+        try:
+            cur = conn.cursor()
+            svc_id = str(uuid.uuid4())
+            cur.execute(
+                "INSERT INTO services (id, provider_id, name, points_cost, description, active) VALUES (%s, %s, %s, %s, %s, 1)",
+                (svc_id, provider_uuid, name, points, desc)
+            )
+            conn.commit()
+            self.after_commit(lambda: self.service_board.bump(svc_id))
+            return True, "Услуга опубликована"
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    def _transition(self, cur, table, row_id, from_status, to_status, version=None):
+        """
+        Compare-and-set перехода статуса: UPDATE пройдет, только если строка
+        все еще в from_status (и, если передана, в той же version).
+        True - переход выполнен этой транзакцией.
+        """
+        if to_status not in SERVICE_TRANSITIONS[table].get(from_status, ()):
+            raise ValueError(f"Недопустимый переход {table}: {from_status} -> {to_status}")
+        query = f"UPDATE {table} SET status = %s, version = version + 1 WHERE id = %s AND status = %s"
+        params = [to_status, row_id, from_status]
+        if version is not None:
+            query += " AND version = %s"
+            params.append(version)
+        cur.execute(query, tuple(params))
+        return cur.rowcount == 1
+
+    def _lock_balances(self, cur, student_uuids):
+        """
+        Блокирует балансы всегда в порядке student_id - без взаимных дедлоков.
+        cur - dictionary=True. Возвращает {student_id: доступные баллы},
+        то есть current_points без удержанных под ставки held_points.
+        """
+        uuids = sorted({str(u) for u in student_uuids})
+        marks = ", ".join(["%s"] * len(uuids))
+        cur.execute(f"""
+            SELECT student_id, current_points - held_points AS available FROM balances
+            WHERE student_id IN ({marks})
+            ORDER BY student_id{self.backend.for_update}
+        """, tuple(uuids))
+        return {str(row['student_id']): row['available'] for row in cur.fetchall()}
+
+    def _get_service_order(self, cur, order_id):
+        cur.execute("""
+            SELECT ord.id, ord.service_id, ord.buyer_id as executor_id, ord.status, ord.version,
                    s.points_cost, s.provider_id, s.name as service_name
             FROM service_orders ord
             JOIN services s ON ord.service_id = s.id
             WHERE ord.id = %s
-            """
-            cur.execute(query, (order_id,))
-            order = cur.fetchone()
+        """, (order_id,))
+        return cur.fetchone()
 
+    def assign_service(self, service_id, executor_tg_id):
+        """Исполнитель берет задачу: услуга open -> in_progress и новый заказ"""
+        executor_uuid = self._get_student_uuid(executor_tg_id)
+        if not executor_uuid: return False, "Пользователь не найден"
+
+        conn = self._get_connection()
+        if not conn: return False, "Ошибка БД"
+        try:
+            cur = conn.cursor(dictionary=True)
+            
+            cur.execute("SELECT provider_id FROM services WHERE id = %s AND active = 1", (service_id,))
+            svc = cur.fetchone()
+            if not svc: return False, "Услуга не найдена"
+            if str(svc['provider_id']) == str(executor_uuid):
+                return False, "Нельзя выполнять свои задания"
+
+            # Занять задачу может только один: второй UPDATE не найдет строку в статусе open
+            if not self._transition(cur, 'services', service_id, 'open', 'in_progress'):
+                return False, "Задание уже занято или выполнено"
+
+            order_id = str(uuid.uuid4())
+            cur.execute("""
+                INSERT INTO service_orders (id, service_id, buyer_id, status)
+                VALUES (%s, %s, %s, 'in_progress')
+            """, (order_id, service_id, executor_uuid))
+            self._queue_task_event(cur, {'id': order_id, 'service_id': service_id,
+                                         'provider_id': svc['provider_id'], 'executor_id': executor_uuid},
+                                   'in_progress')
+            
+            conn.commit()
+            self.after_commit(lambda: self.service_board.bump(service_id))
+            return True, "Вы взяли задание в работу!"
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    def complete_service_order(self, order_id, provider_tg_id):
+        """Заказчик подтверждает выполнение и платит (in_progress -> completed)"""
+        if not order_id: return False, "Не передан ID заказа"
+        
+        provider_uuid = self._get_student_uuid(provider_tg_id)
+        if not provider_uuid: return False, "Пользователь не найден"
+        
+        conn = self._get_connection()
+        if not conn: return False, "Ошибка БД"
+        try:
+            cur = conn.cursor(dictionary=True)
+            
+            order = self._get_service_order(cur, order_id)
             if not order: return False, "Заказ не найден"
             # Проверяем права (только создатель услуги может подтвердить)
             if str(order['provider_id']) != str(provider_uuid): 
                 return False, "Вы не автор этой задачи"
-            
             if order['status'] == 'completed': return False, "Уже оплачено"
+            if order['status'] != 'in_progress': return False, "Заказ отменен"
 
             cost = order['points_cost']
             executor_uuid = order['executor_id']
 
-            # Проверяем баланс заказчика
-            cur.execute("SELECT current_points FROM balances WHERE student_id = %s", (provider_uuid,))
-            bal = cur.fetchone()
-            if not bal or bal['current_points'] < cost:
-                return False, "Недостаточно средств на балансе!"
-
             # --- ТРАНЗАКЦИЯ ---
-            
-            # 1. Обновляем статус заказа
-            cur.execute("UPDATE service_orders SET status = 'completed' WHERE id = %s", (order_id,))
-            
-            # 2. Списываем у заказчика
-            cur.execute("""
-                UPDATE balances SET current_points = current_points - %s, total_spent = total_spent + %s 
-                WHERE student_id = %s
-            """, (cost, cost, provider_uuid))
+            # Блокировки всегда в одном порядке: услуга, заказ, балансы по student_id.
+            # Повторное подтверждение ждет первое и не проходит CAS - оплаты не будет.
+            if not (self._transition(cur, 'services', order['service_id'], 'in_progress', 'completed')
+                    and self._transition(cur, 'service_orders', order_id, 'in_progress', 'completed',
+                                         order['version'])):
+                conn.rollback()
+                return False, "Заказ уже оплачен или отменен"
 
-            # 3. Начисляем исполнителю
+            self._lock_balances(cur, [provider_uuid, executor_uuid])
+
+            # Списываем у заказчика, только если хватает баллов
+            if cost > 0:
+                cur.execute("""
+                    UPDATE balances SET current_points = current_points - %s, total_spent = total_spent + %s 
+                    WHERE student_id = %s AND current_points - held_points >= %s
+                """, (cost, cost, provider_uuid, cost))
+                if cur.rowcount != 1:
+                    conn.rollback()
+                    return False, "Недостаточно средств на балансе!"
+
+            # Начисляем исполнителю
             cur.execute("""
                 UPDATE balances SET current_points = current_points + %s, total_earned = total_earned + %s
                 WHERE student_id = %s
             """, (cost, cost, executor_uuid))
 
-            # 4. Пишем в историю (transactions)
-            # Расход
+            self._sync_ranking(cur, [provider_uuid, executor_uuid])
+
+            # Пишем в историю (transactions): расход и доход
+            self._record_transactions(cur, [
+                (provider_uuid, 'spend', cost, f"Оплата задачи: {order['service_name']}", 'service', order_id),
+                (executor_uuid, 'earn', cost, f"Выполнение задачи: {order['service_name']}", 'service', order_id),
+            ])
+            self._queue_task_event(cur, order, 'completed')
+
+            conn.commit()
+            self.after_commit(lambda: self.service_board.bump(order['service_id']))
+            return True, "Задание подтверждено, оплата проведена!"
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    def cancel_service_order(self, order_id, tg_id):
+        """
+        Отмена заказа в работе заказчиком или исполнителем:
+        заказ -> cancelled, услуга снова open. Баллы не движутся.
+        """
+        if not order_id: return False, "Не передан ID заказа"
+
+        user_uuid = self._get_student_uuid(tg_id)
+        if not user_uuid: return False, "Пользователь не найден"
+
+        conn = self._get_connection()
+        if not conn: return False, "Ошибка БД"
+        try:
+            cur = conn.cursor(dictionary=True)
+
+            order = self._get_service_order(cur, order_id)
+            if not order: return False, "Заказ не найден"
+            if str(user_uuid) not in (str(order['provider_id']), str(order['executor_id'])):
+                return False, "Это не ваш заказ"
+            if order['status'] != 'in_progress': return False, "Заказ уже закрыт"
+
+            if not (self._transition(cur, 'services', order['service_id'], 'in_progress', 'open')
+                    and self._transition(cur, 'service_orders', order_id, 'in_progress', 'cancelled',
+                                         order['version'])):
+                conn.rollback()
+                return False, "Заказ уже оплачен или отменен"
+            self._queue_task_event(cur, order, 'cancelled')
+
+            conn.commit()
+            self.after_commit(lambda: self.service_board.bump(order['service_id']))
+            return True, "Заказ отменен, задание снова доступно"
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    # ==========================
+    # АУКЦИОНЫ
+    # ==========================
+
+    def _load_auction(self, auction_id):
+        """Строка для AuctionBook: аукцион, товар и число ставок"""
+        conn = self._get_connection()
+        if not conn: return None
+        try:
+            cur = conn.cursor(dictionary=True)
             cur.execute("""
-                INSERT INTO transactions (id, student_id, type, amount, description, entity_type, entity_id)
-                VALUES (%s, %s, 'spend', %s, %s, 'service', %s)
-            """, (str(uuid.uuid4()), provider_uuid, cost, f"Оплата задачи: {order['service_name']}", order_id))
-            
-            # Доход
+                SELECT a.id, a.merch_id, m.name AS merch_name, a.student_id AS seller_id, a.start_price,
+                       a.current_bid, a.min_increment, a.winner_id AS leader_id, a.end_time, a.status,
+                       (SELECT COUNT(*) FROM bids b WHERE b.auction_id = a.id) AS bids
+                FROM auctions a JOIN merch m ON m.id = a.merch_id
+                WHERE a.id = %s
+            """, (auction_id,))
+            return cur.fetchone()
+        finally:
+            conn.close()
+
+    def get_auction(self, auction_id):
+        """Состояние торгов из памяти (см. auctions.AuctionBook) или None"""
+        state = self.auction_book.get(auction_id)
+        return state.as_dict() if state else None
+
+    def get_open_auctions(self):
+        """Открытые аукционы; текущие ставки - из памяти"""
+        conn = self._get_connection()
+        if not conn: return []
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM auctions WHERE status = 'open' ORDER BY end_time")
+            ids = [row[0] for row in cur.fetchall()]
+        finally:
+            conn.close()
+        states = (self.auction_book.get(auction_id) for auction_id in ids)
+        return [state.as_dict() for state in states if state and state.is_open()]
+
+    def create_auction(self, seller_tg_id, merch_id, start_price, end_time, min_increment=1):
+        """
+        Аукцион на товар; seller - админ, который его проводит. Единица
+        товара резервируется сразу (stock - 1), чтобы ее не выкупили в
+        магазине до конца торгов; без победителя она вернется при закрытии.
+        """
+        if start_price < 1 or min_increment < 1:
+            return False, "Стартовая цена и шаг должны быть положительными"
+        if end_time <= datetime.now():
+            return False, "Время окончания уже прошло"
+        seller_uuid = self._get_student_uuid(seller_tg_id)
+        if not seller_uuid: return False, "Пользователь не найден"
+
+        conn = self._get_connection()
+        if not conn: return False, "Ошибка БД"
+        try:
+            cur = conn.cursor()
+            cur.execute("UPDATE merch SET stock = stock - 1 WHERE id = %s AND stock > 0", (merch_id,))
+            reserved = cur.rowcount == 1
+            cur.execute("SELECT 1 FROM merch WHERE id = %s", (merch_id,))
+            if not cur.fetchone(): return False, "Товар не найден"
+            if not reserved: return False, "Товар закончился"
+            auction_id = str(uuid.uuid4())
             cur.execute("""
-                INSERT INTO transactions (id, student_id, type, amount, description, entity_type, entity_id)
-                VALUES (%s, %s, 'earn', %s, %s, 'service', %s)
-            """, (str(uuid.uuid4()), executor_uuid, cost, f"Выполнение задачи: {order['service_name']}", order_id))
+                INSERT INTO auctions (id, student_id, merch_id, start_price, current_bid, min_increment,
+                                      end_time, status, stock_reserved)
+                VALUES (%s, %s, %s, %s, 0, %s, %s, 'open', TRUE)
+            """, (auction_id, seller_uuid, merch_id, start_price, min_increment, end_time))
+            conn.commit()
+            self.after_commit(lambda: self.merch_catalog.bump(merch_id))
+            return True, auction_id
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    def place_bid(self, auction_id, telegram_id, amount):
+        """
+        Ставка на аукционе.
+
+        Ставки ниже минимальной отбиваются по состоянию в памяти, без БД.
+        Остальные на один аукцион идут по очереди (AuctionBook.lock), каждая -
+        своей транзакцией: строка аукциона блокируется, сумма ставки
+        удерживается на балансе нового лидера (held_points), удержание
+        прошлого лидера снимается. Баллы списываются только при закрытии.
+        Сама открывает транзакцию: роут не оборачивается в transactional.
+        """
+        try:
+            amount = int(amount)
+        except (TypeError, ValueError):
+            return False, "Некорректная ставка"
+        bidder_uuid = self._get_student_uuid(telegram_id)
+        if not bidder_uuid: return False, "Пользователь не найден"
+
+        state = self.auction_book.get(auction_id)
+        if not state: return False, "Аукцион не найден"
+        if not state.is_open(): return False, "Аукцион завершен"
+        if amount < state.min_bid(): return False, f"Минимальная ставка: {state.min_bid()}"
+
+        with self.auction_book.lock(auction_id):
+            return self.run_in_transaction(self._place_bid, auction_id, bidder_uuid, amount)
+
+    def _place_bid(self, auction_id, bidder_uuid, amount):
+        conn = self._get_connection()
+        if not conn: return False, "Ошибка БД"
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(f"""
+                SELECT student_id, start_price, current_bid, min_increment, end_time, status, winner_id
+                FROM auctions WHERE id = %s{self.backend.for_update}
+            """, (auction_id,))
+            auction = cur.fetchone()
+            if not auction: return False, "Аукцион не найден"
+            if auction['status'] != 'open' or auction['end_time'] <= datetime.now():
+                self.after_commit(lambda: self.auction_book.invalidate(auction_id))
+                return False, "Аукцион завершен"
+            if str(auction['student_id']) == str(bidder_uuid):
+                return False, "Нельзя ставить на свой аукцион"
+
+            leader = str(auction['winner_id']) if auction['winner_id'] else None
+            min_bid = auction['current_bid'] + auction['min_increment'] if leader else auction['start_price']
+            if amount < min_bid:
+                # Память отстала (ставка другого процесса) - перечитаем
+                self.after_commit(lambda: self.auction_book.invalidate(auction_id))
+                return False, f"Минимальная ставка: {min_bid}"
+
+            self._lock_balances(cur, [bidder_uuid] + ([leader] if leader else []))
+
+            # Лидер, перебивающий сам себя, доудерживает только разницу
+            hold = amount - auction['current_bid'] if leader == str(bidder_uuid) else amount
+            cur.execute("""
+                UPDATE balances SET held_points = held_points + %s
+                WHERE student_id = %s AND current_points - held_points >= %s
+            """, (hold, bidder_uuid, hold))
+            if cur.rowcount != 1:
+                conn.rollback()
+                return False, "Недостаточно средств"
+            if leader and leader != str(bidder_uuid):
+                cur.execute("""
+                    UPDATE balances SET held_points = held_points - %s WHERE student_id = %s
+                """, (auction['current_bid'], leader))
+
+            end_time = None
+            now = datetime.now()
+            if self.auction_snipe_window and \
+                    auction['end_time'] - now < timedelta(seconds=self.auction_snipe_window):
+                end_time = now + timedelta(seconds=self.auction_snipe_extend)
+                cur.execute("UPDATE auctions SET end_time = %s WHERE id = %s AND end_time < %s",
+                            (end_time, auction_id, end_time))
+                if cur.rowcount != 1:
+                    # Срок уже дальше (продлила более поздняя ставка) - не трогаем
+                    end_time = None
+            cur.execute("UPDATE auctions SET current_bid = %s, winner_id = %s WHERE id = %s",
+                        (amount, bidder_uuid, auction_id))
+            cur.execute("""
+                INSERT INTO bids (id, auction_id, bidder_id, amount) VALUES (%s, %s, %s, %s)
+            """, (str(uuid.uuid4()), auction_id, bidder_uuid, amount))
+
+            outbid = []
+            if leader and leader != str(bidder_uuid):
+                outbid.append((leader, {'type': 'auction', 'auction_id': auction_id,
+                                        'status': 'outbid', 'current_bid': amount}))
+            self._queue_events(cur, outbid, balances_of={str(bidder_uuid)} | ({leader} if leader else set()))
 
             conn.commit()
-            return True, "Задание подтверждено, оплата проведена!"
+            self.after_commit(lambda: self.auction_book.record_bid(auction_id, amount, str(bidder_uuid), end_time))
+            return True, "Ставка принята"
         except Exception as e:
             conn.rollback()
             return False, str(e)
         finally:
             conn.close()
 
+    def get_open_auction_deadlines(self):
+        """[(id, end_time)] открытых аукционов - для AuctionScheduler"""
+        conn = self._get_connection()
+        if not conn: return []
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT id, end_time FROM auctions WHERE status = 'open' ORDER BY end_time")
+            return [(str(row[0]), row[1]) for row in cur.fetchall()]
+        finally:
+            conn.close()
+
+    def close_auctions(self, auction_ids, now):
+        """
+        Закрывает пачку аукционов одной транзакцией. Аукцион с лидером
+        рассчитывается: удержание превращается в списание, пишутся
+        transactions и merch_orders. Товар зарезервирован при создании:
+        без победителя он возвращается в stock, аукционы, созданные до
+        резервирования (stock_reserved = FALSE), списывают его сейчас, а если он
+        уже закончился - удержание победителя снимается без списания. Удержания
+        проигравших снимаются еще при перебитой ставке (_place_bid).
+        Аукцион, продленный после постановки в очередь, не закрывается.
+        Возвращает {'closed', 'settled', 'unsold', 'extended': {id: end_time}} или None.
+        """
+        return self.run_in_transaction(self._close_auctions, auction_ids, now)
+
+    def _close_auctions(self, auction_ids, now):
+        report = {'closed': 0, 'settled': 0, 'unsold': 0, 'extended': {}}
+        conn = self._get_connection()
+        if not conn: return None
+        try:
+            cur = conn.cursor(dictionary=True)
+            marks = ", ".join(["%s"] * len(auction_ids))
+            cur.execute(f"""
+                SELECT a.id, a.merch_id, m.name AS merch_name, a.student_id AS seller_id,
+                       a.current_bid, a.winner_id, a.end_time, a.stock_reserved
+                FROM auctions a JOIN merch m ON m.id = a.merch_id
+                WHERE a.id IN ({marks}) AND a.status = 'open'
+                ORDER BY a.id{self.backend.for_update}
+            """, tuple(auction_ids))
+            auctions = []
+            for row in cur.fetchall():
+                if row['end_time'] > now:
+                    report['extended'][str(row['id'])] = row['end_time']
+                else:
+                    auctions.append(row)
+            if not auctions:
+                return report
+
+            # Порядок блокировок как в buy_merch: сначала товар, потом балансы
+            merch_ids = sorted({a['merch_id'] for a in auctions})
+            marks = ", ".join(["%s"] * len(merch_ids))
+            cur.execute(f"SELECT id FROM merch WHERE id IN ({marks}) ORDER BY id{self.backend.for_update}",
+                        tuple(merch_ids))
+            cur.fetchall()
+
+            # Аукционы без резерва списывают товар сейчас; если он уже
+            # закончился - удержание победителя снимается без списания
+            won, unsold = [], []
+            for a in auctions:
+                if not a['winner_id']:
+                    continue
+                if not a['stock_reserved']:
+                    cur.execute("UPDATE merch SET stock = stock - 1 WHERE id = %s AND stock > 0", (a['merch_id'],))
+                    if cur.rowcount != 1:
+                        unsold.append(a)
+                        continue
+                won.append(a)
+            cur.executemany("UPDATE merch SET stock = stock + 1 WHERE id = %s",
+                            [(a['merch_id'],) for a in auctions if a['stock_reserved'] and not a['winner_id']])
+
+            self._lock_balances(cur, [a['winner_id'] for a in won + unsold])
+            cur.executemany("UPDATE auctions SET status = 'closed' WHERE id = %s AND status = 'open'",
+                            [(a['id'],) for a in auctions])
+            cur.executemany("""
+                UPDATE balances SET current_points = current_points - %s, held_points = held_points - %s,
+                                    total_spent = total_spent + %s
+                WHERE student_id = %s
+            """, [(a['current_bid'], a['current_bid'], a['current_bid'], a['winner_id']) for a in won])
+            cur.executemany("UPDATE balances SET held_points = held_points - %s WHERE student_id = %s",
+                            [(a['current_bid'], a['winner_id']) for a in unsold])
+            self._sync_ranking(cur, list({str(a['winner_id']) for a in won}))
+            cur.executemany("""
+                INSERT INTO merch_orders (id, merch_id, buyer_id, quantity, status)
+                VALUES (%s, %s, %s, 1, 'pending')
+            """, [(str(uuid.uuid4()), a['merch_id'], a['winner_id']) for a in won])
+            if won:
+                self._record_transactions(cur, [
+                    (a['winner_id'], 'spend', a['current_bid'], f"Выигрыш аукциона: {a['merch_name']}",
+                     'auction', a['id'])
+                    for a in won
+                ])
+            self._queue_events(cur, [
+                (a['winner_id'], {'type': 'auction', 'auction_id': str(a['id']),
+                                  'status': 'won', 'current_bid': a['current_bid']})
+                for a in won
+            ] + [
+                (a['winner_id'], {'type': 'auction', 'auction_id': str(a['id']),
+                                  'status': 'out_of_stock', 'current_bid': a['current_bid']})
+                for a in unsold
+            ], balances_of={str(a['winner_id']) for a in unsold})
+
+            conn.commit()
+            report['closed'] = len(auctions)
+            report['settled'] = len(won)
+            report['unsold'] = len(unsold)
+            closed_ids = [str(a['id']) for a in auctions]
+
+            def forget():
+                for auction_id in closed_ids:
+                    self.auction_book.forget(auction_id)
+                for merch_id in merch_ids:
+                    self.merch_catalog.bump(merch_id)
+            self.after_commit(forget)
+            return report
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB ERROR] Close auctions failed: {e}")
+            return None
+        finally:
+            conn.close()
+
+    # ==========================
+    # АКТИВНОСТИ И ОТМЕТКИ
+    # ==========================
+
+    def create_activity(self, title, points, category, start_date=None, end_date=None, max_participants=None):
+        if not title or points < 1: return False, "Нужны название и положительные баллы"
+        if max_participants is not None and max_participants < 1:
+            return False, "Лимит участников должен быть положительным"
+        conn = self._get_connection()
+        if not conn: return False, "Ошибка БД"
+        try:
+            cur = conn.cursor()
+            activity_id = str(uuid.uuid4())
+            cur.execute("""
+                INSERT INTO activities (id, title, points, category, start_date, end_date, max_participants, status)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, 'active')
+            """, (activity_id, title, points, category, start_date, end_date, max_participants))
+            conn.commit()
+            return True, activity_id
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    def get_activity_roster(self, activity_id):
+        """(активность, [student_id уже отмеченных]) или (None, []) - для CheckinDesk"""
+        conn = self._get_connection()
+        if not conn: return None, []
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT id, title, points, max_participants, status FROM activities WHERE id = %s
+            """, (activity_id,))
+            row = cur.fetchone()
+            if not row: return None, []
+            cur.execute("SELECT student_id FROM student_activities WHERE activity_id = %s", (activity_id,))
+            return row, [str(r['student_id']) for r in cur.fetchall()]
+        finally:
+            conn.close()
+
+    def award_checkins(self, scans):
+        """
+        Проводит пачку отметок [(activity_id, student_uuid)] одной транзакцией:
+        student_activities, balances, ranking, transactions - по запросу на
+        таблицу. Активности блокируются, уникальный ключ и max_participants
+        перепроверяются по БД (отметки могли прийти и из другого процесса).
+        Возвращает {'awarded', 'duplicates', 'rejected': [(activity_id,
+        student_uuid, причина)], 'closed': {activity_id: status}}.
+        None - БД недоступна или дедлок/обрыв связи (backend.is_transient):
+        пачку можно повторить. Ошибка из-за данных пробрасывается - пачка
+        целиком не пройдет, ее надо проводить по одной отметке.
+        """
+        return self.run_in_transaction(self._award_checkins, scans)
+
+    def _award_checkins(self, scans):
+        conn = self._get_connection()
+        if not conn: return None
+        try:
+            cur = conn.cursor(dictionary=True)
+            activity_ids = sorted({a for a, _ in scans})
+            student_ids = sorted({s for _, s in scans})
+            a_marks = ", ".join(["%s"] * len(activity_ids))
+            s_marks = ", ".join(["%s"] * len(student_ids))
+            cur.execute(f"""
+                SELECT id, title, points, max_participants, status FROM activities
+                WHERE id IN ({a_marks}) ORDER BY id{self.backend.for_update}
+            """, tuple(activity_ids))
+            activities = {str(row['id']): row for row in cur.fetchall()}
+            cur.execute(f"""
+                SELECT activity_id, COUNT(*) AS taken FROM student_activities
+                WHERE activity_id IN ({a_marks}) GROUP BY activity_id
+            """, tuple(activity_ids))
+            taken = {str(row['activity_id']): row['taken'] for row in cur.fetchall()}
+            cur.execute(f"""
+                SELECT activity_id, student_id FROM student_activities
+                WHERE activity_id IN ({a_marks}) AND student_id IN ({s_marks})
+            """, tuple(activity_ids) + tuple(student_ids))
+            seen = {(str(row['activity_id']), str(row['student_id'])) for row in cur.fetchall()}
+
+            report = {'awarded': 0, 'duplicates': 0, 'rejected': [], 'closed': {}}
+            accepted = []
+            for activity_id, student_uuid in scans:
+                activity = activities.get(activity_id)
+                if (activity_id, student_uuid) in seen:
+                    report['duplicates'] += 1
+                elif not activity or activity['status'] != 'active':
+                    report['closed'][activity_id] = activity['status'] if activity else 'deleted'
+                    report['rejected'].append((activity_id, student_uuid, "Мероприятие завершено"))
+                elif activity['max_participants'] is not None and \
+                        taken.get(activity_id, 0) >= activity['max_participants']:
+                    report['rejected'].append((activity_id, student_uuid, "Свободных мест нет"))
+                else:
+                    seen.add((activity_id, student_uuid))
+                    taken[activity_id] = taken.get(activity_id, 0) + 1
+                    accepted.append((activity, student_uuid))
+
+            if accepted:
+                cur.executemany("""
+                    INSERT INTO student_activities (id, student_id, activity_id, earned_points, status)
+                    VALUES (%s, %s, %s, %s, 'approved')
+                """, [(str(uuid.uuid4()), s, a['id'], a['points']) for a, s in accepted])
+                earned = {}
+                for activity, student_uuid in accepted:
+                    earned[student_uuid] = earned.get(student_uuid, 0) + activity['points']
+                self._lock_balances(cur, earned)
+                cur.executemany("""
+                    UPDATE balances SET current_points = current_points + %s, total_earned = total_earned + %s
+                    WHERE student_id = %s
+                """, [(points, points, s) for s, points in earned.items()])
+                self._sync_ranking(cur, list(earned))
+                self._record_transactions(cur, [
+                    (s, 'earn', a['points'], f"Участие в мероприятии: {a['title']}", 'activity', a['id'])
+                    for a, s in accepted
+                ])
+            self._queue_events(cur, [
+                (s, {'type': 'checkin', 'activity_id': a, 'status': 'rejected', 'message': reason})
+                for a, s, reason in report['rejected']
+            ])
+
+            conn.commit()
+            report['awarded'] = len(accepted)
+            return report
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB ERROR] Award checkins failed: {e}")
+            if not self.backend.is_transient(e):
+                raise
+            return None
+        finally:
+            conn.close()
+
+    # ==========================
+    # АДМИНКА
+    # ==========================
+
+    def is_admin(self, telegram_id):
+        conn = self._get_connection()
+        if not conn: return False
+        try:
+            cur = conn.cursor(dictionary=True)
+            cur.execute("SELECT role FROM students WHERE telegram_user_id = %s", (telegram_id,))
+            row = cur.fetchone()
+            return bool(row) and row['role'] == 'admin'
+        finally:
+            conn.close()
+
+    def admin_add_merch(self, name, price, stock, description=None, image_url=None):
+        conn = self._get_connection()
+        if not conn: return False
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO merch (id, name, description, price_points, stock, image_url)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (str(uuid.uuid4()), name, description, price, stock, image_url))
+            conn.commit()
+            self.after_commit(self.merch_catalog.bump)
+            return True
+        except Exception as e:
+            print(f"[DB ADD MERCH ERROR] {e}")
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+
+    def admin_add_points(self, telegram_id, amount, description):
+        """Начисление (amount > 0) или списание (amount < 0) баллов админом"""
+        if not amount: return False, "Сумма должна быть ненулевой"
+
+        student_uuid = self._get_student_uuid(telegram_id)
+        if not student_uuid: return False, "Студент не найден"
+
+        conn = self._get_connection()
+        if not conn: return False, "Ошибка БД"
+        try:
+            cur = conn.cursor(dictionary=True)
+            if amount > 0:
+                cur.execute("""
+                    UPDATE balances SET current_points = current_points + %s, total_earned = total_earned + %s
+                    WHERE student_id = %s
+                """, (amount, amount, student_uuid))
+                tx_type = 'earn'
+            else:
+                cur.execute("""
+                    UPDATE balances SET current_points = current_points - %s, total_spent = total_spent + %s
+                    WHERE student_id = %s AND current_points - held_points >= %s
+                """, (-amount, -amount, student_uuid, -amount))
+                tx_type = 'spend'
+            if cur.rowcount != 1:
+                conn.rollback()
+                return False, "Нет баланса или недостаточно средств у студента"
+            self._sync_ranking(cur, [student_uuid])
+
+            self._record_transactions(cur, [
+                (student_uuid, tx_type, abs(amount), description, 'admin', None),
+            ])
+
+            conn.commit()
+            return True, f"Баланс изменен на {amount:+d}"
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        finally:
+            conn.close()
+
+    def admin_bulk_add_points(self, rows, batch_id, chunk_size=500):
+        """
+        Массовое начисление/списание баллов по списку из grants.parse_grants.
+        kind строки - 'student_id' (номер студенческого) или 'telegram'.
+
+        Строки применяются пачками по chunk_size: на пачку - несколько запросов
+        executemany и своя транзакция, а не по транзакции на студента. Пачка
+        считается проведенной только после ее COMMIT, поэтому метод нельзя
+        звать внутри unit of work - все пачки слились бы в одну транзакцию.
+
+        Id транзакции строки детерминирован: uuid5 от batch_id загрузки
+        (grants.upload_id) и номера строки. Повторная загрузка того же списка
+        пропускает уже проведенные строки, а новый список с такими же
+        суммами и описаниями проводится заново.
+
+        Возвращает {'applied', 'skipped', 'failed': [(line, target, причина)], 'error'}.
+        error - ошибка БД: обработка прервана, загрузку можно безопасно повторить.
+        """
+        if current_uow.get() is not None:
+            raise RuntimeError("admin_bulk_add_points коммитит пачки сам и не работает внутри unit of work")
+
+        report = {'applied': 0, 'skipped': 0, 'failed': [], 'error': None}
+        for start in range(0, len(rows), chunk_size):
+            try:
+                result = self.run_in_transaction(self._apply_grant_chunk, rows[start:start + chunk_size], batch_id)
+            except Exception as e:
+                print(f"[DB ERROR] Массовое начисление: {e}")
+                result = None
+                report['error'] = str(e)
+            if result is None:
+                report['error'] = report['error'] or "Ошибка БД"
+                return report
+            applied, skipped, failed = result
+            report['applied'] += applied
+            report['skipped'] += skipped
+            report['failed'].extend(failed)
+        return report
+
+    def _apply_grant_chunk(self, chunk, batch_id):
+        conn = self._get_connection()
+        if not conn: return None
+        try:
+            cur = conn.cursor(dictionary=True)
+            result = self._apply_grant_rows(cur, chunk, batch_id)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _apply_grant_rows(self, cur, chunk, batch_id):
+        failed = []
+
+        # 1. Получатели: по номеру студенческого или по Telegram ID
+        by_card, by_tg = {}, {}
+        cards = [r['target'] for r in chunk if r['kind'] == 'student_id']
+        tg_ids = [int(r['target']) for r in chunk if r['kind'] == 'telegram']
+        if cards:
+            marks = ", ".join(["%s"] * len(cards))
+            cur.execute(f"SELECT id, student_id FROM students WHERE student_id IN ({marks})", tuple(cards))
+            by_card = {row['student_id']: str(row['id']) for row in cur.fetchall()}
+        if tg_ids:
+            marks = ", ".join(["%s"] * len(tg_ids))
+            cur.execute(f"SELECT id, telegram_user_id FROM students WHERE telegram_user_id IN ({marks})", tuple(tg_ids))
+            by_tg = {row['telegram_user_id']: str(row['id']) for row in cur.fetchall()}
+
+        entries = []
+        for row in chunk:
+            target = row['target']
+            student_uuid = by_tg.get(int(target)) if row['kind'] == 'telegram' else by_card.get(target)
+            if not student_uuid:
+                failed.append((row['line'], target, "Студент не найден"))
+                continue
+            tx_id = str(uuid.uuid5(BULK_GRANT_NAMESPACE, f"{batch_id}|{row['line']}"))
+            entries.append((row, student_uuid, tx_id))
+        if not entries:
+            return 0, 0, failed
+
+        # 2. Уже проведенные при прошлой загрузке строки пропускаем
+        marks = ", ".join(["%s"] * len(entries))
+        cur.execute(f"SELECT id FROM transactions WHERE id IN ({marks})", tuple(tx_id for _, _, tx_id in entries))
+        done = {row['id'] for row in cur.fetchall()}
+        skipped = sum(1 for _, _, tx_id in entries if tx_id in done)
+        entries = [e for e in entries if e[2] not in done]
+        if not entries:
+            return 0, skipped, failed
+
+        # 3. Списания проверяем по заблокированным балансам в порядке строк списка
+        balances = self._lock_balances(cur, {student_uuid for _, student_uuid, _ in entries})
+        totals = {}  # student_uuid -> [earned, spent]
+        accepted = []
+        for row, student_uuid, tx_id in entries:
+            if student_uuid not in balances:
+                failed.append((row['line'], row['target'], "Нет баланса"))
+                continue
+            if balances[student_uuid] + row['amount'] < 0:
+                failed.append((row['line'], row['target'], "Недостаточно средств"))
+                continue
+            balances[student_uuid] += row['amount']
+            earned_spent = totals.setdefault(student_uuid, [0, 0])
+            earned_spent[0 if row['amount'] > 0 else 1] += abs(row['amount'])
+            accepted.append((row, student_uuid, tx_id))
+        if not accepted:
+            return 0, skipped, failed
+
+        cur.executemany("""
+            UPDATE balances SET current_points = current_points + %s,
+                total_earned = total_earned + %s, total_spent = total_spent + %s
+            WHERE student_id = %s
+        """, [(earned - spent, earned, spent, student_uuid) for student_uuid, (earned, spent) in totals.items()])
+        self._sync_ranking(cur, list(totals))
+        self._record_transactions(cur, [
+            (student_uuid, 'earn' if row['amount'] > 0 else 'spend', abs(row['amount']), row['description'], 'admin', None)
+            for row, student_uuid, _ in accepted
+        ], ids=[tx_id for _, _, tx_id in accepted])
+        return len(accepted), skipped, failed
+
 # Создаем единственный экземпляр
 db = Database()
@@ -0,0 +1,175 @@
+# events.py
+import json
+import threading
+import time
+from collections import deque
+
+# Клиент, у которого накопилось больше событий, получает resync и перечитывает данные сам
+MAX_PENDING = 256
+
+RESYNC = json.dumps({"type": "resync"})
+
+
+class Subscription:
+    """Очередь событий одного SSE-соединения"""
+
+    def __init__(self, telegram_id):
+        self.telegram_id = telegram_id
+        self._pending = deque()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._overflow = False
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    def put(self, payload):
+        with self._lock:
+            if len(self._pending) >= MAX_PENDING:
+                self._overflow = True
+                self._pending.clear()
+            else:
+                self._pending.append(payload)
+        self._ready.set()
+
+    def get(self, timeout):
+        """
+        Все накопившиеся события (JSON-строки); [] - таймаут, пора слать ping;
+        None - подписку закрыли, соединение пора завершать.
+        """
+        self._ready.wait(timeout)
+        self._ready.clear()
+        if self.closed:
+            return None
+        with self._lock:
+            if self._overflow:
+                self._overflow = False
+                self._pending.clear()
+                return [RESYNC]
+            items = list(self._pending)
+            self._pending.clear()
+        return items
+
+
+class EventBroker:
+    """
+    Раздача событий подписчикам по Telegram ID в пределах процесса.
+    Простаивающий подписчик - это Subscription без своих потоков и таймеров:
+    он ничего не стоит, пока для него нет событий.
+    """
+
+    def __init__(self, max_subscribers=5000, per_user=5):
+        self.max_subscribers = max_subscribers
+        self.per_user = per_user
+        self._subs = {}  # telegram_id -> [Subscription]
+        self._count = 0
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.rejected = 0
+
+    def subscribe(self, telegram_id):
+        """Новая подписка или None, если достигнут max_subscribers"""
+        sub = Subscription(telegram_id)
+        with self._lock:
+            subs = self._subs.setdefault(telegram_id, [])
+            if len(subs) >= self.per_user:
+                # Старые вкладки того же пользователя уступают место новой
+                subs.pop(0).close()
+                self._count -= 1
+            if self._count >= self.max_subscribers:
+                if not subs:
+                    del self._subs[telegram_id]
+                self.rejected += 1
+                return None
+            subs.append(sub)
+            self._count += 1
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.telegram_id)
+            if subs and sub in subs:
+                subs.remove(sub)
+                self._count -= 1
+                if not subs:
+                    del self._subs[sub.telegram_id]
+
+    def publish(self, telegram_id, payload):
+        with self._lock:
+            subs = list(self._subs.get(telegram_id, ()))
+            self.published += 1
+            self.delivered += len(subs)
+        for sub in subs:
+            sub.put(payload)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": self._count,
+                "users": len(self._subs),
+                "published": self.published,
+                "delivered": self.delivered,
+                "rejected": self.rejected,
+            }
+
+
+class EventRelay:
+    """
+    Переносит события из таблицы events (их пишут и webapp, и бот - в
+    транзакции операции) в EventBroker этого процесса. Каждый процесс
+    webapp читает outbox сам, начиная с момента запуска; строки старше
+    retention удаляются.
+    """
+
+    def __init__(self, db, broker, batch_size=1000, retention=600.0, prune_every=60.0, gap_timeout=2.0):
+        self.db = db
+        self.broker = broker
+        self.batch_size = batch_size
+        self.retention = retention
+        self.prune_every = prune_every
+        self.gap_timeout = gap_timeout
+        self._last_id = None   # все события до него включительно уже разосланы
+        self._sent = set()     # разосланные id после пропуска в нумерации
+        self._gap_since = None
+        self._last_prune = 0.0
+
+    def poll(self):
+        """Один проход: все новые события подписчикам"""
+        if self._last_id is None:
+            self._last_id = self.db.get_last_event_id()
+            if self._last_id is None:
+                return
+        while True:
+            rows = self.db.get_events_after(self._last_id, self.batch_size)
+            for event_id, telegram_id, payload in rows:
+                if event_id not in self._sent:
+                    self.broker.publish(telegram_id, payload)
+                    self._sent.add(event_id)
+            before = self._last_id
+            self._advance()
+            if len(rows) < self.batch_size or self._last_id == before:
+                break
+        if time.monotonic() - self._last_prune > self.prune_every:
+            self._last_prune = time.monotonic()
+            self.db.prune_events(self.retention)
+
+    def _advance(self):
+        """
+        Сдвигает _last_id по непрерывной нумерации. id выдаются при вставке,
+        а видны после коммита, поэтому пропуск может заполниться позже -
+        ждем его gap_timeout, потом считаем откатом и идем дальше.
+        """
+        while self._last_id + 1 in self._sent:
+            self._last_id += 1
+            self._sent.discard(self._last_id)
+        if not self._sent:
+            self._gap_since = None
+        elif self._gap_since is None:
+            self._gap_since = time.monotonic()
+        elif time.monotonic() - self._gap_since > self.gap_timeout:
+            self._last_id = min(self._sent) - 1
+            self._gap_since = None
+            self._advance()
@@ -0,0 +1,92 @@
+# grants.py
+import csv
+import hashlib
+import io
+from datetime import date
+
+# Получатель - номер студенческого (students.student_id, как в списке
+# деканата) или Telegram ID. Номер студенческого тоже бывает из одних цифр,
+# поэтому вид задается явно: префиксом "tg:" у строки или заголовком файла
+TELEGRAM_PREFIX = "tg:"
+TELEGRAM_HEADERS = ("telegram_id", "telegram_user_id", "tg")
+STUDENT_ID_HEADERS = ("student_id", "номер студенческого", "студенческий")
+STUDENT_ID_LENGTH = 20
+
+MAX_GRANT_ROWS = 20000
+
+
+def upload_id(text, default_description, day=None):
+    """
+    Идентификатор загрузки для ключей идемпотентности: хэш содержимого
+    списка и дня загрузки. Повтор того же списка в тот же день (например,
+    после ошибки БД) дает тот же id, такой же список на следующей неделе - новый.
+    """
+    day = day or date.today()
+    raw = f"{day.isoformat()}\n{default_description}\n{text}".encode()
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def parse_grants(text, default_description):
+    """
+    Разбирает CSV или вставленный список начислений. Строка:
+
+        <student_id | tg:telegram_id>, <сумма>[, <описание>]
+
+    Без префикса получатель - номер студенческого. Первая строка с
+    нечисловой суммой - заголовок, только если ее первая колонка - из
+    STUDENT_ID_HEADERS или TELEGRAM_HEADERS; заголовок с telegram_id
+    переключает весь файл на Telegram ID. Разделитель -
+    запятая, точка с запятой или табуляция; пустые строки пропускаются.
+    Возвращает (rows, errors):
+    rows - [{'line', 'kind', 'target', 'amount', 'description'}],
+    kind - 'student_id' или 'telegram';
+    errors - [(номер строки, исходный текст, причина)].
+    """
+    rows, errors = [], []
+    default_kind = 'student_id'
+    for line_no, line in enumerate(io.StringIO(text), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        delimiter = next((d for d in (";", "\t", ",") if d in line), ",")
+        fields = [f.strip() for f in next(csv.reader([line], delimiter=delimiter))]
+        if len(fields) < 2:
+            errors.append((line_no, line, "Нужно минимум два поля: получатель и сумма"))
+            continue
+
+        target, amount = fields[0], fields[1]
+        try:
+            amount = int(amount)
+        except ValueError:
+            header = target.lower()
+            if not rows and not errors and header in STUDENT_ID_HEADERS + TELEGRAM_HEADERS:
+                if header in TELEGRAM_HEADERS:
+                    default_kind = 'telegram'
+                continue
+            errors.append((line_no, line, "Сумма должна быть целым числом"))
+            continue
+        kind = default_kind
+        if target.lower().startswith(TELEGRAM_PREFIX):
+            kind, target = 'telegram', target[len(TELEGRAM_PREFIX):].strip()
+        if kind == 'telegram' and not target.isdigit():
+            errors.append((line_no, line, "Telegram ID - только цифры"))
+            continue
+        if kind == 'student_id' and not (target and len(target) <= STUDENT_ID_LENGTH):
+            errors.append((line_no, line, f"Номер студенческого - до {STUDENT_ID_LENGTH} символов"))
+            continue
+        if amount == 0:
+            errors.append((line_no, line, "Сумма должна быть ненулевой"))
+            continue
+
+        description = ", ".join(f for f in fields[2:] if f) or default_description
+        rows.append({
+            "line": line_no,
+            "kind": kind,
+            "target": target,
+            "amount": amount,
+            "description": description,
+        })
+        if len(rows) > MAX_GRANT_ROWS:
+            errors.append((line_no, line, f"Не больше {MAX_GRANT_ROWS} строк за раз"))
+            return [], errors
+    return rows, errors
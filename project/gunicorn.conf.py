@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+# Запуск webapp в продакшене (из папки project):
+#     gunicorn webapp:app
+#
+# SSE (/api/events) держит соединение открытым все время, пока открыт
+# мини-апп. С синхронными воркерами это поток на клиента, поэтому воркер -
+# gevent: простаивающее соединение стоит один greenlet, а threading в
+# events.py, tasks.py и пуле соединений gevent делает кооперативным.
+import os
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8000")
+worker_class = "gevent"
+# Одного процесса хватает на тысячи SSE-клиентов; планировщик аукционов
+# рассчитан на один процесс webapp
+workers = int(os.getenv("WEB_WORKERS", "1"))
+# Одновременных соединений на воркер; SSE_MAX_CLIENTS в webapp - не больше этого
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", "6000"))
+# У gevent-воркера timeout - проверка живости процесса, долгие SSE-ответы он не обрывает
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+keepalive = 75
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    # __main__ webapp не выполняется под gunicorn - фоновые задачи стартуют здесь
+    from webapp import start_background_tasks
+    start_background_tasks()
@@ -0,0 +1,43 @@
+# leaderboards.py
+from datetime import date, timedelta
+
+# Окна рейтинга по заработанным баллам и срезы, в которых их смотрят
+WINDOWS = ('week', 'month', 'semester')
+SCOPES = ('global', 'faculty', 'group')
+
+# Осенний семестр - с 1 сентября, весенний - с 1 февраля
+SEMESTER_STARTS = (2, 9)
+
+
+def window_start(window, day=None):
+    """Первый день окна, в которое попадает day"""
+    day = day or date.today()
+    if window == 'week':
+        return day - timedelta(days=day.weekday())
+    if window == 'month':
+        return day.replace(day=1)
+    if window == 'semester':
+        if day.month >= SEMESTER_STARTS[1]:
+            return date(day.year, SEMESTER_STARTS[1], 1)
+        if day.month >= SEMESTER_STARTS[0]:
+            return date(day.year, SEMESTER_STARTS[0], 1)
+        return date(day.year - 1, SEMESTER_STARTS[1], 1)
+    raise ValueError(f"Неизвестное окно: {window}")
+
+
+def window_end(window, start):
+    """Первый день следующего окна"""
+    if window == 'week':
+        return start + timedelta(days=7)
+    if window == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    if window == 'semester':
+        if start.month == SEMESTER_STARTS[0]:
+            return date(start.year, SEMESTER_STARTS[1], 1)
+        return date(start.year + 1, SEMESTER_STARTS[0], 1)
+    raise ValueError(f"Неизвестное окно: {window}")
+
+
+def previous_start(window, start):
+    """Начало предыдущего окна"""
+    return window_start(window, start - timedelta(days=1))
@@ -0,0 +1,147 @@
+# manage.py
+"""Служебные команды: python manage.py <команда>"""
+import argparse
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+from checkin import DEEP_LINK_PREFIX, CheckinDesk
+from db import db
+from grants import parse_grants, upload_id
+from roster import parse_roster
+
+
+def cmd_migrate(args):
+    applied = db.apply_migrations()
+    if applied is None:
+        return False
+    if not applied:
+        print("[MIGRATE] схема актуальна")
+        return True
+    # Новые таблицы заполняются из уже накопленных транзакций и балансов
+    return (db.backfill_daily_totals(batch_size=args.batch_size)
+            and db.backfill_leaderboards() and db.refresh_ranking())
+
+
+def cmd_backfill_daily_totals(args):
+    return db.backfill_daily_totals(batch_size=args.batch_size)
+
+
+def cmd_refresh_ranking(args):
+    return db.refresh_ranking()
+
+
+def cmd_backfill_leaderboards(args):
+    return db.backfill_leaderboards()
+
+
+def cmd_grant_points(args):
+    with open(args.file, encoding="utf-8-sig") as f:
+        text = f.read()
+    description = args.description or f"Начисление: {args.file}"
+    rows, errors = parse_grants(text, description)
+    report = db.admin_bulk_add_points(rows, upload_id(text, description), chunk_size=args.chunk_size) if rows else \
+        {'applied': 0, 'skipped': 0, 'failed': [], 'error': None}
+    print(f"[GRANTS] проведено {report['applied']}, пропущено {report['skipped']}")
+    for line, target, reason in sorted(errors + report['failed'], key=lambda f: f[0]):
+        print(f"[GRANTS] строка {line}: {target} - {reason}")
+    if report['error']:
+        print(f"[GRANTS] прервано: {report['error']}")
+    return not report['error']
+
+
+def cmd_import_students(args):
+    with open(args.file, encoding="utf-8-sig") as f:
+        rows, errors = parse_roster(f.read())
+    for line, student_id, reason in errors:
+        print(f"[IMPORT] строка {line}: {student_id or '-'} - {reason}")
+    report = db.import_students(rows, chunk_size=args.chunk_size)
+    print(f"[IMPORT] новых {report['created']}, обновлено {report['updated']}, с ошибками {len(errors)}")
+    if report['error']:
+        print(f"[IMPORT] прервано: {report['error']}")
+    return not report['error']
+
+
+def cmd_create_auction(args):
+    end_time = datetime.now() + timedelta(minutes=args.minutes)
+    ok, result = db.create_auction(args.seller, args.merch, args.start_price, end_time,
+                                   min_increment=args.min_increment)
+    print(f"[AUCTION] {'создан ' + result if ok else result}")
+    return ok
+
+
+def cmd_create_activity(args):
+    ok, result = db.create_activity(args.title, args.points, args.category,
+                                    start_date=args.start_date, end_date=args.end_date,
+                                    max_participants=args.max_participants)
+    print(f"[ACTIVITY] {'создана ' + result if ok else result}")
+    return ok
+
+
+def cmd_checkin_link(args):
+    token = CheckinDesk.from_env(db).token(args.activity, valid_seconds=args.hours * 3600)
+    bot = os.getenv("BOT_USERNAME", "<бот>")
+    # Одна ссылка на мероприятие: ее и печатают в QR-коде у входа
+    print(f"https://t.me/{bot}?start={DEEP_LINK_PREFIX}{token}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="применить migrations/*.sql к базе, созданной по старой схеме")
+    p.add_argument("--batch-size", type=int, default=1000, help="студентов в одной транзакции backfill")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("backfill-daily-totals", help="пересобрать daily_totals из transactions")
+    p.add_argument("--batch-size", type=int, default=1000, help="студентов в одной транзакции")
+    p.set_defaults(func=cmd_backfill_daily_totals)
+
+    p = sub.add_parser("refresh-ranking", help="пересчитать места в таблице ranking")
+    p.set_defaults(func=cmd_refresh_ranking)
+
+    p = sub.add_parser("backfill-leaderboards", help="пересобрать рейтинги недели/месяца/семестра из daily_totals")
+    p.set_defaults(func=cmd_backfill_leaderboards)
+
+    p = sub.add_parser("grant-points", help="массовое начисление баллов из CSV")
+    p.add_argument("file", help="CSV: номер студенческого или tg:telegram_id, сумма[, описание]")
+    p.add_argument("--description", help="описание для строк без своего")
+    p.add_argument("--chunk-size", type=int, default=500, help="строк в одной пачке")
+    p.set_defaults(func=cmd_grant_points)
+
+    p = sub.add_parser("import-students", help="импорт студентов из CSV деканата")
+    p.add_argument("file", help="CSV с заголовком: student_id, last_name, first_name, "
+                                "middle_name, group, faculty, faculty_name")
+    p.add_argument("--chunk-size", type=int, default=500, help="студентов в одной транзакции")
+    p.set_defaults(func=cmd_import_students)
+
+    p = sub.add_parser("create-auction", help="выставить товар на аукцион")
+    p.add_argument("--seller", type=int, required=True, help="Telegram ID проводящего аукцион")
+    p.add_argument("--merch", required=True, help="id товара")
+    p.add_argument("--start-price", type=int, required=True)
+    p.add_argument("--minutes", type=int, default=60, help="длительность торгов")
+    p.add_argument("--min-increment", type=int, default=1, help="минимальный шаг ставки")
+    p.set_defaults(func=cmd_create_auction)
+
+    p = sub.add_parser("create-activity", help="новое мероприятие")
+    p.add_argument("title")
+    p.add_argument("--points", type=int, required=True)
+    p.add_argument("--category", default="culture")
+    p.add_argument("--start-date", type=date.fromisoformat)
+    p.add_argument("--end-date", type=date.fromisoformat)
+    p.add_argument("--max-participants", type=int)
+    p.set_defaults(func=cmd_create_activity)
+
+    p = sub.add_parser("checkin-link", help="ссылка для QR-кода отметки на мероприятии")
+    p.add_argument("--activity", required=True, help="id активности")
+    p.add_argument("--hours", type=int, default=6, help="сколько часов ссылка действительна")
+    p.set_defaults(func=cmd_checkin_link)
+
+    args = parser.parse_args()
+    ok = args.func(args)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# metrics.py
+import functools
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+# Метод Database, который сейчас выполняется: к нему относятся запросы и ожидание пула
+current_method = ContextVar("current_method", default="other")
+
+# Порог журнала медленных запросов, мс (0 - выключен)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, doc, labels=(), buckets=DB_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счетчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        names = self.labels + ("le",)
+        for label_values, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(names, label_values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(names, label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class StatsGauges:
+    """
+    Gauge-метрики из словаря статистики, который отдает fn() в момент
+    выгрузки (pool.stats(), cache_stats()). label задан - fn возвращает
+    {значение метки: {ключ: число}}, иначе {ключ: число}.
+    """
+
+    def __init__(self, prefix, fn, label=None):
+        self.prefix = prefix
+        self.fn = fn
+        self.label = label
+
+    def render(self):
+        stats = self.fn()
+        groups = stats.items() if self.label else [(None, stats)]
+        series = {}
+        for label_value, values in groups:
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                labels = _format_labels((self.label,), (label_value,)) if self.label else ""
+                series.setdefault(key, []).append(f"{self.prefix}_{key}{labels} {_format_value(value)}")
+        lines = []
+        for key, samples in sorted(series.items()):
+            lines.append(f"# TYPE {self.prefix}_{key} gauge")
+            lines.extend(samples)
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as err:
+                print(f"[METRICS ERROR] {getattr(metric, 'name', metric)}: {err}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+db_queries = registry.register(Counter(
+    "db_queries_total", "SQL statements executed", ("method",)))
+# Одно наблюдение на запрос: время execute; чтение результата - отдельно в db_fetch_seconds
+db_query_seconds = registry.register(Histogram(
+    "db_query_seconds", "Time spent in execute", ("method",)))
+db_fetch_seconds = registry.register(Histogram(
+    "db_fetch_seconds", "Time spent fetching result sets", ("method",)))
+db_rows = registry.register(Counter(
+    "db_rows_total", "Rows fetched from result sets", ("method",)))
+db_connection_wait_seconds = registry.register(Histogram(
+    "db_connection_wait_seconds", "Time waiting for a pooled connection", ("method",)))
+db_method_seconds = registry.register(Histogram(
+    "db_method_seconds", "Database method latency", ("method",)))
+db_errors = registry.register(Counter(
+    "db_errors_total", "Exceptions raised by Database methods", ("method", "error")))
+http_request_seconds = registry.register(Histogram(
+    "http_request_seconds", "HTTP request latency", ("endpoint", "method", "status"), HTTP_BUCKETS))
+
+
+def register_stats(prefix, fn, label=None):
+    return registry.register(StatsGauges(prefix, fn, label))
+
+
+def instrument_methods(skip=()):
+    """
+    Декоратор класса: каждый публичный метод (кроме skip) меряет свое время
+    и ошибки, а запросы внутри него считаются под его именем.
+    """
+    def decorate(cls):
+        for name, attr in list(vars(cls).items()):
+            if name.startswith("_") or name in skip or not callable(attr):
+                continue
+            setattr(cls, name, _instrumented(name, attr))
+        return cls
+    return decorate
+
+
+def _instrumented(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_method.set(name)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as err:
+            db_errors.inc(name, type(err).__name__)
+            raise
+        finally:
+            db_method_seconds.observe(time.perf_counter() - start, name)
+            current_method.reset(token)
+    return wrapper
+
+
+def observe_connection_wait(seconds):
+    db_connection_wait_seconds.observe(seconds, current_method.get())
+
+
+# ==========================
+# КУРСОРЫ
+# ==========================
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def params_shape(params, many=False):
+    """Типы параметров без значений: в журнал не попадают персональные данные"""
+    if many:
+        params = list(params)
+        first = params_shape(params[0]) if params else "()"
+        return f"{len(params)} x {first}"
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+
+
+class InstrumentedConnection:
+    """Соединение, курсоры которого считают запросы, время и строки"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._conn.close()
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._statement = None  # [sql, params_shape, секунды, уже в журнале]
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params, *args, **kwargs)
+        finally:
+            self._executed(sql, lambda: params_shape(params), time.perf_counter() - start)
+
+    def executemany(self, sql, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq_params, *args, **kwargs)
+        finally:
+            self._executed(sql, lambda: params_shape(seq_params, many=True), time.perf_counter() - start)
+
+    def fetchone(self):
+        return self._fetched(self._cursor.fetchone, lambda row: 0 if row is None else 1)
+
+    def fetchall(self):
+        return self._fetched(self._cursor.fetchall, len)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._fetched(lambda: self._cursor.fetchmany(*args, **kwargs), len)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _executed(self, sql, shape, elapsed):
+        method = current_method.get()
+        db_queries.inc(method)
+        db_query_seconds.observe(elapsed, method)
+        self._statement = [sql, shape, elapsed, False]
+        self._check_slow(method)
+
+    def _fetched(self, fetch, count):
+        start = time.perf_counter()
+        result = fetch()
+        elapsed = time.perf_counter() - start
+        method = current_method.get()
+        db_fetch_seconds.observe(elapsed, method)
+        rows = count(result)
+        if rows:
+            db_rows.inc(method, amount=rows)
+        if self._statement:
+            self._statement[2] += elapsed
+            self._check_slow(method)
+        return result
+
+    def _check_slow(self, method):
+        sql, shape, elapsed, logged = self._statement
+        if not SLOW_QUERY_MS or logged or elapsed * 1000 < SLOW_QUERY_MS:
+            return
+        self._statement[3] = True
+        text = _WHITESPACE_RE.sub(" ", sql).strip()
+        if len(text) > 1000:
+            text = text[:1000] + "..."
+        print(f"[SLOW QUERY] {method} {elapsed * 1000:.1f} ms: {text} params={shape()}")
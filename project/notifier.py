@@ -0,0 +1,207 @@
+# notifier.py
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+import requests
+
+
+class RateLimiter:
+    """Token bucket: не больше rate событий в секунду, всплеск до burst"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self):
+        """Забирает токен; возвращает, сколько секунд нужно подождать (0 - можно сразу)"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class TelegramNotifier:
+    """
+    Фоновая отправка сообщений в Telegram.
+
+    send() только кладет сообщение в очередь и сразу возвращается.
+    Отдельный поток отправляет их через одну HTTP-сессию (keep-alive),
+    соблюдая лимиты Telegram: ~30 сообщений/с всего и ~1 сообщение/с в чат.
+    При 429 ждет retry_after, при сетевых ошибках и 5xx повторяет с
+    экспоненциальной задержкой.
+
+    Очередь в памяти: при аварийном падении процесса неотправленные
+    уведомления теряются, при штатной остановке stop() дожидается отправки.
+    """
+
+    def __init__(self, token, api_url="https://api.telegram.org", global_rate=30.0,
+                 per_chat_interval=1.0, max_retries=5, timeout=10.0, max_queue=10000):
+        self.token = token
+        self.api_url = api_url.rstrip("/")
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_queue = max_queue
+
+        self._limiter = RateLimiter(global_rate)
+        self._chat_next = {}      # chat_id -> когда можно писать в чат снова
+        self._heap = []           # (не раньше, seq, сообщение)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._in_flight = 0
+        self._session = requests.Session()
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("BOT_TOKEN"),
+            api_url=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org"),
+            global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+            per_chat_interval=float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1")),
+        )
+
+    # --- Публичный интерфейс ---
+
+    def send(self, chat_id, text, parse_mode="HTML"):
+        """Ставит сообщение в очередь. False - если очередь переполнена."""
+        if not self.token:
+            return False
+        msg = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode, "attempt": 0}
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._push(time.monotonic(), msg)
+            self._ensure_started()
+        return True
+
+    def stop(self, timeout=10.0):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает поток"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._heap or self._in_flight) and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+            self._thread = None
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) + self._in_flight
+
+    def stats(self):
+        return {"pending": self.pending(), "sent": self.sent,
+                "failed": self.failed, "dropped": self.dropped}
+
+    # --- Внутреннее ---
+
+    def _push(self, not_before, msg):
+        heapq.heappush(self._heap, (not_before, next(self._seq), msg))
+        self._cond.notify()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="tg-notifier", daemon=True)
+            self._thread.start()
+
+    def _next_message(self):
+        """Ждет сообщение, которое уже можно отправить с учетом всех лимитов"""
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                not_before, _, msg = self._heap[0]
+                now = time.monotonic()
+                if not_before > now:
+                    self._cond.wait(not_before - now)
+                    continue
+                heapq.heappop(self._heap)
+
+                chat_ready = self._chat_next.get(msg["chat_id"], 0.0)
+                if chat_ready > now:
+                    # В этот чат писать рано - откладываем, не блокируя остальные
+                    self._push(chat_ready, msg)
+                    continue
+                wait = self._limiter.reserve()
+                if wait > 0:
+                    self._push(now + wait, msg)
+                    continue
+
+                self._chat_next[msg["chat_id"]] = now + self.per_chat_interval
+                if len(self._chat_next) > 10000:
+                    self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+                self._in_flight += 1
+                return msg
+
+    def _run(self):
+        while True:
+            msg = self._next_message()
+            if msg is None:
+                return
+            try:
+                retry_in = self._deliver(msg)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    if retry_in is not None:
+                        msg["attempt"] += 1
+                        self._push(time.monotonic() + retry_in, msg)
+                    self._cond.notify_all()
+
+    def _deliver(self, msg):
+        """Отправляет сообщение. Возвращает задержку до повтора или None."""
+        url = f"{self.api_url}/bot{self.token}/sendMessage"
+        payload = {"chat_id": msg["chat_id"], "text": msg["text"], "parse_mode": msg["parse_mode"]}
+        retry_in = None
+        try:
+            resp = self._session.post(url, json=payload, timeout=self.timeout)
+            if resp.status_code == 200:
+                self.sent += 1
+                return None
+            if resp.status_code == 429:
+                try:
+                    retry_in = float(resp.json()["parameters"]["retry_after"])
+                except (ValueError, KeyError, TypeError):
+                    retry_in = None
+                retry_in = retry_in or self._backoff(msg["attempt"])
+            elif resp.status_code >= 500:
+                retry_in = self._backoff(msg["attempt"])
+            else:
+                # 400/403: чат не найден, бот заблокирован - повтор не поможет
+                print(f"[NOTIFY ERROR] {msg['chat_id']}: {resp.status_code} {resp.text[:200]}")
+                self.failed += 1
+                return None
+        except requests.RequestException as e:
+            print(f"[NOTIFY ERROR] Ошибка отправки: {e}")
+            retry_in = self._backoff(msg["attempt"])
+
+        if msg["attempt"] >= self.max_retries:
+            print(f"[NOTIFY ERROR] {msg['chat_id']}: сообщение отброшено после {msg['attempt'] + 1} попыток")
+            self.failed += 1
+            return None
+        return retry_in
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(60.0, 0.5 * (2 ** attempt)) * random.uniform(0.8, 1.2)
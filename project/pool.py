@@ -0,0 +1,192 @@
+# pool.py
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class PooledConnection:
+    """Обертка над соединением: close() возвращает его в пул, а не рвет"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw)
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise AttributeError(f"Соединение уже возвращено в пул ({name})")
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Ограниченный потокобезопасный пул соединений.
+
+    factory      - функция, открывающая новое соединение
+    min_size     - сколько соединений держим открытыми даже при простое
+    max_size     - верхняя граница открытых соединений
+    timeout      - сколько секунд ждать свободное соединение
+    idle_timeout - через сколько секунд простоя закрываем лишние соединения
+    ping_interval - соединения, простоявшие дольше, проверяются перед выдачей
+    """
+
+    def __init__(self, factory, min_size=2, max_size=10, timeout=5.0,
+                 idle_timeout=300.0, ping_interval=30.0):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Некорректные размеры пула")
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()  # (conn, время возврата в пул)
+        self._size = 0        # всего открыто (в пуле + выдано)
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+    # --- Выдача / возврат ---
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, last_used, create = None, None, False
+            with self._cond:
+                evicted = self._evict_idle()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Нет свободных соединений ({self.max_size}) за {self.timeout} с")
+                    self._waits += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            for old in evicted:
+                self._close_quietly(old)
+
+            if create:
+                try:
+                    conn = self._factory()
+                except Exception:
+                    self._forget()
+                    raise
+                with self._cond:
+                    self._created += 1
+                return conn
+
+            # Проверка здоровья - только для давно простаивавших соединений
+            if time.monotonic() - last_used < self.ping_interval or self._is_alive(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        try:
+            # Незавершенная транзакция не должна перейти к следующему владельцу
+            if getattr(conn, "in_transaction", False):
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def connection(self):
+        """Соединение-обертка для использования в коде: conn.close() вернет его в пул"""
+        return PooledConnection(self, self.acquire())
+
+    # --- Обслуживание ---
+
+    def warmup(self):
+        """Открывает соединения до min_size заранее, чтобы первый запрос не ждал"""
+        conns = []
+        try:
+            for _ in range(self.min_size):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+                "created": self._created,
+                "discarded": self._discarded,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+            }
+
+    # --- Внутреннее ---
+
+    def _evict_idle(self):
+        # Вызывается под блокировкой. Самые старые соединения лежат слева,
+        # закрываются они уже после выхода из блокировки.
+        now = time.monotonic()
+        evicted = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.idle_timeout):
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._discarded += 1
+            evicted.append(conn)
+        return evicted
+
+    def _is_alive(self, conn):
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self._cond:
+            self._discarded += 1
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,51 @@
+# roster.py
+import csv
+import io
+
+# Колонки списка деканата; обязательные - student_id, last_name, first_name
+ROSTER_COLUMNS = ("student_id", "last_name", "first_name", "middle_name", "group", "faculty", "faculty_name")
+REQUIRED_COLUMNS = ("student_id", "last_name", "first_name")
+
+# Ограничения длины из схемы (diplom.sql)
+MAX_LENGTH = {"student_id": 20, "last_name": 50, "first_name": 50, "middle_name": 50,
+              "group": 10, "faculty": 10, "faculty_name": 100}
+
+
+def parse_roster(text):
+    """
+    Разбирает CSV со строкой-заголовком (разделитель , ; или табуляция).
+    Возвращает (rows, errors): rows - dict по ROSTER_COLUMNS (пустые поля - None),
+    errors - [(номер строки, student_id, причина)].
+    """
+    header_line = text.split("\n", 1)[0]
+    delimiter = next((d for d in (";", "\t", ",") if d in header_line), ",")
+    reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
+    header = [h.strip().lower() for h in reader.fieldnames or []]
+    missing = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing:
+        return [], [(1, None, f"Нет колонок: {', '.join(missing)}")]
+    reader.fieldnames = header
+
+    rows, errors, seen = [], [], set()
+    for record in reader:
+        line = reader.line_num
+        row = {c: (record.get(c) or "").strip() or None for c in ROSTER_COLUMNS}
+        if not any(row.values()):
+            continue
+        empty = [c for c in REQUIRED_COLUMNS if not row[c]]
+        if empty:
+            errors.append((line, row["student_id"], f"Пустые поля: {', '.join(empty)}"))
+            continue
+        too_long = [c for c, limit in MAX_LENGTH.items() if row[c] and len(row[c]) > limit]
+        if too_long:
+            errors.append((line, row["student_id"], f"Слишком длинные поля: {', '.join(too_long)}"))
+            continue
+        if row["group"] and not row["faculty"]:
+            errors.append((line, row["student_id"], "У группы не указан факультет"))
+            continue
+        if row["student_id"] in seen:
+            errors.append((line, row["student_id"], "Повтор student_id"))
+            continue
+        seen.add(row["student_id"])
+        rows.append(row)
+    return rows, errors
@@ -0,0 +1,412 @@
+const tg = (window.Telegram && window.Telegram.WebApp) ? window.Telegram.WebApp : null;
+if (tg) tg.expand();
+
+const userId = new URLSearchParams(window.location.search).get('user_id');
+let currentMerchId = null; // Для хранения ID текущего открытого товара (пока фейковый)
+
+// --- Утилиты ---
+function uiAlert(msg) {
+  if (tg && tg.showPopup) tg.showAlert(msg);
+  else alert(msg);
+}
+
+function uiConfirm(msg, callback) {
+  if (tg && tg.showPopup) tg.showConfirm(msg, callback);
+  else { const r = confirm(msg); callback(r); }
+}
+
+let myChart = null;
+
+// --- НАВИГАЦИЯ ---
+function showTab(tabId, el) {
+    document.querySelectorAll('.content-section').forEach(s => s.classList.remove('active'));
+    document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
+
+    document.getElementById(tabId).classList.add('active');
+    if (el) el.classList.add('active');
+
+    // Логика загрузки данных
+    if(tabId === 'main') updateAllData(); 
+    if(tabId === 'exchange') loadServices();
+    // Вкладка merch теперь статичная (хардкод), но можно вызвать loadMerch() если нужно из БД
+}
+
+// --- ДАННЫЕ ПРОФИЛЯ ---
+function renderChart(stats) {
+  const ctx = document.getElementById('expensesChart').getContext('2d');
+  if (myChart) myChart.destroy();
+  myChart = new Chart(ctx, {
+    type: 'line',
+    data: {
+      labels: stats.map(s => s.date),
+      datasets: [{
+        label: 'Траты',
+        data: stats.map(s => s.spent),
+        borderColor: '#2481cc',
+        tension: 0.4,
+        fill: true,
+        backgroundColor: 'rgba(36, 129, 204, 0.1)'
+      }, {
+        label: 'Доходы',
+        data: stats.map(s => s.earned),
+        borderColor: '#4caf50',
+        tension: 0.4,
+        fill: false
+      }]
+    },
+    options: { responsive: true, maintainAspectRatio: false, plugins: { legend: { display: true, position: 'bottom' } }, scales: { y: { beginAtZero: true, grid: { display: false } }, x: { grid: { display: false } } } }
+  });
+}
+
+function loadStats(days) {
+  fetch(`/api/stats/${userId}?days=${days}`).then(r => r.json()).then(stats => renderChart(stats));
+}
+
+// Все данные профиля одним запросом; sections - только нужные разделы
+function updateAllData(sections) {
+  const query = sections ? `?sections=${sections.join(',')}` : '';
+  fetch(`/api/dashboard/${userId}${query}`).then(r => r.json()).then(data => {
+    if (data.user) document.getElementById('balance-display').innerText = data.user.current_points;
+    if (data.stats) {
+      renderChart(data.stats);
+      document.getElementById('stats-range').value = '7';
+    }
+    if (data.history) renderHistory(data.history);
+    if (data.leaderboard && document.getElementById('leaderboard-window').value === 'all') {
+      renderLeaderboard(data.leaderboard);
+    }
+  });
+}
+
+function renderLeaderboard(list) {
+  document.getElementById('leaderboard').innerHTML = list.map((s, i) => 
+    `<div style="display:flex; justify-content:space-between; padding: 8px 0; border-bottom: 1px solid rgba(0,0,0,0.05);">
+      <span>${i+1}. ${s.first_name}</span><b>${s.current_points ?? s.points}</b>
+    </div>`).join('');
+}
+
+// Рейтинг за неделю/месяц/семестр: в целом, по факультету или группе
+function loadLeaderboard() {
+  const win = document.getElementById('leaderboard-window').value;
+  const scopeSelect = document.getElementById('leaderboard-scope');
+  const me = document.getElementById('leaderboard-me');
+  scopeSelect.style.display = win === 'all' ? 'none' : '';
+  if (win === 'all') {
+    me.innerText = '';
+    return updateAllData(['leaderboard']);
+  }
+  fetch(`/api/leaderboard/${win}/${scopeSelect.value}?user_id=${userId}`).then(r => r.json()).then(data => {
+    if (data.error) { me.innerText = data.error; return; }
+    renderLeaderboard(data.items);
+    me.innerText = data.me && data.me.position
+      ? `Ваше место: ${data.me.position} (${data.me.points} STC)`
+      : 'Вы еще не заработали баллов в этом периоде';
+  });
+}
+
+// --- ИСТОРИЯ (бесконечная прокрутка) ---
+let historyCursor = null;
+let historyLoading = false;
+
+function historyItemHtml(item) {
+  return `
+    <div class="history-item">
+      <div>
+        <div style="font-weight: 500; font-size: 14px;">${item.description}</div>
+        <div class="history-meta">${item.created_at}</div>
+      </div>
+      <div class="history-amount ${item.type}">
+        ${item.type === 'earn' ? '+' : '-'}${item.amount}
+      </div>
+    </div>
+  `;
+}
+
+// Первая страница: приходит в составе /api/dashboard
+function renderHistory(page) {
+  historyCursor = page.next_cursor;
+  if (!page.items || page.items.length === 0) {
+      document.getElementById('history-list').innerHTML = '<div style="text-align:center; padding:10px; color:var(--tg-hint)">Истории пока нет</div>';
+      return;
+  }
+  document.getElementById('history-list').innerHTML = page.items.map(historyItemHtml).join('');
+}
+
+// Следующие страницы: догружаем, когда низ списка появился на экране
+function loadMoreHistory() {
+  if (!historyCursor || historyLoading) return;
+  historyLoading = true;
+  fetch(`/api/history/${userId}?cursor=${encodeURIComponent(historyCursor)}`).then(r => r.json()).then(page => {
+    historyCursor = page.next_cursor;
+    document.getElementById('history-list').insertAdjacentHTML('beforeend', page.items.map(historyItemHtml).join(''));
+  }).finally(() => { historyLoading = false; });
+}
+
+new IntersectionObserver(entries => {
+  if (entries.some(e => e.isIntersecting)) loadMoreHistory();
+}).observe(document.getElementById('history-sentinel'));
+
+// --- МЕРЧ МОДАЛКА ---
+// Открытие
+function openMerchModal(title, price, material, sizes, status, imgUrl) {
+    document.getElementById('modal-title').innerText = title;
+    document.getElementById('modal-price').innerText = price + ' STC';
+    document.getElementById('modal-material').innerText = material;
+    document.getElementById('modal-sizes').innerText = sizes;
+    document.getElementById('modal-status').innerText = status;
+    document.getElementById('modal-img').src = imgUrl;
+
+    // В реальном проекте тут должен быть реальный ID из БД. 
+    // Пока используем заглушку, чтобы кнопка работала визуально.
+    currentMerchId = 'dummy_id'; 
+
+    document.getElementById('merch-modal').style.display = 'flex';
+}
+
+// Закрытие
+function closeMerchModal() {
+    document.getElementById('merch-modal').style.display = 'none';
+}
+
+// Покупка (вызывает API)
+function buyCurrentMerch() {
+  uiConfirm("Вы уверены, что хотите заказать этот товар?", (ok) => {
+    if(ok) {
+      // Здесь мы отправляем ID. Так как карточки тестовые, 
+      // сервер может вернуть ошибку "Товар не найден", если в БД нет товара с таким ID.
+      // Но логика запроса сохранена.
+      fetch('/api/buy_merch', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({user_id: userId, merch_id: currentMerchId})
+      }).then(r => r.json()).then(res => {
+        uiAlert(res.message);
+        closeMerchModal();
+        // Баланс и строку истории пришлет поток событий, график - нет
+        updateAllData(liveUpdates ? ['stats'] : ['user', 'stats', 'history']);
+      });
+    }
+  });
+}
+
+// --- ОТМЕТКА НА МЕРОПРИЯТИИ ---
+function scanCheckin() {
+  if (!tg || !tg.showScanQrPopup) { uiAlert('Сканер QR-кодов доступен только в Telegram'); return; }
+  tg.showScanQrPopup({text: 'Наведите камеру на QR-код мероприятия'}, (text) => {
+    // В QR - ссылка t.me/<бот>?start=checkin_<токен>, сервер примет и ее целиком
+    const token = text.split('start=')[1] || text;
+    fetch('/api/checkin', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({user_id: userId, token: token})
+    }).then(r => r.json()).then(res => uiAlert(res.message));
+    return true;  // закрыть сканер
+  });
+}
+
+// --- БИРЖА УСЛУГ ---
+let servicesCursor = null;
+// Показанные карточки по id: изменения статуса применяются к ним на месте
+let servicesById = {};
+
+// Сервер уже отфильтровал выполненные задания (status=active)
+function loadServices(more) {
+    const sort = document.getElementById('services-sort').value;
+    let url = `/api/services?user_id=${userId}&status=active&sort=${sort}`;
+    if (more && servicesCursor) url += `&cursor=${encodeURIComponent(servicesCursor)}`;
+    fetch(url).then(r => r.json()).then(page => {
+    const list = document.getElementById('services-list');
+    servicesCursor = page.next_cursor;
+    document.getElementById('services-more').style.display = servicesCursor ? 'block' : 'none';
+    if (!more) servicesById = {};
+    if (!more && page.items.length === 0) {
+        list.innerHTML = '<div style="text-align:center; padding:20px; color:var(--tg-hint)">Заданий нет</div>';
+        return;
+    }
+
+    page.items.forEach(s => { servicesById[s.id] = s; });
+    const html = page.items.map(serviceCardHtml).join('');
+    if (more) list.insertAdjacentHTML('beforeend', html);
+    else list.innerHTML = html;
+    });
+}
+
+function serviceCardHtml(s) {
+    let actionButton = '';
+    let statusBadge = '';
+
+    if (s.is_my_task) {
+    if (s.status === 'in_progress') {
+        statusBadge = '<span style="color:#2481cc;">⚙️ В работе</span>';
+        actionButton = `<button class="btn" style="background:#4caf50; margin-top:5px;" onclick="confirmTask('${s.id}', '${s.order_id}')">✅ Принять и оплатить</button>
+        <button class="btn" style="background:#e53935; margin-top:5px;" onclick="cancelTask('${s.id}', '${s.order_id}')">✖️ Отменить</button>`;
+    } else {
+        statusBadge = '<span style="color:var(--tg-hint);">⏳ Ждем исполнителя</span>';
+    }
+    } else {
+    if (s.status === 'open') {
+        actionButton = `<button class="btn" onclick="takeTask('${s.id}')">⚡️ Выполнить за ${s.points_cost}</button>`;
+    } else if (s.am_i_executor) {
+        statusBadge = '<span style="color:#4caf50; font-weight:bold;">🛠 Вы выполняете</span>';
+        actionButton = `<div style="font-size:12px; margin-top:5px; color:var(--tg-hint);">Выполните работу и сообщите заказчику</div>
+        <button class="btn" style="background:#e53935; margin-top:5px;" onclick="cancelTask('${s.id}', '${s.order_id}')">✖️ Отказаться</button>`;
+    } else {
+        statusBadge = '<span style="color:var(--tg-hint);">🔒 Занято</span>';
+    }
+    }
+
+    return `
+    <div class="service-item" data-service-id="${s.id}">
+    <div style="display:flex; justify-content:space-between; align-items:start;">
+        <div style="flex:1; padding-right:10px;">
+        <div style="font-weight:700; font-size:15px;">${s.name}</div>
+        <div style="font-size:13px; margin:4px 0;">${s.description || ''}</div>
+        <div style="font-size:11px; color:var(--tg-hint);">
+            Автор: ${s.is_my_task ? 'Вы' : s.provider_name}
+        </div>
+        <div style="margin-top:5px;">${statusBadge}</div>
+        </div>
+        <div style="text-align:right; min-width:80px;">
+        <div style="color:var(--tg-link); font-weight:800; font-size:16px;">${s.points_cost}</div>
+        ${actionButton}
+        </div>
+    </div>
+    </div>
+    `;
+}
+
+// Новое состояние услуги (из ответа API или события 'task') - в ее карточку.
+// Версия отсекает устаревшее: ответ и событие об одном переходе приходят оба
+function patchService(state) {
+    const s = state && servicesById[state.id];
+    if (!s || state.version <= s.version) return;
+    const card = document.querySelector(`[data-service-id="${state.id}"]`);
+    if (state.status === 'completed') {
+        // Выполненные на бирже не показываются
+        delete servicesById[state.id];
+        if (card) card.remove();
+        return;
+    }
+    s.status = state.status;
+    s.version = state.version;
+    s.order_id = state.order_id;
+    // События 'task' приходят только заказчику и исполнителю
+    s.am_i_executor = !s.is_my_task && state.status === 'in_progress';
+    if (card) card.outerHTML = serviceCardHtml(s);
+}
+
+function toggleCreateService(force) {
+    const card = document.getElementById('create-service-card');
+    const show = (typeof force === 'boolean') ? force : (card.style.display === 'none');
+    card.style.display = show ? 'block' : 'none';
+}
+
+function createService() {
+    const name = document.getElementById('svc-name').value.trim();
+    const price = parseInt(document.getElementById('svc-price').value, 10);
+    const desc = document.getElementById('svc-desc').value.trim();
+    if (!name || !price || price < 1) return uiAlert('Заполни поля корректно.');
+
+    uiConfirm(`Опубликовать?`, (ok) => {
+        if (!ok) return;
+        fetch('/api/add_service', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({user_id: parseInt(userId, 10), name: name, points_cost: price, description: desc})
+        }).then(r => r.json()).then(res => {
+            uiAlert(res.message || (res.success ? 'Готово' : 'Ошибка'));
+            if (res.success) {
+                toggleCreateService(false);
+                loadServices();
+            }
+        });
+    });
+}
+
+function takeTask(id) {
+    uiConfirm("Взять задание?", (ok) => {
+        if(!ok) return;
+        fetch('/api/take_task', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({user_id: userId, service_id: id})
+        }).then(r => r.json()).then(res => { uiAlert(res.message); patchService(res.service); });
+    });
+}
+
+function confirmTask(serviceId, orderId) {
+    uiConfirm("Подтвердить выполнение?", (ok) => {
+        if(!ok) return;
+        fetch('/api/confirm_task', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({user_id: userId, service_id: serviceId, order_id: orderId})
+        }).then(r => r.json()).then(res => {
+            uiAlert(res.message);
+            patchService(res.service);
+            // Баланс и строки истории пришлет поток событий, график - нет
+            if (res.success) updateAllData(liveUpdates ? ['stats', 'leaderboard'] : ['user', 'stats', 'history', 'leaderboard']);
+        });
+    });
+}
+
+function cancelTask(serviceId, orderId) {
+    uiConfirm("Отменить заказ?", (ok) => {
+        if(!ok) return;
+        fetch('/api/cancel_task', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({user_id: userId, service_id: serviceId, order_id: orderId})
+        }).then(r => r.json()).then(res => { uiAlert(res.message); patchService(res.service); });
+    });
+}
+
+// --- ЖИВЫЕ ОБНОВЛЕНИЯ (SSE) ---
+// Сервер сам присылает изменения: баланс, новые строки истории, статусы заданий.
+// Пока поток открыт, после действий не перезапрашиваем то, что придет событием.
+let liveUpdates = false;
+
+function applyEvent(ev) {
+  if (ev.type === 'balance') {
+    document.getElementById('balance-display').innerText = ev.current_points;
+  } else if (ev.type === 'history') {
+    const list = document.getElementById('history-list');
+    if (!list.querySelector('.history-item')) list.innerHTML = '';  // заглушка "Истории пока нет"
+    list.insertAdjacentHTML('afterbegin', historyItemHtml(ev.item));
+  } else if (ev.type === 'task') {
+    patchService({id: ev.service_id, status: ev.service_status, version: ev.version,
+                  order_id: ev.service_status === 'in_progress' ? ev.order_id : null});
+  } else if (ev.type === 'checkin' && ev.status === 'rejected') {
+    // Отметку приняли у входа, но при записи мест уже не осталось
+    uiAlert(ev.message);
+  } else if (ev.type === 'resync') {
+    updateAllData();
+    if (document.getElementById('exchange').classList.contains('active')) loadServices();
+  }
+}
+
+function connectEvents() {
+  if (!window.EventSource || !userId) return;
+  const source = new EventSource(`/api/events/${userId}`);
+  let reconnecting = false;
+  source.onopen = () => {
+    liveUpdates = true;
+    // Пока соединения не было, события могли пройти мимо
+    if (reconnecting) updateAllData();
+  };
+  source.onmessage = (e) => applyEvent(JSON.parse(e.data));
+  source.onerror = () => {
+    // EventSource переподключится сам через retry
+    liveUpdates = false;
+    reconnecting = true;
+  };
+}
+
+// --- FAQ ЛОГИКА ---
+function toggleFaq(el) {
+    el.classList.toggle('active');
+}
+
+// Инициализация при старте
+updateAllData();
+connectEvents();
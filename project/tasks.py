@@ -0,0 +1,40 @@
+# tasks.py
+import threading
+
+
+class PeriodicTask:
+    """Фоновый поток, вызывающий fn каждые interval секунд"""
+
+    def __init__(self, fn, interval, name=None, run_immediately=True):
+        self.fn = fn
+        self.interval = interval
+        self.name = name or getattr(fn, "__name__", "periodic")
+        self.run_immediately = run_immediately
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        # Безопасно звать из нескольких потоков: поток будет один
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        if not self.run_immediately and self._stop.wait(self.interval):
+            return
+        while True:
+            try:
+                self.fn()
+            except Exception as e:
+                print(f"[TASK ERROR] {self.name}: {e}")
+            if self._stop.wait(self.interval):
+                return
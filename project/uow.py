@@ -0,0 +1,118 @@
+# uow.py
+from contextvars import ContextVar
+
+# Текущий unit of work. ContextVar, а не threading.local: так он корректно
+# изолирован и между потоками Flask, и между asyncio-задачами бота.
+current_uow = ContextVar("current_uow", default=None)
+
+
+class TransactionRolledBack(Exception):
+    """Запрос в unit of work, который уже откатил один из методов"""
+
+
+class UnitOfWork:
+    """
+    Одно соединение и одна транзакция на весь запрос.
+
+    Методы Database внутри unit of work получают BoundConnection: их
+    commit() ничего не делает, close() не возвращает соединение в пул.
+    Итоговый COMMIT/ROLLBACK выполняется при выходе из контекста.
+
+    rollback() метода откатывает весь unit of work, поэтому после него
+    любой запрос в том же unit of work падает с TransactionRolledBack:
+    следующий метод не отчитается об успехе работы, которая не закоммитится.
+    """
+
+    def __init__(self, conn, is_deadlock):
+        self.conn = conn
+        self.is_deadlock = is_deadlock
+        self.depth = 0
+        self.rollback_only = False
+        self.deadlocked = False
+        self._after_commit = []
+
+    def bound_connection(self):
+        return BoundConnection(self)
+
+    def after_commit(self, fn):
+        """fn будет вызвана только если транзакция успешно закоммитится"""
+        self._after_commit.append(fn)
+
+    def finish(self, failed):
+        """Завершает транзакцию и возвращает соединение в пул"""
+        committed = False
+        try:
+            if failed or self.rollback_only or self.deadlocked:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+                committed = True
+        finally:
+            self.conn.close()
+        if committed:
+            for fn in self._after_commit:
+                fn()
+
+
+class BoundConnection:
+    """Соединение, привязанное к unit of work"""
+
+    def __init__(self, uow):
+        self._uow = uow
+
+    def cursor(self, *args, **kwargs):
+        return TrackingCursor(self._uow, self._uow.conn.cursor(*args, **kwargs))
+
+    def commit(self):
+        # Коммит делает unit of work целиком при выходе
+        pass
+
+    def rollback(self):
+        # Откатываем сразу, чтобы отпустить блокировки, и больше не коммитим
+        self._uow.rollback_only = True
+        self._uow.conn.rollback()
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._uow.conn, name)
+
+
+class TrackingCursor:
+    """
+    Курсор, который запоминает дедлок, даже если метод проглотил исключение,
+    и не выполняет запросы в откаченном unit of work
+    """
+
+    def __init__(self, uow, cursor):
+        self._uow = uow
+        self._cursor = cursor
+
+    def _check(self):
+        if self._uow.rollback_only:
+            raise TransactionRolledBack("Транзакция уже откачена, изменения не будут сохранены")
+
+    def execute(self, *args, **kwargs):
+        self._check()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        except Exception as err:
+            if self._uow.is_deadlock(err):
+                self._uow.deadlocked = True
+            raise
+
+    def executemany(self, *args, **kwargs):
+        self._check()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        except Exception as err:
+            if self._uow.is_deadlock(err):
+                self._uow.deadlocked = True
+            raise
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)